@@ -1,23 +1,112 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, Flask, Response, current_app, make_response, render_template, request, redirect, session, url_for, flash, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+import click
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, timezone
 import os
+import base64
+import bisect
+import collections
 import csv
+import functools
+import hashlib
 import io
-import re
+import itertools
+import json
+import math
+import operator
+import time
+import uuid
+import zlib
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'tu_clave_secreta_aqui'
-# Use a more accessible database path for Linux
-db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "registro_fisico.db")
-os.makedirs(os.path.dirname(db_path), exist_ok=True)
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+import basedatos
+import cache
+import composicion
+import garmin
+import metricas
+import migraciones
+import normas
+import series
+import tendencias
+import trabajos
+from composicion import calcular_edad
 
-db = SQLAlchemy(app)
+# Ruta predeterminada de la base de datos SQLite (DATABASE_URL permite usar otra)
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "registro_fisico.db")
+
+def configuracion_entorno(entorno=os.environ):
+    """Configuración de la aplicación leída de las variables de entorno"""
+    config = {}
+    config['SECRET_KEY'] = entorno.get('SECRET_KEY', 'tu_clave_secreta_aqui')
+    config['SQLALCHEMY_DATABASE_URI'] = entorno.get('DATABASE_URL', f'sqlite:///{DB_PATH}')
+    config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # SQLite con varios procesos: PRAGMA por conexión, pool de conexiones y checkpoint periódico del WAL
+    config['SQLITE_JOURNAL_MODE'] = entorno.get('SQLITE_JOURNAL_MODE', 'WAL')
+    config['SQLITE_SYNCHRONOUS'] = entorno.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    config['SQLITE_CACHE_SIZE'] = int(entorno.get('SQLITE_CACHE_SIZE', -65536))  # negativo: KiB (64 MiB)
+    config['SQLITE_MMAP_SIZE'] = int(entorno.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    config['SQLITE_TEMP_STORE'] = entorno.get('SQLITE_TEMP_STORE', 'MEMORY')
+    config['SQLITE_BUSY_TIMEOUT'] = int(entorno.get('SQLITE_BUSY_TIMEOUT', 10000))  # milisegundos
+    config['SQLITE_WAL_AUTOCHECKPOINT'] = int(entorno.get('SQLITE_WAL_AUTOCHECKPOINT', 1000))  # páginas
+    config['SQLITE_CHECKPOINT_INTERVALO'] = float(entorno.get('SQLITE_CHECKPOINT_INTERVALO', 300))  # segundos, 0 desactiva
+    config['SQLITE_CHECKPOINT_MODO'] = entorno.get('SQLITE_CHECKPOINT_MODO', 'PASSIVE')
+    config['DB_POOL_SIZE'] = int(entorno.get('DB_POOL_SIZE', 5))
+    config['DB_MAX_OVERFLOW'] = int(entorno.get('DB_MAX_OVERFLOW', 10))
+    config['DB_POOL_TIMEOUT'] = float(entorno.get('DB_POOL_TIMEOUT', 30))
+    config['DB_POOL_RECYCLE'] = int(entorno.get('DB_POOL_RECYCLE', 3600))
+    # Verificación de disponibilidad (/readyz): tiempo máximo del ping a la base de datos en segundos
+    config['READYZ_TIMEOUT_DB'] = float(entorno.get('READYZ_TIMEOUT_DB', 2))
+    # Tablas de referencia: directorio adicional con normas propias y población activa ('nombre' o 'nombre@version')
+    config['NORMAS_DIR'] = entorno.get('NORMAS_DIR')
+    config['NORMAS_POBLACION'] = entorno.get('NORMAS_POBLACION', 'aahperd')
+    config['NORMAS_INTERVALO_RECARGA'] = float(entorno.get('NORMAS_INTERVALO_RECARGA', 5))
+    # Exportación CSV: filas leídas por lote y compresión gzip al vuelo
+    config['EXPORTAR_TAMANO_LOTE'] = int(entorno.get('EXPORTAR_TAMANO_LOTE', 1000))
+    config['EXPORTAR_GZIP'] = entorno.get('EXPORTAR_GZIP', '1') == '1'
+    # Importación CSV: filas insertadas por lote (una transacción por lote)
+    config['IMPORTAR_TAMANO_LOTE'] = int(entorno.get('IMPORTAR_TAMANO_LOTE', 1000))
+    # Gestión de usuarios: usuarios por página
+    config['USUARIOS_POR_PAGINA'] = int(entorno.get('USUARIOS_POR_PAGINA', 25))
+    # Historial de registros en estadísticas: opciones de registros por página (la primera es la predeterminada)
+    config['HISTORIAL_POR_PAGINA'] = [int(n) for n in entorno.get('HISTORIAL_POR_PAGINA', '20,10,50,100').split(',')]
+    # API JSON: registros por página (parámetro limit) y máximo permitido
+    config['API_LIMITE_DEFECTO'] = int(entorno.get('API_LIMITE_DEFECTO', 100))
+    config['API_LIMITE_MAXIMO'] = int(entorno.get('API_LIMITE_MAXIMO', 1000))
+    # API de series para gráficos: puntos por defecto y máximo (parámetro puntos, reducción LTTB)
+    config['SERIES_PUNTOS_DEFECTO'] = int(entorno.get('SERIES_PUNTOS_DEFECTO', 500))
+    config['SERIES_PUNTOS_MAXIMO'] = int(entorno.get('SERIES_PUNTOS_MAXIMO', 5000))
+    # Caché de páginas por versión de datos del usuario: 'memoria' (LRU por proceso), 'compartida' (CACHE_URL) o 'ninguna'
+    config['CACHE_BACKEND'] = entorno.get('CACHE_BACKEND', 'memoria')
+    config['CACHE_URL'] = entorno.get('CACHE_URL')  # redis://... o local:// (sustituto en memoria)
+    config['CACHE_MAXIMO'] = int(entorno.get('CACHE_MAXIMO', 512))  # entradas de la caché en memoria
+    config['CACHE_TTL'] = int(entorno.get('CACHE_TTL', 300))  # segundos
+    config['CACHE_PREFIJO'] = entorno.get('CACHE_PREFIJO', 'registro-fisico')
+    # Importaciones en segundo plano: hilos por proceso (0 importa dentro de la petición) y archivos pendientes
+    config['TRABAJOS_HILOS'] = int(entorno.get('TRABAJOS_HILOS', 2))
+    config['TRABAJOS_DIRECTORIO'] = entorno.get('TRABAJOS_DIRECTORIO', os.path.join(os.path.dirname(DB_PATH), 'trabajos'))
+    # Segundos sin latido tras los que un trabajo activo se da por interrumpido
+    config['TRABAJOS_LATIDO_LIMITE'] = int(entorno.get('TRABAJOS_LATIDO_LIMITE', 300))
+    # Métricas en /metrics (formato Prometheus); con varios workers, directorio donde combinan su estado
+    config['METRICAS_HABILITADAS'] = entorno.get('METRICAS_HABILITADAS', '1') == '1'
+    config['METRICAS_DIRECTORIO'] = entorno.get('METRICAS_DIRECTORIO')
+    config['METRICAS_INTERVALO'] = float(entorno.get('METRICAS_INTERVALO', 5))  # segundos entre escrituras del estado
+    # Registro de peticiones lentas con sus consultas SQL: umbral en segundos (0 lo desactiva)
+    config['METRICAS_PETICION_LENTA'] = float(entorno.get('METRICAS_PETICION_LENTA', 0))
+    config['METRICAS_MAXIMO_SENTENCIAS'] = int(entorno.get('METRICAS_MAXIMO_SENTENCIAS', 20))
+    return config
+
+db = SQLAlchemy()
+# Rutas y comandos de la aplicación (los comandos quedan en el grupo principal de "flask")
+bp = Blueprint('main', __name__, cli_group=None)
 
 # Modelos de datos
 class Usuario(db.Model):
+    __table_args__ = (
+        db.Index('ix_usuario_activo', 'activo'),
+        db.Index('ix_usuario_nombre_apellido', 'nombre', 'apellido'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     apellido = db.Column(db.String(100), nullable=False)
@@ -26,18 +115,109 @@ class Usuario(db.Model):
     altura = db.Column(db.Float)  # Altura en metros para reutilizar en registros
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     activo = db.Column(db.Boolean, default=True)
+    # Última modificación de sus registros (validadores ETag/Last-Modified de la API)
+    datos_modificados = db.Column(db.DateTime, default=datetime.utcnow)
+    # Versión de sus datos, incrementada en cada escritura (clave de la caché de páginas)
+    version_datos = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
-    # Relación con registros físicos
+    # Relación con registros físicos (carga perezosa: para listas de usuarios usar con_registros())
     registros = db.relationship('RegistroFisico', backref='usuario', lazy=True, cascade='all, delete-orphan')
+    agregado = db.relationship('AgregadoUsuario', uselist=False, lazy=True, cascade='all, delete-orphan')
+    tendencias = db.relationship('TendenciaUsuario', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Usuario {self.nombre} {self.apellido}>'
     
+    @classmethod
+    def con_registros(cls):
+        """Opción de consulta que carga los registros de todos los usuarios en una consulta adicional"""
+        return db.selectinload(cls.registros)
+    
+    @classmethod
+    def con_agregado(cls):
+        """Opción de consulta que carga las estadísticas acumuladas de todos los usuarios en una consulta adicional"""
+        return db.selectinload(cls.agregado)
+    
     @property
     def nombre_completo(self):
         return f"{self.nombre} {self.apellido}"
+    
+    @property
+    def num_registros(self):
+        """Cantidad de registros (de las estadísticas acumuladas, sin cargar los registros)"""
+        if self.agregado is not None:
+            return self.agregado.total_registros
+        return db.session.scalar(db.select(db.func.count(RegistroFisico.id)).filter_by(usuario_id=self.id))
+    
+    @property
+    def ultimo_registro_fecha(self):
+        """Fecha del registro más reciente (None si no tiene registros)"""
+        if self.agregado is not None:
+            return self.agregado.ultima_fecha
+        return db.session.scalar(db.select(db.func.max(RegistroFisico.fecha)).filter_by(usuario_id=self.id))
+    
+    def registrar_cambio_datos(self):
+        """Marca que cambiaron los datos del usuario, sus registros o sus métricas"""
+        self.datos_modificados = datetime.utcnow()
+        # Incremento en SQL: dos escrituras concurrentes nunca comparten versión
+        self.version_datos = Usuario.version_datos + 1
+
+class CalculosRegistro:
+    """
+    Cálculos y clasificaciones de un registro a partir de sus valores guardados,
+    compartidos por el modelo (RegistroFisico) y el modelo de lectura (RegistroLite).
+    """
+    __slots__ = ()
+    
+    def clasificacion_imc(self):
+        """Retorna la clasificación del IMC"""
+        return composicion.clasificacion_imc(self.imc)
+    
+    def sumatoria_pliegues(self):
+        """Calcula la sumatoria de pliegues usando los promedios"""
+        pliegues = [
+            self.pliegue_tricipital_promedio or 0,
+            self.pliegue_subescapular_promedio or 0,
+            self.pliegue_suprailiaco_promedio or 0,
+            self.pliegue_abdominal_promedio or 0,
+            self.pliegue_muslo_anterior_promedio or 0,
+            self.pliegue_pantorrilla_promedio or 0
+        ]
+        return sum(pliegues)
+    
+    def calcular_porcentaje_grasa(self):
+        """Porcentaje de grasa corporal (Durnin-Womersley) guardado para el registro"""
+        return self.porcentaje_grasa
+    
+    def clasificar_grasa_corporal(self):
+        """Clasifica el nivel de grasa corporal según estándares"""
+        return composicion.clasificacion_grasa(self.nivel_grasa)
+    
+    def calcular_spc_aaherd(self):
+        """Suma de Pliegues Cutáneos según método AAHPERD para población universitaria"""
+        return self.spc
+    
+    def calcular_percentila_spc_aaherd(self):
+        """Percentila de SPC según tablas oficiales AAHPERD para población universitaria"""
+        return self.percentila_spc
+    
+    def calcular_percentila_grasa(self):
+        """Percentila de grasa corporal según edad y género"""
+        return self.percentila_grasa
+    
+    def calcular_progreso_grasa(self):
+        """Progreso hacia el siguiente nivel de clasificación (objetivo guardado junto con el nivel)"""
+        return composicion.progreso_grasa(self.nivel_grasa, self.objetivo_grasa, self.diferencia_grasa)
+    
+    def clasificar_spc_aaherd(self):
+        """Clasifica el SPC según estándares AAHPERD para población universitaria"""
+        return composicion.clasificacion_spc(self.nivel_spc)
+    
+    def obtener_interpretacion_motivacional(self):
+        """Obtiene interpretación motivacional basada en percentilas AAHPERD"""
+        return composicion.interpretacion_motivacional(self.calcular_percentila_spc_aaherd())
 
-class RegistroFisico(db.Model):
+class RegistroFisico(CalculosRegistro, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
     fecha = db.Column(db.DateTime, default=datetime.utcnow)
@@ -45,6 +225,77 @@ class RegistroFisico(db.Model):
     altura = db.Column(db.Float, nullable=False)
     imc = db.Column(db.Float, nullable=False)
     
+    # Pliegues, circunferencias y observaciones (fila de medidas_registro, solo si el registro las tiene)
+    medidas = db.relationship('MedidasRegistro', uselist=False, lazy='select', cascade='all, delete-orphan')
+    
+    # Métricas derivadas (materializadas al guardar, con la edad a la fecha de medición).
+    # Se cargan juntas y solo cuando se usan: los listados muestran únicamente los datos básicos
+    edad_en_medicion = db.deferred(db.Column(db.Integer), group='metricas')
+    porcentaje_grasa = db.deferred(db.Column(db.Float), group='metricas')
+    percentila_grasa = db.deferred(db.Column(db.Integer), group='metricas')
+    nivel_grasa = db.deferred(db.Column(db.Integer), group='metricas')  # Índice en composicion.NIVELES_GRASA
+    objetivo_grasa = db.deferred(db.Column(db.Float), group='metricas')  # Límite del nivel (mismas normas que nivel_grasa)
+    diferencia_grasa = db.deferred(db.Column(db.Float), group='metricas')
+    spc = db.deferred(db.Column(db.Float), group='metricas')
+    percentila_spc = db.deferred(db.Column(db.Integer), group='metricas')
+    nivel_spc = db.deferred(db.Column(db.Integer), group='metricas')  # Índice en composicion.NIVELES_SPC
+    
+    @classmethod
+    def con_grupos(cls, *grupos):
+        """
+        Opciones de consulta que cargan los datos básicos y solo los grupos de
+        columnas pedidos (claves de GRUPOS_REGISTRO); las medidas de los grupos
+        pedidos se cargan con un JOIN en la misma consulta.
+        """
+        desconocidos = [g for g in grupos if g not in GRUPOS_REGISTRO]
+        if desconocidos:
+            raise ValueError(f"Grupos de columnas desconocidos: {', '.join(desconocidos)}")
+        nombres = [n for g in dict.fromkeys(('basicos', *grupos)) for n in GRUPOS_REGISTRO[g]]
+        opciones = [db.load_only(*[getattr(cls, n) for n in nombres if n in cls.__table__.c])]
+        medidas = [getattr(MedidasRegistro, n) for n in nombres if n not in cls.__table__.c]
+        if medidas:
+            opciones.append(db.joinedload(cls.medidas).load_only(*medidas))
+        return opciones
+
+    def calcular_imc(self):
+        """Calcula el IMC basado en peso y altura"""
+        if self.altura > 0:
+            return round(self.peso / (self.altura ** 2), 2)
+        return 0
+    
+    def calcular_metricas(self):
+        """Calcula las métricas derivadas del registro con el motor de composición corporal"""
+        edad = calcular_edad(self.usuario.fecha_nacimiento, self.fecha) if self.usuario else None
+        genero = self.usuario.genero if self.usuario else None
+        return composicion.calcular_registro(
+            self.pliegue_tricipital_promedio,
+            self.pliegue_subescapular_promedio,
+            self.pliegue_suprailiaco_promedio,
+            self.pliegue_abdominal_promedio,
+            edad,
+            genero
+        )
+    
+    def actualizar_metricas(self, usuario=None):
+        """Recalcula y guarda las métricas derivadas del registro"""
+        materializar_metricas([self], usuario or self.usuario)
+
+# Consultas por usuario ordenadas por fecha descendente; un único registro por usuario y fecha/hora
+db.Index('ix_registro_usuario_fecha', RegistroFisico.usuario_id, RegistroFisico.fecha.desc(), unique=True)
+
+class MedidasRegistro(db.Model):
+    """
+    Medidas antropométricas de un registro: pliegues, circunferencias y observaciones.
+    
+    La mayoría de los registros son pesajes (importados de Garmin) sin estas
+    medidas, por lo que se guardan aparte y solo para los registros que tienen
+    alguna: los pesajes quedan como filas angostas de registro_fisico. Cada
+    columna se lee y se escribe desde RegistroFisico con su nombre de siempre.
+    """
+    __tablename__ = 'medidas_registro'
+    
+    registro_id = db.Column(db.Integer, db.ForeignKey('registro_fisico.id', ondelete='CASCADE'), primary_key=True)
+    
     # Pliegues cutáneos (en mm) - 3 mediciones individuales + promedio
     # Tricipital
     pliegue_tricipital_1 = db.Column(db.Float)
@@ -95,781 +346,1427 @@ class RegistroFisico(db.Model):
     # Observaciones
     observaciones = db.Column(db.Text)
 
-    def calcular_imc(self):
-        """Calcula el IMC basado en peso y altura"""
-        if self.altura > 0:
-            return round(self.peso / (self.altura ** 2), 2)
-        return 0
+    def vacia(self):
+        """Indica si no queda ninguna medida cargada"""
+        return all(getattr(self, nombre) in (None, '') for nombre in COLUMNAS_MEDIDAS)
 
-    def clasificacion_imc(self):
-        """Retorna la clasificación del IMC"""
-        if self.imc < 18.5:
-            return "Bajo peso"
-        elif self.imc < 25:
-            return "Peso normal"
-        elif self.imc < 30:
-            return "Sobrepeso"
-        else:
-            return "Obesidad"
+# Columnas de medidas_registro, en el orden del CSV
+COLUMNAS_PLIEGUES = [c.name for c in MedidasRegistro.__table__.c if c.name.startswith('pliegue_')]
+COLUMNAS_CIRCUNFERENCIAS = [c.name for c in MedidasRegistro.__table__.c if c.name.startswith('circunferencia_')]
+COLUMNAS_MEDIDAS = COLUMNAS_PLIEGUES + COLUMNAS_CIRCUNFERENCIAS + ['observaciones']
+_CLAVES_MEDIDAS = frozenset(COLUMNAS_MEDIDAS)
 
-    def sumatoria_pliegues(self):
-        """Calcula la sumatoria de pliegues usando los promedios"""
-        pliegues = [
-            self.pliegue_tricipital_promedio or 0,
-            self.pliegue_subescapular_promedio or 0,
-            self.pliegue_suprailiaco_promedio or 0,
-            self.pliegue_abdominal_promedio or 0,
-            self.pliegue_muslo_anterior_promedio or 0,
-            self.pliegue_pantorrilla_promedio or 0
+# Grupos de columnas de un registro que las vistas y la API piden por nombre
+GRUPOS_REGISTRO = {
+    'basicos': ['id', 'usuario_id', 'fecha', 'peso', 'altura', 'imc'],
+    'pliegues': COLUMNAS_PLIEGUES,
+    'circunferencias': COLUMNAS_CIRCUNFERENCIAS,
+    'metricas': ['edad_en_medicion', 'porcentaje_grasa', 'percentila_grasa', 'nivel_grasa',
+                 'objetivo_grasa', 'diferencia_grasa', 'spc', 'percentila_spc', 'nivel_spc'],
+    'observaciones': ['observaciones'],
+}
+
+def consultar_registros(*grupos):
+    """Consulta de registros que carga solo los datos básicos y los grupos de columnas pedidos"""
+    return RegistroFisico.query.options(*RegistroFisico.con_grupos(*grupos))
+
+def _atributo_medida(nombre):
+    """
+    Propiedad de RegistroFisico para una columna de sus medidas: lee None si el
+    registro no tiene medidas, crea la fila de medidas al asignar el primer
+    valor y la descarta cuando todas sus medidas quedan vacías.
+    """
+    def leer(registro):
+        medidas = registro.medidas
+        return getattr(medidas, nombre) if medidas is not None else None
+    
+    def escribir(registro, valor):
+        medidas = registro.medidas
+        if medidas is None:
+            if valor is None or valor == '':
+                return
+            medidas = registro.medidas = MedidasRegistro()
+        setattr(medidas, nombre, valor)
+        if medidas.vacia():
+            registro.medidas = None
+    
+    return property(leer, escribir)
+
+for _nombre in COLUMNAS_MEDIDAS:
+    setattr(RegistroFisico, _nombre, _atributo_medida(_nombre))
+
+def seleccionar_registros(nombres):
+    """
+    SELECT de columnas de registros por nombre, sean de registro_fisico o de
+    medidas_registro; la tabla de medidas se une (LEFT JOIN) solo si se pide
+    alguna de sus columnas.
+    """
+    registros = RegistroFisico.__table__
+    medidas = MedidasRegistro.__table__
+    consulta = db.select(*[registros.c[n] if n in registros.c else medidas.c[n] for n in nombres])
+    if any(n not in registros.c for n in nombres):
+        consulta = consulta.select_from(registros.outerjoin(medidas, medidas.c.registro_id == registros.c.id))
+    return consulta
+
+class RegistroLite(CalculosRegistro):
+    """
+    Registro de solo lectura para las lecturas masivas (exportación, API y
+    estadísticas): una tupla con nombre con las columnas consultadas, sin
+    objetos ORM ni seguimiento de cambios, con los mismos cálculos que
+    RegistroFisico. ``tipo`` crea (una vez por combinación de columnas) la
+    clase para las filas de un SELECT.
+    """
+    __slots__ = ()
+    _tipos = {}
+    
+    @classmethod
+    def tipo(cls, nombres):
+        """Clase de RegistroLite con los campos ``nombres`` (en el orden de las columnas)"""
+        nombres = tuple(nombres)
+        tipo = cls._tipos.get(nombres)
+        if tipo is None:
+            base = collections.namedtuple('RegistroLite', nombres)
+            tipo = cls._tipos[nombres] = type('RegistroLite', (base, cls), {'__slots__': ()})
+        return tipo
+    
+    def valores_csv(self):
+        """Valores de la fila del CSV de registros (COLUMNAS_CSV_MEDIDAS y COLUMNAS_CSV_DERIVADAS)"""
+        porcentaje_grasa = self.porcentaje_grasa
+        spc = self.spc
+        return [
+            self.fecha.strftime('%Y-%m-%d %H:%M:%S'),
+            self.peso,
+            self.altura,
+            self.imc,
+            *[valor or '' for valor in _medidas_csv(self)],
+            round(porcentaje_grasa, 2) if porcentaje_grasa else '',
+            round(spc, 2) if spc else '',
+            self.percentila_spc or '',
+            composicion.clasificacion_spc(self.nivel_spc)[0] or ''
         ]
-        return sum(pliegues)
+
+def leer_registros(consulta):
+    """Ejecuta un SELECT de columnas de registros y retorna sus filas como RegistroLite"""
+    resultado = db.session.execute(consulta)
+    return list(map(RegistroLite.tipo(resultado.keys())._make, resultado))
+
+class AgregadoUsuario(db.Model):
+    """
+    Estadísticas acumuladas de los registros de un usuario.
     
-    def calcular_porcentaje_grasa(self):
-        """Calcula el porcentaje de grasa corporal usando la fórmula de Durnin-Womersley"""
-        if not self.usuario:
-            return None
-            
-        # Obtener edad del usuario
-        if not self.usuario.fecha_nacimiento:
-            return None
-            
-        from datetime import datetime
-        hoy = datetime.now().date()
-        edad = hoy.year - self.usuario.fecha_nacimiento.year
-        if hoy.month < self.usuario.fecha_nacimiento.month or \
-           (hoy.month == self.usuario.fecha_nacimiento.month and hoy.day < self.usuario.fecha_nacimiento.day):
-            edad -= 1
-        
-        # Sumatoria de 4 pliegues (tricipital, subescapular, suprailíaco, abdominal)
-        suma_4_pliegues = (
-            (self.pliegue_tricipital_promedio or 0) +
-            (self.pliegue_subescapular_promedio or 0) +
-            (self.pliegue_suprailiaco_promedio or 0) +
-            (self.pliegue_abdominal_promedio or 0)
-        )
-        
-        if suma_4_pliegues == 0:
-            return None
-        
-        # Fórmula de Durnin-Womersley
-        if self.usuario.genero == 'M':
-            # Fórmula para hombres
-            if edad >= 16 and edad <= 19:
-                densidad = 1.1620 - 0.0630 * (suma_4_pliegues / 10)
-            elif edad >= 20 and edad <= 29:
-                densidad = 1.1631 - 0.0632 * (suma_4_pliegues / 10)
-            elif edad >= 30 and edad <= 39:
-                densidad = 1.1422 - 0.0544 * (suma_4_pliegues / 10)
-            elif edad >= 40 and edad <= 49:
-                densidad = 1.1620 - 0.0700 * (suma_4_pliegues / 10)
-            elif edad >= 50:
-                densidad = 1.1715 - 0.0779 * (suma_4_pliegues / 10)
-            else:
-                return None
-        else:
-            # Fórmula para mujeres
-            if edad >= 16 and edad <= 19:
-                densidad = 1.1549 - 0.0678 * (suma_4_pliegues / 10)
-            elif edad >= 20 and edad <= 29:
-                densidad = 1.1599 - 0.0717 * (suma_4_pliegues / 10)
-            elif edad >= 30 and edad <= 39:
-                densidad = 1.1423 - 0.0632 * (suma_4_pliegues / 10)
-            elif edad >= 40 and edad <= 49:
-                densidad = 1.1333 - 0.0612 * (suma_4_pliegues / 10)
-            elif edad >= 50:
-                densidad = 1.1339 - 0.0645 * (suma_4_pliegues / 10)
-            else:
-                return None
-        
-        # Convertir densidad a porcentaje de grasa usando la ecuación de Siri
-        if densidad > 0:
-            porcentaje_grasa = ((4.95 / densidad) - 4.50) * 100
-            return round(porcentaje_grasa, 1)
-        
-        return None
+    Se actualizan en la misma transacción que cada alta, edición, baja o
+    importación de registros (ver ``actualizar_agregado``), de modo que la
+    página de estadísticas no recorre el historial. ``flask reparar-agregados``
+    los reconstruye desde los registros.
+    """
+    __tablename__ = 'agregado_usuario'
     
-    def clasificar_grasa_corporal(self):
-        """Clasifica el nivel de grasa corporal según estándares"""
-        porcentaje = self.calcular_porcentaje_grasa()
-        if not porcentaje or not self.usuario:
-            return None, None
-            
-        edad = self.usuario.fecha_nacimiento
-        if not edad:
-            return None, None
-            
-        from datetime import datetime
-        hoy = datetime.now().date()
-        edad_anos = hoy.year - edad.year
-        if hoy.month < edad.month or (hoy.month == edad.month and hoy.day < edad.day):
-            edad_anos -= 1
-        
-        if self.usuario.genero == 'M':
-            # Clasificación para hombres
-            if edad_anos >= 18 and edad_anos <= 39:
-                if porcentaje < 8:
-                    return "Muy Bajo", "danger"
-                elif porcentaje < 11:
-                    return "Bajo", "warning"
-                elif porcentaje < 14:
-                    return "Aceptable", "info"
-                elif porcentaje < 18:
-                    return "Promedio", "success"
-                elif porcentaje < 25:
-                    return "Alto", "warning"
-                else:
-                    return "Muy Alto", "danger"
-            elif edad_anos >= 40 and edad_anos <= 59:
-                if porcentaje < 11:
-                    return "Muy Bajo", "danger"
-                elif porcentaje < 14:
-                    return "Bajo", "warning"
-                elif porcentaje < 17:
-                    return "Aceptable", "info"
-                elif porcentaje < 22:
-                    return "Promedio", "success"
-                elif porcentaje < 28:
-                    return "Alto", "warning"
-                else:
-                    return "Muy Alto", "danger"
-            else:  # 60+
-                if porcentaje < 13:
-                    return "Muy Bajo", "danger"
-                elif porcentaje < 16:
-                    return "Bajo", "warning"
-                elif porcentaje < 20:
-                    return "Aceptable", "info"
-                elif porcentaje < 25:
-                    return "Promedio", "success"
-                elif porcentaje < 30:
-                    return "Alto", "warning"
-                else:
-                    return "Muy Alto", "danger"
-        else:
-            # Clasificación para mujeres
-            if edad_anos >= 18 and edad_anos <= 39:
-                if porcentaje < 16:
-                    return "Muy Bajo", "danger"
-                elif porcentaje < 20:
-                    return "Bajo", "warning"
-                elif porcentaje < 22:
-                    return "Aceptable", "info"
-                elif porcentaje < 25:
-                    return "Promedio", "success"
-                elif porcentaje < 32:
-                    return "Alto", "warning"
-                else:
-                    return "Muy Alto", "danger"
-            elif edad_anos >= 40 and edad_anos <= 59:
-                if porcentaje < 20:
-                    return "Muy Bajo", "danger"
-                elif porcentaje < 24:
-                    return "Bajo", "warning"
-                elif porcentaje < 26:
-                    return "Aceptable", "info"
-                elif porcentaje < 30:
-                    return "Promedio", "success"
-                elif porcentaje < 35:
-                    return "Alto", "warning"
-                else:
-                    return "Muy Alto", "danger"
-            else:  # 60+
-                if porcentaje < 22:
-                    return "Muy Bajo", "danger"
-                elif porcentaje < 26:
-                    return "Bajo", "warning"
-                elif porcentaje < 29:
-                    return "Aceptable", "info"
-                elif porcentaje < 33:
-                    return "Promedio", "success"
-                elif porcentaje < 38:
-                    return "Alto", "warning"
-                else:
-                    return "Muy Alto", "danger"
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), primary_key=True)
+    total_registros = db.Column(db.Integer, nullable=False, default=0)
+    suma_peso = db.Column(db.Float, nullable=False, default=0)
+    peso_minimo = db.Column(db.Float)
+    peso_maximo = db.Column(db.Float)
+    suma_imc = db.Column(db.Float, nullable=False, default=0)
+    # Solo se cuentan los registros con porcentaje de grasa o SPC calculados (distintos de 0)
+    registros_grasa = db.Column(db.Integer, nullable=False, default=0)
+    suma_grasa = db.Column(db.Float, nullable=False, default=0)
+    registros_spc = db.Column(db.Integer, nullable=False, default=0)
+    suma_spc = db.Column(db.Float, nullable=False, default=0)
+    # Primer y último registro (por fecha) y último porcentaje de grasa calculado
+    primera_fecha = db.Column(db.DateTime)
+    peso_inicial = db.Column(db.Float)
+    ultimo_registro_id = db.Column(db.Integer)
+    ultima_fecha = db.Column(db.DateTime)
+    peso_actual = db.Column(db.Float)
+    fecha_ultima_grasa = db.Column(db.DateTime)
+    ultima_grasa = db.Column(db.Float)
     
-    def calcular_spc_aaherd(self):
-        """Calcula la Suma de Pliegues Cutáneos según método AAHPERD para población universitaria"""
-        if not self.pliegue_tricipital_promedio or not self.pliegue_subescapular_promedio:
-            return None
-        return self.pliegue_tricipital_promedio + self.pliegue_subescapular_promedio
+    def __repr__(self):
+        return f'<AgregadoUsuario {self.usuario_id}: {self.total_registros} registros>'
     
-    def calcular_percentila_spc_aaherd(self):
-        """Calcula la percentila de SPC según tablas oficiales AAHPERD para población universitaria"""
-        spc = self.calcular_spc_aaherd()
-        if not spc or not self.usuario:
-            return None
-            
-        edad = self.usuario.fecha_nacimiento
-        if not edad:
-            return None
-            
-        from datetime import datetime
-        hoy = datetime.now().date()
-        edad_anos = hoy.year - edad.year
-        if hoy.month < edad.month or (hoy.month == edad.month and hoy.day < edad.day):
-            edad_anos -= 1
-        
-        # Tablas oficiales AAHPERD para población universitaria (Tríceps + Subescapular)
-        if self.usuario.genero == 'M':
-            # Hombres universitarios (18-25 años) - Tabla AAHPERD
-            if edad_anos >= 18 and edad_anos <= 25:
-                # Percentilas: 5, 10, 25, 50, 75, 90, 95
-                spc_percentiles = [8, 10, 13, 17, 22, 28, 32]
-            else:
-                # Para edades fuera del rango universitario, usar aproximación
-                spc_percentiles = [10, 12, 15, 19, 24, 30, 34]
-        else:
-            # Mujeres universitarias (18-25 años) - Tabla AAHPERD
-            if edad_anos >= 18 and edad_anos <= 25:
-                # Percentilas: 5, 10, 25, 50, 75, 90, 95
-                spc_percentiles = [12, 15, 19, 24, 30, 37, 42]
-            else:
-                # Para edades fuera del rango universitario, usar aproximación
-                spc_percentiles = [14, 17, 21, 26, 32, 39, 44]
-        
-        # Determinar percentila basada en SPC
-        if spc <= spc_percentiles[0]:
-            return 5
-        elif spc <= spc_percentiles[1]:
-            return 10
-        elif spc <= spc_percentiles[2]:
-            return 25
-        elif spc <= spc_percentiles[3]:
-            return 50
-        elif spc <= spc_percentiles[4]:
-            return 75
-        elif spc <= spc_percentiles[5]:
-            return 90
-        else:
-            return 95
+    @property
+    def peso_promedio(self):
+        return self.suma_peso / self.total_registros if self.total_registros else None
     
-    def calcular_percentila_grasa(self):
-        """Calcula la percentila de grasa corporal según edad y género"""
-        porcentaje = self.calcular_porcentaje_grasa()
-        if not porcentaje or not self.usuario:
-            return None
-            
-        edad = self.usuario.fecha_nacimiento
-        if not edad:
-            return None
-            
-        from datetime import datetime
-        hoy = datetime.now().date()
-        edad_anos = hoy.year - edad.year
-        if hoy.month < edad.month or (hoy.month == edad.month and hoy.day < edad.day):
-            edad_anos -= 1
-        
-        # Tablas de percentilas basadas en estudios poblacionales
-        if self.usuario.genero == 'M':
-            # Percentilas para hombres (aproximadas)
-            if edad_anos >= 18 and edad_anos <= 39:
-                percentilas = [5, 8, 11, 14, 18, 25, 35]
-            elif edad_anos >= 40 and edad_anos <= 59:
-                percentilas = [8, 11, 14, 17, 22, 28, 38]
-            else:  # 60+
-                percentilas = [10, 13, 16, 20, 25, 30, 40]
-        else:
-            # Percentilas para mujeres (aproximadas)
-            if edad_anos >= 18 and edad_anos <= 39:
-                percentilas = [12, 16, 20, 22, 25, 32, 42]
-            elif edad_anos >= 40 and edad_anos <= 59:
-                percentilas = [16, 20, 24, 26, 30, 35, 45]
-            else:  # 60+
-                percentilas = [18, 22, 26, 29, 33, 38, 48]
-        
-        # Determinar percentila
-        if porcentaje <= percentilas[0]:
-            return 5
-        elif porcentaje <= percentilas[1]:
-            return 10
-        elif porcentaje <= percentilas[2]:
-            return 25
-        elif porcentaje <= percentilas[3]:
-            return 50
-        elif porcentaje <= percentilas[4]:
-            return 75
-        elif porcentaje <= percentilas[5]:
-            return 90
-        else:
-            return 95
+    @property
+    def imc_promedio(self):
+        return self.suma_imc / self.total_registros if self.total_registros else None
     
-    def calcular_progreso_grasa(self):
-        """Calcula el progreso hacia el siguiente nivel de clasificación"""
-        porcentaje = self.calcular_porcentaje_grasa()
-        if not porcentaje or not self.usuario:
-            return None, None, None, None
-            
-        edad = self.usuario.fecha_nacimiento
-        if not edad:
-            return None, None, None, None
-            
-        from datetime import datetime
-        hoy = datetime.now().date()
-        edad_anos = hoy.year - edad.year
-        if hoy.month < edad.month or (hoy.month == edad.month and hoy.day < edad.day):
-            edad_anos -= 1
-        
-        # Definir rangos por edad y género
-        if self.usuario.genero == 'M':
-            if edad_anos >= 18 and edad_anos <= 39:
-                rangos = [8, 11, 14, 18, 25, 35]
-            elif edad_anos >= 40 and edad_anos <= 59:
-                rangos = [11, 14, 17, 22, 28, 38]
-            else:  # 60+
-                rangos = [13, 16, 20, 25, 30, 40]
-        else:
-            if edad_anos >= 18 and edad_anos <= 39:
-                rangos = [16, 20, 22, 25, 32, 42]
-            elif edad_anos >= 40 and edad_anos <= 59:
-                rangos = [20, 24, 26, 30, 35, 45]
-            else:  # 60+
-                rangos = [22, 26, 29, 33, 38, 48]
-        
-        # Determinar nivel actual y siguiente
-        nivel_actual = None
-        nivel_siguiente = None
-        porcentaje_objetivo = None
-        diferencia = None
-        
-        if porcentaje < rangos[0]:
-            nivel_actual = "Muy Bajo"
-            nivel_siguiente = "Bajo"
-            porcentaje_objetivo = rangos[0]
-            diferencia = rangos[0] - porcentaje
-        elif porcentaje < rangos[1]:
-            nivel_actual = "Bajo"
-            nivel_siguiente = "Aceptable"
-            porcentaje_objetivo = rangos[1]
-            diferencia = rangos[1] - porcentaje
-        elif porcentaje < rangos[2]:
-            nivel_actual = "Aceptable"
-            nivel_siguiente = "Promedio"
-            porcentaje_objetivo = rangos[2]
-            diferencia = rangos[2] - porcentaje
-        elif porcentaje < rangos[3]:
-            nivel_actual = "Promedio"
-            nivel_siguiente = "Alto"
-            porcentaje_objetivo = rangos[3]
-            diferencia = rangos[3] - porcentaje
-        elif porcentaje < rangos[4]:
-            nivel_actual = "Alto"
-            nivel_siguiente = "Muy Alto"
-            porcentaje_objetivo = rangos[4]
-            diferencia = rangos[4] - porcentaje
-        else:
-            nivel_actual = "Muy Alto"
-            nivel_siguiente = None
-            porcentaje_objetivo = None
-            diferencia = None
-        
-        return nivel_actual, nivel_siguiente, porcentaje_objetivo, diferencia
+    @property
+    def grasa_promedio(self):
+        return self.suma_grasa / self.registros_grasa if self.registros_grasa else None
     
-    def clasificar_spc_aaherd(self):
-        """Clasifica el SPC según estándares AAHPERD para población universitaria"""
-        spc = self.calcular_spc_aaherd()
-        if not spc or not self.usuario:
-            return None, None
-            
-        edad = self.usuario.fecha_nacimiento
-        if not edad:
-            return None, None
-            
-        from datetime import datetime
-        hoy = datetime.now().date()
-        edad_anos = hoy.year - edad.year
-        if hoy.month < edad.month or (hoy.month == edad.month and hoy.day < edad.day):
-            edad_anos -= 1
-        
-        # Clasificación AAHPERD para población universitaria (18-25 años)
-        if edad_anos >= 18 and edad_anos <= 25:
-            if self.usuario.genero == 'M':
-                # Hombres universitarios
-                if spc <= 10:
-                    return "Excelente", "success"
-                elif spc <= 13:
-                    return "Muy Bueno", "info"
-                elif spc <= 17:
-                    return "Bueno", "primary"
-                elif spc <= 22:
-                    return "Promedio", "warning"
-                elif spc <= 28:
-                    return "Bajo Promedio", "warning"
-                else:
-                    return "Necesita Mejora", "danger"
-            else:
-                # Mujeres universitarias
-                if spc <= 15:
-                    return "Excelente", "success"
-                elif spc <= 19:
-                    return "Muy Bueno", "info"
-                elif spc <= 24:
-                    return "Bueno", "primary"
-                elif spc <= 30:
-                    return "Promedio", "warning"
-                elif spc <= 37:
-                    return "Bajo Promedio", "warning"
-                else:
-                    return "Necesita Mejora", "danger"
-        else:
-            # Para edades fuera del rango universitario, usar clasificación general
-            if self.usuario.genero == 'M':
-                if spc <= 12:
-                    return "Excelente", "success"
-                elif spc <= 15:
-                    return "Muy Bueno", "info"
-                elif spc <= 19:
-                    return "Bueno", "primary"
-                elif spc <= 24:
-                    return "Promedio", "warning"
-                elif spc <= 30:
-                    return "Bajo Promedio", "warning"
-                else:
-                    return "Necesita Mejora", "danger"
-            else:
-                if spc <= 17:
-                    return "Excelente", "success"
-                elif spc <= 21:
-                    return "Muy Bueno", "info"
-                elif spc <= 26:
-                    return "Bueno", "primary"
-                elif spc <= 32:
-                    return "Promedio", "warning"
-                elif spc <= 39:
-                    return "Bajo Promedio", "warning"
-                else:
-                    return "Necesita Mejora", "danger"
+    @property
+    def spc_promedio(self):
+        return self.suma_spc / self.registros_spc if self.registros_spc else None
+
+class TendenciaUsuario(db.Model):
+    """
+    Estado incremental de la tendencia de una métrica de un usuario.
     
-    def obtener_interpretacion_motivacional(self):
-        """Obtiene interpretación motivacional basada en percentilas AAHPERD"""
-        percentila_spc = self.calcular_percentila_spc_aaherd()
-        if not percentila_spc:
-            return None, None, None
-            
-        if percentila_spc <= 5:
-            mensaje = "¡Excelente! Estás en el top 5% de la población universitaria. Tu composición corporal es excepcional."
-            consejo = "Mantén tu rutina actual de ejercicio y alimentación balanceada."
-            color = "success"
-        elif percentila_spc <= 10:
-            mensaje = "¡Muy bien! Estás en el top 10% de la población universitaria. Tu composición corporal es muy buena."
-            consejo = "Continúa con tu estilo de vida saludable y considera agregar entrenamiento de fuerza."
-            color = "info"
-        elif percentila_spc <= 25:
-            mensaje = "¡Bien! Estás por encima del promedio de la población universitaria. Tu composición corporal es buena."
-            consejo = "Mantén el ejercicio regular y considera optimizar tu alimentación."
-            color = "primary"
-        elif percentila_spc <= 50:
-            mensaje = "Estás en el promedio de la población universitaria. Hay espacio para mejorar tu composición corporal."
-            consejo = "Incorpora ejercicio cardiovascular regular y revisa tus hábitos alimentarios."
-            color = "warning"
-        elif percentila_spc <= 75:
-            mensaje = "Estás por debajo del promedio de la población universitaria. Es momento de tomar acción."
-            consejo = "Inicia un programa de ejercicio estructurado y consulta con un nutricionista."
-            color = "warning"
-        elif percentila_spc <= 90:
-            mensaje = "Tu composición corporal está significativamente por debajo del promedio. Es importante actuar ahora."
-            consejo = "Busca asesoría profesional para crear un plan de ejercicio y nutrición personalizado."
-            color = "danger"
-        else:
-            mensaje = "Tu composición corporal está muy por debajo del promedio. Es crucial buscar ayuda profesional."
-            consejo = "Consulta inmediatamente con un médico, nutricionista y entrenador personal certificado."
-            color = "danger"
-            
-        return mensaje, consejo, color
+    Sumas ponderadas exponencialmente por antigüedad respecto de la última
+    medición (ver ``tendencias``): con ellas la EMA, el cambio semanal y la
+    fecha proyectada salen en O(1). Cada registro nuevo las actualiza en la
+    misma transacción que las estadísticas acumuladas; las ediciones y bajas
+    las reconstruyen desde la serie (ver ``actualizar_tendencias``).
+    """
+    __tablename__ = 'tendencia_usuario'
+    
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), primary_key=True)
+    metrica = db.Column(db.String(20), primary_key=True)  # Clave de METRICAS_TENDENCIA
+    registros = db.Column(db.Integer, nullable=False, default=0)
+    # Fecha y valor de la última medición (referencia de las sumas)
+    fecha = db.Column(db.DateTime)
+    valor = db.Column(db.Float)
+    # EMA: suma de pesos y de valores ponderados
+    ponderacion_ema = db.Column(db.Float, nullable=False, default=0)
+    suma_ema = db.Column(db.Float, nullable=False, default=0)
+    # Mínimos cuadrados ponderados (x: días respecto de la última medición)
+    ponderacion = db.Column(db.Float, nullable=False, default=0)
+    suma_x = db.Column(db.Float, nullable=False, default=0)
+    suma_y = db.Column(db.Float, nullable=False, default=0)
+    suma_xx = db.Column(db.Float, nullable=False, default=0)
+    suma_xy = db.Column(db.Float, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<TendenciaUsuario {self.usuario_id} {self.metrica}: {self.registros} registros>'
 
-# Funciones de exportación e importación CSV
-def export_registros_csv(usuario_id):
-    """Exporta los registros de un usuario a formato CSV"""
-    usuario = Usuario.query.get_or_404(usuario_id)
-    registros = RegistroFisico.query.filter_by(usuario_id=usuario_id).order_by(RegistroFisico.fecha.desc()).all()
+class TrabajoImportacion(db.Model):
+    """
+    Importación de un archivo CSV procesada en segundo plano.
+    
+    El archivo subido se guarda en TRABAJOS_DIRECTORIO y un hilo del proceso
+    que lo recibió lo importa por lotes, registrando aquí el progreso después
+    de cada lote (ver ``ejecutar_importacion``). Cada actualización renueva el
+    ``latido`` de los trabajos activos del proceso (``host`` y ``pid``): un
+    trabajo sin latido reciente se da por interrumpido, sea cual sea la
+    máquina que lo consulte (ver ``revisar_trabajo``).
+    """
+    __tablename__ = 'trabajo_importacion'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False, index=True)
+    tipo = db.Column(db.String(20), nullable=False)  # 'registros' (CSV completo) o 'garmin'
+    archivo = db.Column(db.String(255))  # Nombre del archivo subido
+    estado = db.Column(db.String(20), nullable=False, default=trabajos.PENDIENTE)
+    cancelar = db.Column(db.Boolean, nullable=False, default=False)
+    host = db.Column(db.String(255))  # Máquina y proceso que ejecutan el trabajo
+    pid = db.Column(db.Integer)
+    latido = db.Column(db.DateTime)  # Última señal de vida del proceso
+    filas_leidas = db.Column(db.Integer, nullable=False, default=0)
+    importados = db.Column(db.Integer, nullable=False, default=0)
+    duplicados = db.Column(db.Integer, nullable=False, default=0)
+    total_errores = db.Column(db.Integer, nullable=False, default=0)
+    errores = db.Column(db.Text)  # JSON con los primeros errores
+    mensaje = db.Column(db.Text)
+    creado = db.Column(db.DateTime, default=datetime.utcnow)
+    iniciado = db.Column(db.DateTime)
+    finalizado = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<TrabajoImportacion {self.id}: {self.estado}>'
+    
+    @property
+    def terminado(self):
+        return self.estado not in trabajos.ESTADOS_ACTIVOS
+    
+    @property
+    def lista_errores(self):
+        return json.loads(self.errores) if self.errores else []
     
+    def resumen(self):
+        """Estado, progreso y resultado del trabajo para la API"""
+        return {
+            'id': self.id,
+            'usuario_id': self.usuario_id,
+            'tipo': self.tipo,
+            'archivo': self.archivo,
+            'estado': self.estado,
+            'terminado': self.terminado,
+            'cancelacion_pedida': self.cancelar,
+            'filas_leidas': self.filas_leidas,
+            'importados': self.importados,
+            'duplicados': self.duplicados,
+            'total_errores': self.total_errores,
+            'errores': self.lista_errores,
+            'mensaje': self.mensaje,
+            'creado': self.creado.isoformat() if self.creado else None,
+            'iniciado': self.iniciado.isoformat() if self.iniciado else None,
+            'finalizado': self.finalizado.isoformat() if self.finalizado else None,
+        }
+
+# Columnas de métricas derivadas y su clave en el resultado del motor de composición corporal
+COLUMNAS_METRICAS = {
+    'porcentaje_grasa': 'porcentaje_grasa',
+    'percentila_grasa': 'percentila_grasa',
+    'nivel_grasa': 'nivel_grasa',
+    'objetivo_grasa': 'objetivo_grasa',
+    'diferencia_grasa': 'diferencia_grasa',
+    'spc': 'spc',
+    'percentila_spc': 'percentila_spc',
+    'nivel_spc': 'nivel_spc',
+}
+
+def calcular_metricas_lote(pliegues, fechas, usuario):
+    """
+    Calcula las métricas derivadas de registros de un usuario en una sola pasada vectorizada.
+    
+    ``pliegues`` son cuatro secuencias con los promedios tricipital, subescapular,
+    suprailíaco y abdominal; la edad se calcula a la fecha de cada medición.
+    Retorna, para cada registro, un diccionario con los valores de las columnas
+    de métricas (incluida ``edad_en_medicion``). Un único registro (el caso de
+    cada alta o edición) se calcula con ``composicion.calcular_registro``, sin
+    el costo fijo de los arrays.
+    """
+    edades = [calcular_edad(usuario.fecha_nacimiento, fecha) for fecha in fechas]
+    if len(edades) == 1:
+        metricas = composicion.calcular_registro(*(valores[0] for valores in pliegues), edades[0], usuario.genero)
+        return [{'edad_en_medicion': edades[0], **{c: metricas[clave] for c, clave in COLUMNAS_METRICAS.items()}}]
+    listas = composicion.a_listas(composicion.calcular_lote(*pliegues, edades, usuario.genero))
+    nombres = ['edad_en_medicion', *COLUMNAS_METRICAS]
+    columnas = [edades] + [listas[clave] for clave in COLUMNAS_METRICAS.values()]
+    return [dict(zip(nombres, valores)) for valores in zip(*columnas)]
+
+def materializar_metricas(registros, usuario):
+    """Calcula y asigna las métricas derivadas a una lista de registros de un usuario"""
     if not registros:
-        return None
+        return
+    pliegues = (
+        [r.pliegue_tricipital_promedio for r in registros],
+        [r.pliegue_subescapular_promedio for r in registros],
+        [r.pliegue_suprailiaco_promedio for r in registros],
+        [r.pliegue_abdominal_promedio for r in registros],
+    )
+    metricas = calcular_metricas_lote(pliegues, [r.fecha for r in registros], usuario)
+    for registro, valores in zip(registros, metricas):
+        for columna, valor in valores.items():
+            setattr(registro, columna, valor)
+
+def recalcular_metricas_usuario(usuario, tamano_lote=5000):
+    """
+    Recalcula las métricas guardadas de todos los registros de un usuario.
+    
+    Lee solo las columnas necesarias y escribe con actualizaciones masivas por
+    clave primaria. Se usa cuando cambian la fecha de nacimiento o el género
+    del usuario, o las tablas de referencia. Retorna la cantidad de registros.
+    """
+    filas = db.session.execute(
+        seleccionar_registros([
+            'id', 'fecha', 'pliegue_tricipital_promedio', 'pliegue_subescapular_promedio',
+            'pliegue_suprailiaco_promedio', 'pliegue_abdominal_promedio'
+        ]).where(RegistroFisico.usuario_id == usuario.id)
+    ).all()
+    
+    for inicio in range(0, len(filas), tamano_lote):
+        bloque = filas[inicio:inicio + tamano_lote]
+        ids, fechas, *columnas = zip(*bloque)
+        actualizaciones = calcular_metricas_lote(columnas, fechas, usuario)
+        for registro_id, valores in zip(ids, actualizaciones):
+            valores['id'] = registro_id
+        db.session.execute(db.update(RegistroFisico), actualizaciones)
+    
+    if filas:
+        recalcular_agregado(usuario.id)
+        usuario.registrar_cambio_datos()
+    return len(filas)
+
+# Valores de un registro que intervienen en las estadísticas acumuladas
+FilaAgregado = collections.namedtuple('FilaAgregado', 'id fecha peso imc porcentaje_grasa spc')
+
+def fila_agregado(registro):
+    """Copia de los valores de un registro para actualizar sus estadísticas acumuladas"""
+    return FilaAgregado(registro.id, registro.fecha, registro.peso, registro.imc,
+                        registro.porcentaje_grasa, registro.spc)
+
+def recalcular_agregado(usuario_id=None):
+    """
+    Reconstruye desde los registros las estadísticas acumuladas y las
+    tendencias de un usuario (o de todos si no se indica). Retorna la
+    cantidad de usuarios procesados.
+    """
+    r = RegistroFisico.__table__.c
+    u = Usuario.__table__.c
+    
+    def valor_extremo(columna, *condiciones, ultimo=False):
+        """Valor del primer (o último) registro del usuario por fecha"""
+        registros = RegistroFisico.__table__.alias()
+        orden = (registros.c.fecha.desc(), registros.c.id.desc()) if ultimo else (registros.c.fecha, registros.c.id)
+        return db.select(registros.c[columna]).where(
+            registros.c.usuario_id == u.id,
+            *[condicion(registros.c) for condicion in condiciones]
+        ).order_by(*orden).limit(1).correlate(Usuario.__table__).scalar_subquery()
+    
+    con_grasa = lambda c: c.porcentaje_grasa != 0
+    expresiones = {
+        'usuario_id': u.id,
+        'total_registros': db.func.count(r.id),
+        'suma_peso': db.func.coalesce(db.func.sum(r.peso), 0),
+        'peso_minimo': db.func.min(r.peso),
+        'peso_maximo': db.func.max(r.peso),
+        'suma_imc': db.func.coalesce(db.func.sum(r.imc), 0),
+        'registros_grasa': db.func.count(db.func.nullif(r.porcentaje_grasa, 0)),
+        'suma_grasa': db.func.coalesce(db.func.sum(r.porcentaje_grasa), 0),
+        'registros_spc': db.func.count(db.func.nullif(r.spc, 0)),
+        'suma_spc': db.func.coalesce(db.func.sum(r.spc), 0),
+        'primera_fecha': db.func.min(r.fecha),
+        'peso_inicial': valor_extremo('peso'),
+        'ultimo_registro_id': valor_extremo('id', ultimo=True),
+        'ultima_fecha': db.func.max(r.fecha),
+        'peso_actual': valor_extremo('peso', ultimo=True),
+        'fecha_ultima_grasa': valor_extremo('fecha', con_grasa, ultimo=True),
+        'ultima_grasa': valor_extremo('porcentaje_grasa', con_grasa, ultimo=True),
+    }
+    consulta = db.select(*expresiones.values()).select_from(
+        Usuario.__table__.outerjoin(RegistroFisico.__table__, r.usuario_id == u.id)
+    ).group_by(u.id)
+    if usuario_id is not None:
+        consulta = consulta.where(u.id == usuario_id)
+    
+    tabla = AgregadoUsuario.__table__
+    insercion = sqlite_insert(tabla).from_select(list(expresiones), consulta)
+    resultado = db.session.execute(insercion.on_conflict_do_update(
+        index_elements=[tabla.c.usuario_id],
+        set_={nombre: insercion.excluded[nombre] for nombre in expresiones if nombre != 'usuario_id'}
+    ))
+    recalcular_tendencias(usuario_id)
+    return resultado.rowcount
+
+def _afecta_extremos(agregado, fila):
+    """Indica si quitar la fila cambia un mínimo, un máximo o un primer/último valor"""
+    if agregado is None or agregado.total_registros <= 1:
+        return True
+    return (fila.peso <= agregado.peso_minimo or fila.peso >= agregado.peso_maximo
+            or fila.id == agregado.ultimo_registro_id
+            or fila.fecha <= agregado.primera_fecha or fila.fecha >= agregado.ultima_fecha
+            or (bool(fila.porcentaje_grasa) and (agregado.fecha_ultima_grasa is None
+                                                 or fila.fecha >= agregado.fecha_ultima_grasa)))
+
+def actualizar_agregado(usuario_id, agregadas=(), quitadas=()):
+    """
+    Actualiza las estadísticas acumuladas de un usuario con registros nuevos
+    (``agregadas``) y eliminados o con sus valores previos a una edición
+    (``quitadas``), dentro de la transacción actual.
+    
+    Las sumas se ajustan con un único UPDATE; si un registro quitado era el
+    mínimo, el máximo, el primero o el último, se reconstruyen desde la tabla.
+    Las tendencias se actualizan con ``actualizar_tendencias``.
+    """
+    db.session.flush()
+    tabla = AgregadoUsuario.__table__
+    c = tabla.c
+    
+    if quitadas:
+        agregado = db.session.execute(db.select(tabla).where(c.usuario_id == usuario_id)).first()
+        if any(_afecta_extremos(agregado, fila) for fila in quitadas):
+            recalcular_agregado(usuario_id)
+            return
+    
+    valores = {
+        'total_registros': c.total_registros + len(agregadas) - len(quitadas),
+        'suma_peso': c.suma_peso + sum(f.peso for f in agregadas) - sum(f.peso for f in quitadas),
+        'suma_imc': c.suma_imc + sum(f.imc for f in agregadas) - sum(f.imc for f in quitadas),
+        'registros_grasa': c.registros_grasa + sum(1 for f in agregadas if f.porcentaje_grasa)
+                           - sum(1 for f in quitadas if f.porcentaje_grasa),
+        'suma_grasa': c.suma_grasa + sum(f.porcentaje_grasa or 0 for f in agregadas)
+                      - sum(f.porcentaje_grasa or 0 for f in quitadas),
+        'registros_spc': c.registros_spc + sum(1 for f in agregadas if f.spc) - sum(1 for f in quitadas if f.spc),
+        'suma_spc': c.suma_spc + sum(f.spc or 0 for f in agregadas) - sum(f.spc or 0 for f in quitadas),
+    }
+    if agregadas:
+        pesos = [f.peso for f in agregadas]
+        primera = min(agregadas, key=lambda f: f.fecha)
+        ultima = max(agregadas, key=lambda f: f.fecha)
+        es_primera = db.or_(c.primera_fecha.is_(None), c.primera_fecha > primera.fecha)
+        es_ultima = db.or_(c.ultima_fecha.is_(None), c.ultima_fecha < ultima.fecha)
+        valores.update({
+            'peso_minimo': db.func.min(db.func.coalesce(c.peso_minimo, min(pesos)), min(pesos)),
+            'peso_maximo': db.func.max(db.func.coalesce(c.peso_maximo, max(pesos)), max(pesos)),
+            'primera_fecha': db.case((es_primera, primera.fecha), else_=c.primera_fecha),
+            'peso_inicial': db.case((es_primera, primera.peso), else_=c.peso_inicial),
+            'ultimo_registro_id': db.case((es_ultima, ultima.id), else_=c.ultimo_registro_id),
+            'ultima_fecha': db.case((es_ultima, ultima.fecha), else_=c.ultima_fecha),
+            'peso_actual': db.case((es_ultima, ultima.peso), else_=c.peso_actual),
+        })
+        con_grasa = [f for f in agregadas if f.porcentaje_grasa]
+        if con_grasa:
+            ultima_grasa = max(con_grasa, key=lambda f: f.fecha)
+            es_ultima_grasa = db.or_(c.fecha_ultima_grasa.is_(None), c.fecha_ultima_grasa < ultima_grasa.fecha)
+            valores.update({
+                'fecha_ultima_grasa': db.case((es_ultima_grasa, ultima_grasa.fecha), else_=c.fecha_ultima_grasa),
+                'ultima_grasa': db.case((es_ultima_grasa, ultima_grasa.porcentaje_grasa), else_=c.ultima_grasa),
+            })
+    
+    resultado = db.session.execute(db.update(tabla).where(c.usuario_id == usuario_id).values(**valores))
+    if resultado.rowcount == 0:
+        # Usuario sin estadísticas acumuladas todavía: se crean desde sus registros
+        recalcular_agregado(usuario_id)
+    else:
+        actualizar_tendencias(usuario_id, agregadas, quitadas)
+
+def obtener_agregado(usuario_id):
+    """Estadísticas acumuladas de un usuario (se crean si todavía no existen)"""
+    agregado = db.session.get(AgregadoUsuario, usuario_id)
+    if agregado is None:
+        recalcular_agregado(usuario_id)
+        db.session.commit()
+        agregado = db.session.get(AgregadoUsuario, usuario_id)
+    return agregado
+
+# Métricas con tendencia (estado en TendenciaUsuario) y su unidad
+METRICAS_TENDENCIA = {'peso': 'kg', 'porcentaje_grasa': '%'}
+
+def recalcular_tendencias(usuario_id=None):
+    """
+    Reconstruye el estado de las tendencias de un usuario (o de todos si no se
+    indica) desde su serie completa de registros.
+    """
+    r = RegistroFisico.__table__.c
+    consulta = db.select(r.usuario_id, r.fecha, *[r[m] for m in METRICAS_TENDENCIA]).order_by(r.usuario_id, r.fecha)
+    tabla = TendenciaUsuario.__table__
+    borrado = db.delete(tabla)
+    if usuario_id is not None:
+        consulta = consulta.where(r.usuario_id == usuario_id)
+        borrado = borrado.where(tabla.c.usuario_id == usuario_id)
+    
+    series_usuarios = {usuario_id: []} if usuario_id is not None else {}
+    for id_usuario, filas in itertools.groupby(db.session.execute(consulta), key=operator.itemgetter(0)):
+        series_usuarios[id_usuario] = list(filas)
+    estados = []
+    for id_usuario, filas in series_usuarios.items():
+        for posicion, metrica in enumerate(METRICAS_TENDENCIA, start=2):
+            # Un valor 0 (métricas sin pliegues) es un valor ausente
+            medidas = [(fila[1], fila[posicion]) for fila in filas if fila[posicion]]
+            fechas, valores = zip(*medidas) if medidas else ((), ())
+            estados.append({'usuario_id': id_usuario, 'metrica': metrica, **tendencias.estado_serie(fechas, valores)})
+    db.session.execute(borrado)
+    if estados:
+        db.session.execute(tabla.insert(), estados)
+
+def actualizar_tendencias(usuario_id, agregadas=(), quitadas=()):
+    """
+    Actualiza las tendencias de un usuario con registros nuevos en O(1) por
+    registro (``tendencias.agregar``). Si hay registros quitados (bajas o
+    ediciones) o el usuario todavía no tiene estado, se reconstruyen.
+    """
+    estados = {} if quitadas else _estados_tendencias(usuario_id)
+    if len(estados) < len(METRICAS_TENDENCIA):
+        recalcular_tendencias(usuario_id)
+        return
+    cambios = []
+    for metrica, estado in estados.items():
+        nuevas = [(fila.fecha, getattr(fila, metrica)) for fila in agregadas if getattr(fila, metrica)]
+        for fecha, valor in nuevas:
+            tendencias.agregar(estado, fecha, valor)
+        if nuevas:
+            cambios.append(estado)
+    if cambios:
+        db.session.execute(db.update(TendenciaUsuario), cambios)
+
+def _estados_tendencias(usuario_id):
+    """Estado guardado de las tendencias de un usuario por métrica, como diccionarios"""
+    consulta = db.select(TendenciaUsuario.__table__).where(TendenciaUsuario.usuario_id == usuario_id)
+    return {fila.metrica: fila._asdict() for fila in db.session.execute(consulta)}
+
+def obtener_tendencias(usuario_id):
+    """Estado de las tendencias de un usuario por métrica (se crea si todavía no existe)"""
+    estados = _estados_tendencias(usuario_id)
+    if len(estados) < len(METRICAS_TENDENCIA):
+        recalcular_tendencias(usuario_id)
+        db.session.commit()
+        estados = _estados_tendencias(usuario_id)
+    return estados
+
+def progreso_grasa_reciente(usuario, agregado):
+    """Progreso hacia el siguiente nivel de grasa (``calcular_progreso_grasa``) según el último registro con grasa"""
+    if agregado.fecha_ultima_grasa is None:
+        return None, None, None, None
+    registros = leer_registros(
+        seleccionar_registros(GRUPOS_REGISTRO['basicos'] + GRUPOS_REGISTRO['metricas'])
+        .where(RegistroFisico.usuario_id == usuario.id, RegistroFisico.fecha == agregado.fecha_ultima_grasa)
+    )
+    return registros[0].calcular_progreso_grasa() if registros else (None, None, None, None)
+
+def resumen_tendencias(usuario, agregado):
+    """
+    Tendencia actual de cada métrica de un usuario (``tendencias.resumen``,
+    None si no tiene mediciones) con su unidad. La del porcentaje de grasa
+    incluye el siguiente nivel de ``calcular_progreso_grasa`` y la fecha en
+    que la tendencia alcanza su límite.
+    """
+    estados = obtener_tendencias(usuario.id)
+    progreso = progreso_grasa_reciente(usuario, agregado) if estados['porcentaje_grasa']['registros'] else None
+    resultado = {}
+    for metrica, unidad in METRICAS_TENDENCIA.items():
+        objetivo = progreso[2] if metrica == 'porcentaje_grasa' and progreso else None
+        datos = tendencias.resumen(estados[metrica], objetivo)
+        if datos is not None:
+            datos['unidad'] = unidad
+            if objetivo is not None:
+                datos['siguiente_nivel'] = progreso[1]
+        resultado[metrica] = datos
+    return resultado
+
+class Paginacion:
+    """Página actual, tamaño de página y total de elementos para las plantillas"""
+    
+    def __init__(self, pagina, por_pagina, total):
+        self.por_pagina = por_pagina
+        self.total = total
+        self.paginas = max(1, math.ceil(total / por_pagina))
+        self.pagina = min(max(1, pagina), self.paginas)
+    
+    @property
+    def desplazamiento(self):
+        return (self.pagina - 1) * self.por_pagina
+    
+    @property
+    def tiene_anterior(self):
+        return self.pagina > 1
+    
+    @property
+    def tiene_siguiente(self):
+        return self.pagina < self.paginas
+    
+    def paginas_visibles(self, alrededor=2):
+        """Números de página a mostrar (None marca un salto)"""
+        visibles = []
+        for numero in range(1, self.paginas + 1):
+            if numero in (1, self.paginas) or abs(numero - self.pagina) <= alrededor:
+                visibles.append(numero)
+            elif visibles[-1] is not None:
+                visibles.append(None)
+        return visibles
+
+def historial_registros(usuario_id, paginacion, orden='desc'):
+    """
+    Página del historial de registros de un usuario con la diferencia de peso
+    respecto del registro anterior en el tiempo.
+    
+    La diferencia se calcula con LAG sobre la página más el registro vecino
+    que la precede cronológicamente, por lo que el costo no depende del
+    largo del historial sino de la página pedida. Retorna RegistroLite con
+    id, fecha, peso, imc y diferencia_peso.
+    """
+    r = RegistroFisico.__table__.c
+    descendente = orden == 'desc'
+    # El vecino anterior en el tiempo es el registro siguiente (desc) o el previo (asc) a la página
+    vecino = 1 if descendente or paginacion.desplazamiento else 0
+    desplazamiento = paginacion.desplazamiento - (0 if descendente else vecino)
+    
+    pagina = db.select(r.id, r.fecha, r.peso, r.imc).where(r.usuario_id == usuario_id).order_by(
+        *((r.fecha.desc(), r.id.desc()) if descendente else (r.fecha, r.id))
+    ).limit(paginacion.por_pagina + vecino).offset(desplazamiento).subquery()
+    diferencia = pagina.c.peso - db.func.lag(pagina.c.peso).over(order_by=(pagina.c.fecha, pagina.c.id))
+    consulta = db.select(pagina, diferencia.label('diferencia_peso')).order_by(
+        *((pagina.c.fecha.desc(), pagina.c.id.desc()) if descendente else (pagina.c.fecha, pagina.c.id))
+    )
+    filas = leer_registros(consulta)
+    return filas[:paginacion.por_pagina] if descendente else filas[vecino:]
+
+def inicializar_base_datos():
+    """Crea las tablas que falten y aplica las migraciones de esquema pendientes"""
+    db.create_all()
+    migraciones.migrar(db.session)
+
+@bp.cli.command('recalcular-metricas')
+@click.option('--usuario', 'usuario_id', type=int, help='Recalcular solo los registros de este usuario')
+def recalcular_metricas_comando(usuario_id):
+    """Recalcula las métricas derivadas guardadas en los registros"""
+    if usuario_id:
+        usuario = db.session.get(Usuario, usuario_id)
+        if usuario is None:
+            raise click.ClickException(f'No existe el usuario {usuario_id}')
+        usuarios = [usuario]
+    else:
+        usuarios = Usuario.query.all()
+    total = 0
+    for usuario in usuarios:
+        total += recalcular_metricas_usuario(usuario)
+    db.session.commit()
+    click.echo(f'Métricas recalculadas para {total} registros de {len(usuarios)} usuarios')
+
+@bp.cli.command('migrar')
+def migrar_comando():
+    """Aplica las migraciones de esquema pendientes y muestra la versión actual"""
+    inicializar_base_datos()
+    version = migraciones.version_esquema(db.session)
+    click.echo(f'Esquema en la versión {version}')
+
+@bp.cli.command('reparar-agregados')
+@click.option('--usuario', 'usuario_id', type=int, help='Reconstruir solo las estadísticas de este usuario')
+def reparar_agregados_comando(usuario_id):
+    """Reconstruye desde los registros las estadísticas acumuladas y las tendencias por usuario"""
+    if usuario_id and db.session.get(Usuario, usuario_id) is None:
+        raise click.ClickException(f'No existe el usuario {usuario_id}')
+    total = recalcular_agregado(usuario_id)
+    db.session.commit()
+    click.echo(f'Estadísticas acumuladas reconstruidas para {total} usuarios')
+
+@bp.cli.command('normas')
+def normas_comando():
+    """Lista las tablas de referencia cargadas y la población activa"""
+    activas = normas.activas()
+    for conjunto in normas.catalogo.conjuntos():
+        marca = '*' if conjunto is activas else ' '
+        click.echo(f'{marca} {conjunto.clave:<20} {conjunto.archivo}')
+
+# Funciones de exportación e importación CSV
+# Columnas del CSV de registros (en orden): medidas guardadas y métricas derivadas
+COLUMNAS_CSV_MEDIDAS = ['fecha', 'peso', 'altura', 'imc'] + COLUMNAS_PLIEGUES + COLUMNAS_CIRCUNFERENCIAS
+COLUMNAS_CSV_DERIVADAS = ['porcentaje_grasa', 'spc_aaherd', 'percentila_spc_aaherd', 'clasificacion_spc_aaherd']
+_medidas_csv = operator.attrgetter(*COLUMNAS_CSV_MEDIDAS[4:])
+
+def export_registros_csv(usuario_id, tamano_lote=1000):
+    """
+    Exporta los registros de un usuario a formato CSV de forma incremental.
     
-    import csv
-    import io
+    Retorna un generador de fragmentos de texto: primero el encabezado y luego
+    un fragmento por cada lote de filas leído de la base de datos, de modo que
+    la memoria usada no depende de la cantidad de registros.
+    """
+    consulta = seleccionar_registros(
+        COLUMNAS_CSV_MEDIDAS + ['porcentaje_grasa', 'spc', 'percentila_spc', 'nivel_spc']
+    ).where(RegistroFisico.usuario_id == usuario_id).order_by(RegistroFisico.fecha.desc())
     
     output = io.StringIO()
     writer = csv.writer(output)
     
     # Encabezados del CSV
-    headers = [
-        'fecha', 'peso', 'altura', 'imc',
-        'pliegue_tricipital_1', 'pliegue_tricipital_2', 'pliegue_tricipital_3', 'pliegue_tricipital_promedio',
-        'pliegue_subescapular_1', 'pliegue_subescapular_2', 'pliegue_subescapular_3', 'pliegue_subescapular_promedio',
-        'pliegue_suprailiaco_1', 'pliegue_suprailiaco_2', 'pliegue_suprailiaco_3', 'pliegue_suprailiaco_promedio',
-        'pliegue_abdominal_1', 'pliegue_abdominal_2', 'pliegue_abdominal_3', 'pliegue_abdominal_promedio',
-        'pliegue_muslo_anterior_1', 'pliegue_muslo_anterior_2', 'pliegue_muslo_anterior_3', 'pliegue_muslo_anterior_promedio',
-        'pliegue_pantorrilla_1', 'pliegue_pantorrilla_2', 'pliegue_pantorrilla_3', 'pliegue_pantorrilla_promedio',
-        'circunferencia_cuello', 'circunferencia_pecho', 'circunferencia_brazo', 'circunferencia_antebrazo',
-        'circunferencia_cintura', 'circunferencia_cadera', 'circunferencia_muslo', 'circunferencia_pantorrilla',
-        'porcentaje_grasa', 'spc_aaherd', 'percentila_spc_aaherd', 'clasificacion_spc_aaherd'
-    ]
-    
-    writer.writerow(headers)
-    
-    # Datos de los registros
-    for registro in registros:
-        # Calcular valores derivados
-        porcentaje_grasa = registro.calcular_porcentaje_grasa()
-        spc_aaherd = registro.calcular_spc_aaherd()
-        percentila_spc = registro.calcular_percentila_spc_aaherd()
-        clasificacion_spc = registro.clasificar_spc_aaherd()
+    writer.writerow(COLUMNAS_CSV_MEDIDAS + COLUMNAS_CSV_DERIVADAS)
+    yield output.getvalue()
+    
+    resultado = db.session.execute(consulta.execution_options(yield_per=tamano_lote))
+    registro_lite = RegistroLite.tipo(resultado.keys())
+    for filas in resultado.partitions():
+        output.seek(0)
+        output.truncate()
+        writer.writerows(map(RegistroLite.valores_csv, map(registro_lite._make, filas)))
+        yield output.getvalue()
+
+def comprimir_gzip(fragmentos):
+    """Comprime al vuelo con gzip un generador de fragmentos de texto"""
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for fragmento in fragmentos:
+        datos = compresor.compress(fragmento.encode('utf-8'))
+        if datos:
+            yield datos
+    yield compresor.flush()
+
+def _fecha_csv(valor):
+    """Convierte la fecha del CSV ('%Y-%m-%d %H:%M:%S' o '%Y-%m-%d')"""
+    if len(valor) in (10, 19):
+        try:
+            fecha = datetime.fromisoformat(valor)
+            if fecha.tzinfo is None:
+                return fecha
+        except ValueError:
+            pass
+    raise ValueError(f"Formato de fecha inválido: {valor}")
+
+def compilar_esquema_importacion(encabezados):
+    """
+    Compila el parser de filas del CSV de registros para un orden de columnas.
+    
+    Las posiciones de cada columna se resuelven una sola vez a partir del
+    encabezado; el parser retornado convierte una fila (lista de celdas) en los
+    valores de un registro y lanza ValueError si la fila es inválida.
+    """
+    posiciones = {nombre.strip(): i for i, nombre in enumerate(encabezados)}
+    opcionales = [c for c in COLUMNAS_CSV_MEDIDAS[4:] if c in posiciones]
+    ausentes = dict.fromkeys(c for c in COLUMNAS_CSV_MEDIDAS[4:] if c not in posiciones)
+    obtener_opcionales = operator.itemgetter(*[posiciones[c] for c in opcionales]) if opcionales else lambda row: ()
+    if len(opcionales) == 1:
+        obtener_opcionales = (lambda getter: lambda row: (getter(row),))(obtener_opcionales)
+    i_fecha, i_peso, i_altura, i_imc = (posiciones.get(c, -1) for c in ('fecha', 'peso', 'altura', 'imc'))
+    ancho = len(encabezados)
+    
+    def parsear(row):
+        if len(row) < ancho:
+            row = row + [''] * (ancho - len(row))
+        fecha = row[i_fecha] if i_fecha >= 0 else ''
+        peso = row[i_peso] if i_peso >= 0 else ''
+        altura = row[i_altura] if i_altura >= 0 else ''
+        if not fecha or not peso or not altura:
+            raise ValueError("Faltan campos requeridos (fecha, peso, altura)")
         
-        row = [
-            registro.fecha.strftime('%Y-%m-%d %H:%M:%S'),
-            registro.peso,
-            registro.altura,
-            registro.imc,
-            registro.pliegue_tricipital_1 or '',
-            registro.pliegue_tricipital_2 or '',
-            registro.pliegue_tricipital_3 or '',
-            registro.pliegue_tricipital_promedio or '',
-            registro.pliegue_subescapular_1 or '',
-            registro.pliegue_subescapular_2 or '',
-            registro.pliegue_subescapular_3 or '',
-            registro.pliegue_subescapular_promedio or '',
-            registro.pliegue_suprailiaco_1 or '',
-            registro.pliegue_suprailiaco_2 or '',
-            registro.pliegue_suprailiaco_3 or '',
-            registro.pliegue_suprailiaco_promedio or '',
-            registro.pliegue_abdominal_1 or '',
-            registro.pliegue_abdominal_2 or '',
-            registro.pliegue_abdominal_3 or '',
-            registro.pliegue_abdominal_promedio or '',
-            registro.pliegue_muslo_anterior_1 or '',
-            registro.pliegue_muslo_anterior_2 or '',
-            registro.pliegue_muslo_anterior_3 or '',
-            registro.pliegue_muslo_anterior_promedio or '',
-            registro.pliegue_pantorrilla_1 or '',
-            registro.pliegue_pantorrilla_2 or '',
-            registro.pliegue_pantorrilla_3 or '',
-            registro.pliegue_pantorrilla_promedio or '',
-            registro.circunferencia_cuello or '',
-            registro.circunferencia_pecho or '',
-            registro.circunferencia_brazo or '',
-            registro.circunferencia_antebrazo or '',
-            registro.circunferencia_cintura or '',
-            registro.circunferencia_cadera or '',
-            registro.circunferencia_muslo or '',
-            registro.circunferencia_pantorrilla or '',
-            round(porcentaje_grasa, 2) if porcentaje_grasa else '',
-            round(spc_aaherd, 2) if spc_aaherd else '',
-            percentila_spc or '',
-            clasificacion_spc[0] if clasificacion_spc and clasificacion_spc[0] else ''
+        fecha = _fecha_csv(fecha)
+        try:
+            valores = dict(zip(opcionales, [float(v) if v else None for v in obtener_opcionales(row)]))
+            valores.update(ausentes)
+            valores['peso'] = peso = float(peso)
+            valores['altura'] = altura = float(altura)
+            imc = row[i_imc] if i_imc >= 0 else ''
+            valores['imc'] = float(imc) if imc else round(peso / (altura ** 2), 2)
+        except (ValueError, ZeroDivisionError) as e:
+            raise ValueError(f"Error al procesar registro - {str(e)}") from None
+        valores['fecha'] = fecha
+        return valores
+    
+    return parsear
+
+def insertar_registros(filas):
+    """
+    Inserta filas de registros con un único INSERT masivo, omitiendo las que
+    ya existen para el mismo usuario y fecha (INSERT ... ON CONFLICT DO NOTHING).
+    Las medidas de las filas que traen alguna (claves de ``COLUMNAS_MEDIDAS``)
+    se insertan en medidas_registro. Retorna las filas insertadas con los
+    valores de las estadísticas acumuladas.
+    """
+    if not filas:
+        return []
+    tabla = RegistroFisico.__table__
+    registros = []
+    medidas = {}
+    for fila in filas:
+        registros.append({clave: valor for clave, valor in fila.items() if clave not in _CLAVES_MEDIDAS})
+        if not _CLAVES_MEDIDAS.isdisjoint(fila) and any(fila.get(n) not in (None, '') for n in COLUMNAS_MEDIDAS):
+            medidas[fila['usuario_id'], fila['fecha']] = {nombre: fila.get(nombre) for nombre in COLUMNAS_MEDIDAS}
+    
+    insercion = sqlite_insert(tabla).on_conflict_do_nothing().returning(
+        *[tabla.c[n] for n in FilaAgregado._fields], tabla.c.usuario_id
+    )
+    insertados = db.session.execute(insercion, registros).all()
+    if medidas:
+        # Las filas insertadas se reconocen por usuario y fecha (únicos por registro)
+        filas_medidas = [
+            {'registro_id': fila.id, **medidas[fila.usuario_id, fila.fecha]}
+            for fila in insertados if (fila.usuario_id, fila.fecha) in medidas
         ]
-        writer.writerow(row)
+        if filas_medidas:
+            db.session.execute(MedidasRegistro.__table__.insert(), filas_medidas)
+    return insertados
+
+def _insertar_lote_registros(lote, usuario, errores):
+    """
+    Inserta un lote de filas ya parseadas con un único INSERT masivo.
+    
+    Si el lote falla, se reintenta fila por fila para aislar las filas con
+    error. Retorna la cantidad de registros insertados y de duplicados omitidos.
+    """
+    filas = [valores for _, valores in lote]
+    pliegues = (
+        [f['pliegue_tricipital_promedio'] for f in filas],
+        [f['pliegue_subescapular_promedio'] for f in filas],
+        [f['pliegue_suprailiaco_promedio'] for f in filas],
+        [f['pliegue_abdominal_promedio'] for f in filas],
+    )
+    metricas = calcular_metricas_lote(pliegues, [f['fecha'] for f in filas], usuario)
+    for valores, valores_metricas in zip(filas, metricas):
+        valores['usuario_id'] = usuario.id
+        valores.update(valores_metricas)
+    
+    try:
+        insertados = insertar_registros(filas)
+        actualizar_agregado(usuario.id, agregadas=insertados)
+        usuario.registrar_cambio_datos()
+        db.session.commit()
+        return len(insertados), len(filas) - len(insertados)
+    except Exception:
+        db.session.rollback()
     
-    output.seek(0)
-    return output.getvalue()
+    insertados = 0
+    duplicados = 0
+    for row_num, valores in lote:
+        try:
+            insertado = insertar_registros([valores])
+            if insertado:
+                insertados += 1
+                actualizar_agregado(usuario.id, agregadas=insertado)
+            else:
+                duplicados += 1
+            usuario.registrar_cambio_datos()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            errores.append(f"Fila {row_num}: Error al procesar registro - {str(e)}")
+    return insertados, duplicados
 
-def import_registros_csv(csv_content, usuario_id):
-    """Importa registros desde un CSV al usuario especificado"""
-    import csv
-    import io
-    from datetime import datetime
+def import_registros_csv(csv_content, usuario_id, tamano_lote=None, progreso=None):
+    """
+    Importa registros desde un CSV al usuario especificado.
     
-    usuario = Usuario.query.get_or_404(usuario_id)
-    registros_importados = []
+    Las filas se convierten con un esquema precompilado y se insertan en lotes
+    de ``tamano_lote`` filas (una transacción por lote), sin crear objetos ORM.
+    Las filas con la fecha de un registro existente se omiten como duplicadas.
+    ``progreso`` se llama después de cada lote con (filas leídas, registros
+    importados, duplicados, errores). Retorna la cantidad de registros
+    importados, la de duplicados omitidos y la lista de errores.
+    ``csv_content`` es el texto del archivo o un iterable de sus líneas.
+    """
+    usuario = db.session.get(Usuario, usuario_id)
+    if usuario is None:
+        raise ValueError(f'No existe el usuario {usuario_id}')
+    tamano_lote = tamano_lote or current_app.config['IMPORTAR_TAMANO_LOTE']
+    importados = 0
+    duplicados = 0
     errores = []
+    lote = []
+    filas_leidas = 0
+    
+    def procesar_lote():
+        nonlocal importados, duplicados
+        insertados, omitidos = _insertar_lote_registros(lote, usuario, errores)
+        importados += insertados
+        duplicados += omitidos
+        lote.clear()
+        if progreso:
+            progreso(filas_leidas, importados, duplicados, errores)
+        else:
+            current_app.logger.info('Importación usuario %s: %s filas leídas, %s importadas, %s duplicadas, %s errores',
+                            usuario_id, filas_leidas, importados, duplicados, len(errores))
     
-    # Leer el CSV
-    csv_reader = csv.DictReader(io.StringIO(csv_content))
+    # Leer el CSV y compilar el parser a partir de los encabezados
+    lineas = io.StringIO(csv_content) if isinstance(csv_content, str) else csv_content
+    csv_reader = csv.reader(lineas)
+    parsear_fila = compilar_esquema_importacion(next(csv_reader, []))
     
     for row_num, row in enumerate(csv_reader, start=2):  # Empezar en 2 porque la fila 1 son headers
+        if not row:
+            continue
+        filas_leidas += 1
         try:
-            # Validar campos requeridos
-            if not row.get('fecha') or not row.get('peso') or not row.get('altura'):
-                errores.append(f"Fila {row_num}: Faltan campos requeridos (fecha, peso, altura)")
-                continue
-            
-            # Crear nuevo registro
-            registro = RegistroFisico()
-            registro.usuario_id = usuario_id
-            
-            # Fecha
-            try:
-                registro.fecha = datetime.strptime(row['fecha'], '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                try:
-                    registro.fecha = datetime.strptime(row['fecha'], '%Y-%m-%d')
-                except ValueError:
-                    errores.append(f"Fila {row_num}: Formato de fecha inválido: {row['fecha']}")
-                    continue
-            
-            # Datos básicos
-            registro.peso = float(row['peso'])
-            registro.altura = float(row['altura'])
-            registro.imc = float(row['imc']) if row.get('imc') else round(registro.peso / (registro.altura ** 2), 2)
-            
-            # Pliegues cutáneos - Tricipital
-            registro.pliegue_tricipital_1 = float(row['pliegue_tricipital_1']) if row.get('pliegue_tricipital_1') else None
-            registro.pliegue_tricipital_2 = float(row['pliegue_tricipital_2']) if row.get('pliegue_tricipital_2') else None
-            registro.pliegue_tricipital_3 = float(row['pliegue_tricipital_3']) if row.get('pliegue_tricipital_3') else None
-            registro.pliegue_tricipital_promedio = float(row['pliegue_tricipital_promedio']) if row.get('pliegue_tricipital_promedio') else None
-            
-            # Pliegues cutáneos - Subescapular
-            registro.pliegue_subescapular_1 = float(row['pliegue_subescapular_1']) if row.get('pliegue_subescapular_1') else None
-            registro.pliegue_subescapular_2 = float(row['pliegue_subescapular_2']) if row.get('pliegue_subescapular_2') else None
-            registro.pliegue_subescapular_3 = float(row['pliegue_subescapular_3']) if row.get('pliegue_subescapular_3') else None
-            registro.pliegue_subescapular_promedio = float(row['pliegue_subescapular_promedio']) if row.get('pliegue_subescapular_promedio') else None
-            
-            # Pliegues cutáneos - Suprailíaco
-            registro.pliegue_suprailiaco_1 = float(row['pliegue_suprailiaco_1']) if row.get('pliegue_suprailiaco_1') else None
-            registro.pliegue_suprailiaco_2 = float(row['pliegue_suprailiaco_2']) if row.get('pliegue_suprailiaco_2') else None
-            registro.pliegue_suprailiaco_3 = float(row['pliegue_suprailiaco_3']) if row.get('pliegue_suprailiaco_3') else None
-            registro.pliegue_suprailiaco_promedio = float(row['pliegue_suprailiaco_promedio']) if row.get('pliegue_suprailiaco_promedio') else None
-            
-            # Pliegues cutáneos - Abdominal
-            registro.pliegue_abdominal_1 = float(row['pliegue_abdominal_1']) if row.get('pliegue_abdominal_1') else None
-            registro.pliegue_abdominal_2 = float(row['pliegue_abdominal_2']) if row.get('pliegue_abdominal_2') else None
-            registro.pliegue_abdominal_3 = float(row['pliegue_abdominal_3']) if row.get('pliegue_abdominal_3') else None
-            registro.pliegue_abdominal_promedio = float(row['pliegue_abdominal_promedio']) if row.get('pliegue_abdominal_promedio') else None
-            
-            # Pliegues cutáneos - Muslo anterior
-            registro.pliegue_muslo_anterior_1 = float(row['pliegue_muslo_anterior_1']) if row.get('pliegue_muslo_anterior_1') else None
-            registro.pliegue_muslo_anterior_2 = float(row['pliegue_muslo_anterior_2']) if row.get('pliegue_muslo_anterior_2') else None
-            registro.pliegue_muslo_anterior_3 = float(row['pliegue_muslo_anterior_3']) if row.get('pliegue_muslo_anterior_3') else None
-            registro.pliegue_muslo_anterior_promedio = float(row['pliegue_muslo_anterior_promedio']) if row.get('pliegue_muslo_anterior_promedio') else None
-            
-            # Pliegues cutáneos - Pantorrilla
-            registro.pliegue_pantorrilla_1 = float(row['pliegue_pantorrilla_1']) if row.get('pliegue_pantorrilla_1') else None
-            registro.pliegue_pantorrilla_2 = float(row['pliegue_pantorrilla_2']) if row.get('pliegue_pantorrilla_2') else None
-            registro.pliegue_pantorrilla_3 = float(row['pliegue_pantorrilla_3']) if row.get('pliegue_pantorrilla_3') else None
-            registro.pliegue_pantorrilla_promedio = float(row['pliegue_pantorrilla_promedio']) if row.get('pliegue_pantorrilla_promedio') else None
-            
-            # Circunferencias
-            registro.circunferencia_cuello = float(row['circunferencia_cuello']) if row.get('circunferencia_cuello') else None
-            registro.circunferencia_pecho = float(row['circunferencia_pecho']) if row.get('circunferencia_pecho') else None
-            registro.circunferencia_brazo = float(row['circunferencia_brazo']) if row.get('circunferencia_brazo') else None
-            registro.circunferencia_antebrazo = float(row['circunferencia_antebrazo']) if row.get('circunferencia_antebrazo') else None
-            registro.circunferencia_cintura = float(row['circunferencia_cintura']) if row.get('circunferencia_cintura') else None
-            registro.circunferencia_cadera = float(row['circunferencia_cadera']) if row.get('circunferencia_cadera') else None
-            registro.circunferencia_muslo = float(row['circunferencia_muslo']) if row.get('circunferencia_muslo') else None
-            registro.circunferencia_pantorrilla = float(row['circunferencia_pantorrilla']) if row.get('circunferencia_pantorrilla') else None
-            
-            # Agregar a la base de datos
-            db.session.add(registro)
-            registros_importados.append(registro)
-            
-        except Exception as e:
-            errores.append(f"Fila {row_num}: Error al procesar registro - {str(e)}")
+            lote.append((row_num, parsear_fila(row)))
+        except ValueError as e:
+            errores.append(f"Fila {row_num}: {e}")
             continue
+        
+        if len(lote) >= tamano_lote:
+            procesar_lote()
     
-    # Guardar cambios
-    if registros_importados:
-        db.session.commit()
+    if lote:
+        procesar_lote()
     
-    return registros_importados, errores
+    return importados, duplicados, errores
 
 # Funciones de importación CSV
 def parse_garmin_csv(csv_content):
     """Parsea el contenido CSV de Garmin y retorna una lista de registros"""
-    registros = []
+    return list(garmin.leer_mediciones(io.StringIO(csv_content)))
+
+def _lotes(iterable, tamano):
+    """Agrupa un iterable en listas de hasta ``tamano`` elementos"""
+    iterador = iter(iterable)
+    while lote := list(itertools.islice(iterador, tamano)):
+        yield lote
+
+def _insertar_lote_garmin(mediciones, usuario):
+    """
+    Inserta un lote de mediciones de Garmin omitiendo las fechas ya
+    registradas (una consulta por el rango de fechas del lote). Retorna la
+    cantidad de registros creados.
+    """
+    fechas = [datos['fecha_hora'] for datos in mediciones]
+    existentes = set(db.session.execute(
+        db.select(RegistroFisico.fecha).where(
+            RegistroFisico.usuario_id == usuario.id,
+            RegistroFisico.fecha.between(min(fechas), max(fechas))
+        )
+    ).scalars())
+
+    filas = []
+    for datos in mediciones:
+        if datos['fecha_hora'] in existentes:
+            continue
+        existentes.add(datos['fecha_hora'])
+        filas.append({
+            'usuario_id': usuario.id,
+            'fecha': datos['fecha_hora'],
+            'peso': datos['peso'],
+            'altura': usuario.altura,
+            # Calcular IMC si no se proporcionó
+            'imc': datos['imc'] or round(datos['peso'] / (usuario.altura ** 2), 2)
+        })
+    if not filas:
+        return 0
+
+    # ON CONFLICT cubre importaciones concurrentes del mismo usuario
+    sin_pliegues = [[None] * len(filas)] * 4
+    metricas = calcular_metricas_lote(sin_pliegues, [f['fecha'] for f in filas], usuario)
+    for valores, valores_metricas in zip(filas, metricas):
+        valores.update(valores_metricas)
+    insertados = insertar_registros(filas)
+    actualizar_agregado(usuario.id, agregadas=insertados)
+    usuario.registrar_cambio_datos()
+    db.session.commit()
+    return len(insertados)
+
+def importar_garmin_csv(csv_content, usuario_id, tamano_lote=None, progreso=None):
+    """
+    Importa las mediciones de un CSV de Garmin Connect al usuario especificado.
+
+    ``csv_content`` es el texto del archivo o un iterable de sus líneas (por
+    ejemplo, el archivo abierto): las mediciones se leen a medida que se
+    insertan, en lotes de ``tamano_lote`` (una transacción por lote), sin
+    cargar el archivo en memoria. ``progreso`` se llama después de cada lote,
+    igual que en ``import_registros_csv``. Retorna la cantidad de registros
+    creados, la de duplicados omitidos y la lista de errores.
+    """
+    usuario = db.session.get(Usuario, usuario_id)
+    if usuario is None:
+        raise ValueError(f'No existe el usuario {usuario_id}')
+    if not usuario.altura:
+        raise ValueError('El usuario debe tener una altura configurada antes de importar datos')
+    tamano_lote = tamano_lote or current_app.config['IMPORTAR_TAMANO_LOTE']
+    lineas = io.StringIO(csv_content) if isinstance(csv_content, str) else csv_content
+
+    leidas = 0
+    creados = 0
+    for lote in _lotes(garmin.leer_mediciones(lineas), tamano_lote):
+        leidas += len(lote)
+        creados += _insertar_lote_garmin(lote, usuario)
+        if progreso:
+            progreso(leidas, creados, leidas - creados, [])
+    if not leidas:
+        raise ValueError('No se pudieron extraer datos válidos del archivo CSV')
+
+    return creados, leidas - creados, []
+
+# Importaciones en segundo plano
+# Errores guardados por trabajo (el total se cuenta aparte)
+MAXIMO_ERRORES_TRABAJO = 100
+IMPORTADORES = {
+    'registros': import_registros_csv,
+    'garmin': importar_garmin_csv,
+}
+
+def crear_trabajo_importacion(usuario_id, tipo, archivo):
+    """
+    Guarda el archivo subido, registra el trabajo y lo envía al pool de hilos.
+    
+    El archivo se escribe con un nombre temporal antes de abrir la transacción
+    (el INSERT toma el bloqueo de escritura de SQLite, que no debe quedar
+    tomado mientras se copia la subida) y se renombra con el id del trabajo.
+    """
+    directorio = current_app.config['TRABAJOS_DIRECTORIO']
+    os.makedirs(directorio, exist_ok=True)
+    temporal = os.path.join(directorio, f'subida-{uuid.uuid4().hex}.csv')
+    try:
+        archivo.save(temporal)
+        trabajo = TrabajoImportacion(usuario_id=usuario_id, tipo=tipo, archivo=archivo.filename,
+                                     host=trabajos.HOST, pid=os.getpid(), latido=datetime.utcnow())
+        db.session.add(trabajo)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _eliminar_archivo(temporal)
+        raise
+    ruta = os.path.join(directorio, f'{trabajo.id}.csv')
+    try:
+        os.replace(temporal, ruta)
+    except OSError as e:
+        _eliminar_archivo(temporal)
+        actualizar_trabajo(trabajo.id, estado=trabajos.ERROR, finalizado=datetime.utcnow(),
+                           mensaje=f'No se pudo guardar el archivo subido: {e}')
+        raise
+    current_app.extensions['trabajos'].enviar(ejecutar_importacion, current_app._get_current_object(), trabajo.id, ruta)
+    return trabajo
+
+def actualizar_trabajo(trabajo_id, **valores):
+    """
+    Actualiza el estado o el progreso de un trabajo; retorna si se pidió
+    cancelarlo. Renueva también el latido de los trabajos activos de este
+    proceso, incluidos los que esperan en su pool detrás del que está en curso.
+    """
+    ahora = datetime.utcnow()
+    cancelar = db.session.execute(
+        db.update(TrabajoImportacion).where(TrabajoImportacion.id == trabajo_id)
+        .values(latido=ahora, **valores).returning(TrabajoImportacion.cancelar)
+    ).scalar()
+    db.session.execute(
+        db.update(TrabajoImportacion).where(
+            TrabajoImportacion.host == trabajos.HOST, TrabajoImportacion.pid == os.getpid(),
+            TrabajoImportacion.estado.in_(trabajos.ESTADOS_ACTIVOS), TrabajoImportacion.id != trabajo_id
+        ).values(latido=ahora)
+    )
+    db.session.commit()
+    return bool(cancelar)
+
+def ejecutar_importacion(app, trabajo_id, ruta):
+    """Procesa un trabajo de importación en un hilo del pool, con su propio contexto de aplicación"""
+    with app.app_context():
+        trabajo = db.session.get(TrabajoImportacion, trabajo_id)
+        usuario_id = trabajo.usuario_id
+        tipo = trabajo.tipo
+        importar = IMPORTADORES[tipo]
+        inicio = time.perf_counter()
+        leidas = 0
+        estado = trabajos.ERROR
+        
+        def progreso(filas_leidas, importados, duplicados, errores):
+            nonlocal leidas
+            metricas.FILAS_IMPORTADAS.incrementar(tipo, valor=filas_leidas - leidas)
+            leidas = filas_leidas
+            cancelar = actualizar_trabajo(
+                trabajo_id, filas_leidas=filas_leidas, importados=importados, duplicados=duplicados,
+                total_errores=len(errores), errores=json.dumps(errores[:MAXIMO_ERRORES_TRABAJO])
+            )
+            if cancelar:
+                raise trabajos.TrabajoCancelado()
+        
+        try:
+            if actualizar_trabajo(trabajo_id, estado=trabajos.EN_CURSO, iniciado=datetime.utcnow(),
+                                  host=trabajos.HOST, pid=os.getpid()):
+                raise trabajos.TrabajoCancelado()
+            # Los importadores leen el archivo línea por línea
+            with open(ruta, encoding='utf-8', newline='') as archivo:
+                importados, duplicados, errores = importar(archivo, usuario_id, progreso=progreso)
+            actualizar_trabajo(
+                trabajo_id, estado=trabajos.COMPLETADO, finalizado=datetime.utcnow(),
+                importados=importados, duplicados=duplicados, total_errores=len(errores),
+                errores=json.dumps(errores[:MAXIMO_ERRORES_TRABAJO])
+            )
+            estado = trabajos.COMPLETADO
+        except trabajos.TrabajoCancelado:
+            db.session.rollback()
+            actualizar_trabajo(trabajo_id, estado=trabajos.CANCELADO, finalizado=datetime.utcnow(),
+                               mensaje='Importación cancelada; los lotes ya importados se conservan')
+            estado = trabajos.CANCELADO
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception('Error en la importación %s', trabajo_id)
+            actualizar_trabajo(trabajo_id, estado=trabajos.ERROR, finalizado=datetime.utcnow(), mensaje=str(e))
+        finally:
+            metricas.registrar_importacion(tipo, estado, leidas, time.perf_counter() - inicio)
+            _eliminar_archivo(ruta)
+            db.session.remove()
+
+def _eliminar_archivo(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+def revisar_trabajo(trabajo):
+    """
+    Marca como interrumpido un trabajo activo sin latido en los últimos
+    TRABAJOS_LATIDO_LIMITE segundos (su proceso terminó, por ejemplo un worker
+    reiniciado, en esta u otra máquina). La condición se evalúa en el mismo
+    UPDATE para no pisar un latido concurrente.
+    """
+    if trabajo.terminado:
+        return
+    limite = datetime.utcnow() - timedelta(seconds=current_app.config['TRABAJOS_LATIDO_LIMITE'])
+    interrumpido = db.session.execute(
+        db.update(TrabajoImportacion).where(
+            TrabajoImportacion.id == trabajo.id,
+            TrabajoImportacion.estado.in_(trabajos.ESTADOS_ACTIVOS),
+            db.func.coalesce(TrabajoImportacion.latido, TrabajoImportacion.creado) < limite
+        ).values(
+            estado=trabajos.INTERRUMPIDO, finalizado=datetime.utcnow(),
+            mensaje=('El proceso que ejecutaba la importación dejó de responder. Los lotes ya importados se '
+                     'conservan; al volver a importar el archivo se omiten como duplicados.')
+        )
+    ).rowcount
+    db.session.commit()
+    if interrumpido:
+        _eliminar_archivo(os.path.join(current_app.config['TRABAJOS_DIRECTORIO'], f'{trabajo.id}.csv'))
+
+def prefiere_json():
+    """Indica si el cliente pidió la respuesta en JSON (cabecera Accept)"""
+    return request.accept_mimetypes.best == 'application/json'
+
+# Funciones de la API JSON
+# Grupos de campos opcionales de /api/registros (parámetro fields=)
+CAMPOS_API = {grupo: columnas for grupo, columnas in GRUPOS_REGISTRO.items() if grupo != 'basicos'}
+CAMPOS_API_BASICOS = ['id', 'fecha', 'peso', 'altura', 'imc']
+
+class ErrorApi(Exception):
+    """Parámetro inválido en una petición a la API (respuesta 400)"""
+
+@bp.errorhandler(ErrorApi)
+def error_api(error):
+    return jsonify({'error': str(error)}), 400
+
+def codificar_cursor(fecha, registro_id):
+    """Cursor opaco de paginación por (fecha, id)"""
+    return base64.urlsafe_b64encode(f'{fecha.isoformat()}|{registro_id}'.encode()).decode().rstrip('=')
+
+def decodificar_cursor(cursor):
+    """Fecha e id de un cursor de paginación"""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        fecha, registro_id = texto.split('|')
+        return datetime.fromisoformat(fecha), int(registro_id)
+    except ValueError:
+        raise ErrorApi('Cursor inválido')
+
+def leer_limite():
+    """Cantidad de registros por página pedida con ``limit``"""
+    limite = request.args.get('limit', current_app.config['API_LIMITE_DEFECTO'])
+    try:
+        limite = int(limite)
+    except ValueError:
+        raise ErrorApi('limit debe ser un número entero')
+    if not 1 <= limite <= current_app.config['API_LIMITE_MAXIMO']:
+        raise ErrorApi(f"limit debe estar entre 1 y {current_app.config['API_LIMITE_MAXIMO']}")
+    return limite
+
+def leer_campos():
+    """Grupos de campos opcionales pedidos con ``fields`` (separados por comas)"""
+    grupos = [g.strip() for g in request.args.get('fields', '').split(',') if g.strip()]
+    desconocidos = [g for g in grupos if g not in CAMPOS_API]
+    if desconocidos:
+        raise ErrorApi(f"Campos desconocidos: {', '.join(desconocidos)} (disponibles: {', '.join(CAMPOS_API)})")
+    return grupos
+
+# Métricas de /api/series y su unidad
+METRICAS_SERIE = {
+    'peso': 'kg',
+    'imc': 'kg/m²',
+    'porcentaje_grasa': '%',
+    'spc': 'mm',
+    **{columna: 'cm' for columna in COLUMNAS_CIRCUNFERENCIAS},
+}
+
+# Inicio del período de cada agrupación de /api/series (funciones de fecha de SQLite)
+AGRUPACIONES_SERIE = {
+    'dia': lambda fecha: db.func.date(fecha),
+    'semana': lambda fecha: db.func.date(fecha, '-6 days', 'weekday 1'),  # lunes de la semana
+    'mes': lambda fecha: db.func.strftime('%Y-%m-01', fecha),
+}
+
+def leer_fecha_parametro(nombre, fin=False):
+    """
+    Fecha del parámetro ``nombre`` (ISO, con o sin hora; None si falta). Con
+    ``fin`` una fecha sin hora abarca el día completo (se retorna el día siguiente).
+    """
+    valor = request.args.get(nombre)
+    if not valor:
+        return None
+    try:
+        fecha = datetime.fromisoformat(valor)
+    except ValueError:
+        raise ErrorApi(f'{nombre} debe ser una fecha ISO (AAAA-MM-DD o AAAA-MM-DDTHH:MM:SS)')
+    if fecha.tzinfo is not None:
+        raise ErrorApi(f'{nombre} no debe incluir zona horaria')
+    if fin and len(valor) == 10:
+        fecha += timedelta(days=1)
+    return fecha
+
+def leer_puntos():
+    """Cantidad máxima de puntos pedida con ``puntos``"""
+    puntos = request.args.get('puntos', current_app.config['SERIES_PUNTOS_DEFECTO'])
+    try:
+        puntos = int(puntos)
+    except ValueError:
+        raise ErrorApi('puntos debe ser un número entero')
+    if not 3 <= puntos <= current_app.config['SERIES_PUNTOS_MAXIMO']:
+        raise ErrorApi(f"puntos debe estar entre 3 y {current_app.config['SERIES_PUNTOS_MAXIMO']}")
+    return puntos
+
+def consulta_serie(usuario_id, metrica, desde=None, hasta=None):
+    """
+    Columna, origen (FROM) y condiciones para leer la serie de una métrica de
+    un usuario entre ``desde`` (inclusive) y ``hasta`` (exclusive), sin los
+    registros que no la tienen.
+    """
+    registros = RegistroFisico.__table__
+    medidas = MedidasRegistro.__table__
+    if metrica in registros.c:
+        columna = registros.c[metrica]
+        origen = registros
+    else:
+        columna = medidas.c[metrica]
+        origen = registros.join(medidas, medidas.c.registro_id == registros.c.id)
+    # Un valor 0 (métricas sin pliegues) es un valor ausente
+    condiciones = [registros.c.usuario_id == usuario_id, columna.is_not(None), columna != 0]
+    if desde is not None:
+        condiciones.append(registros.c.fecha >= desde)
+    if hasta is not None:
+        condiciones.append(registros.c.fecha < hasta)
+    return columna, origen, condiciones
+
+def serie_usuario(usuario_id, metrica, desde=None, hasta=None, agrupar=None, puntos=None):
+    """
+    Serie temporal de una métrica de un usuario entre ``desde`` (inclusive) y
+    ``hasta`` (exclusive), sin los registros que no la tienen. Con ``agrupar``
+    (clave de AGRUPACIONES_SERIE) retorna por período, calculados en SQL, el
+    inicio, la cantidad de registros y el mínimo, la media y el máximo; si no,
+    los puntos (fecha, valor), reducidos con LTTB a ``puntos`` si hay más.
+    Retorna los nombres de las columnas, las filas y el total de registros.
+    """
+    registros = RegistroFisico.__table__
+    columna, origen, condiciones = consulta_serie(usuario_id, metrica, desde, hasta)
+    
+    if agrupar:
+        inicio = AGRUPACIONES_SERIE[agrupar](registros.c.fecha).label('inicio')
+        consulta = db.select(
+            inicio, db.func.count(), db.func.min(columna), db.func.avg(columna), db.func.max(columna)
+        ).select_from(origen).where(*condiciones).group_by(inicio).order_by(inicio)
+        filas = [[inicio, cantidad, minimo, round(media, 2), maximo]
+                 for inicio, cantidad, minimo, media, maximo in db.session.execute(consulta)]
+        return ['inicio', 'cantidad', 'minimo', 'media', 'maximo'], filas, sum(fila[1] for fila in filas)
     
-    # Leer el CSV
-    csv_reader = csv.reader(io.StringIO(csv_content))
-    rows = list(csv_reader)
+    consulta = db.select(registros.c.fecha, columna).select_from(origen).where(*condiciones).order_by(
+        registros.c.fecha, registros.c.id
+    )
+    fechas, valores = [], []
+    for fecha, valor in db.session.execute(consulta):
+        fechas.append(fecha)
+        valores.append(valor)
+    total = len(fechas)
+    if puntos is not None and total > puntos:
+        elegidos = series.lttb(series.segundos(fechas), valores, puntos).tolist()
+        fechas = [fechas[i] for i in elegidos]
+        valores = [valores[i] for i in elegidos]
+    return ['fecha', 'valor'], [[fecha.isoformat(), valor] for fecha, valor in zip(fechas, valores)], total
+
+def serie_tendencia(usuario_id, metrica, desde=None, hasta=None, puntos=None):
+    """
+    Serie de una métrica de un usuario con su media móvil, EMA y cambio
+    semanal en cada punto (``tendencias.suavizar``). Se suaviza la serie
+    completa y luego se recorta a ``desde``/``hasta``, para que el inicio del
+    período no pierda la historia previa; se reduce con LTTB a ``puntos``.
+    Retorna los nombres de las columnas, las filas y el total de registros.
+    """
+    registros = RegistroFisico.__table__
+    columna, origen, condiciones = consulta_serie(usuario_id, metrica)
+    consulta = db.select(registros.c.fecha, columna).select_from(origen).where(*condiciones).order_by(
+        registros.c.fecha, registros.c.id
+    )
+    filas = db.session.execute(consulta).all()
+    fechas = [fila[0] for fila in filas]
+    valores = [fila[1] for fila in filas]
+    medias, emas, cambios = tendencias.suavizar(fechas, valores)
     
-    if len(rows) < 2:
-        return registros
+    inicio = bisect.bisect_left(fechas, desde) if desde is not None else 0
+    fin = bisect.bisect_left(fechas, hasta) if hasta is not None else len(fechas)
+    elegidos = range(inicio, fin)
+    if puntos is not None and len(elegidos) > puntos:
+        elegidos = (inicio + series.lttb(series.segundos(fechas[inicio:fin]), valores[inicio:fin], puntos)).tolist()
+    redondear = lambda valor: None if math.isnan(valor) else round(float(valor), 3)
+    datos = [[fechas[i].isoformat(), valores[i], redondear(medias[i]), redondear(emas[i]), redondear(cambios[i])]
+             for i in elegidos]
+    return ['fecha', 'valor', 'media_movil', 'ema', 'cambio_semanal'], datos, fin - inicio
+
+def validadores_usuario(usuario):
+    """
+    ETag y fecha de última modificación de los datos de un usuario para la
+    petición actual. El ETag sale de la versión de datos (que cambia con cada
+    escritura), las normas activas y la URL; Last-Modified, con resolución de
+    un segundo, es solo el validador de respaldo.
+    """
+    modificado = (usuario.datos_modificados or usuario.fecha_creacion or datetime(1970, 1, 1)).replace(tzinfo=timezone.utc)
+    huella = f'{request.path}?{request.query_string.decode()}|{usuario.version_datos}|{normas.activas().clave}'
+    return hashlib.sha1(huella.encode()).hexdigest(), modificado.replace(microsecond=0)
+
+def no_modificado(etag, ultima_modificacion):
+    """
+    Indica si el cliente ya tiene la versión actual: con If-None-Match decide
+    solo el ETag; If-Modified-Since se usa únicamente si no se envió ETag.
+    """
+    if request.if_none_match:
+        return etag in request.if_none_match
+    if request.if_modified_since:
+        return ultima_modificacion <= request.if_modified_since
+    return False
+
+def json_en_cache(usuario, generar):
+    """
+    Respuesta JSON de una vista de la API con los datos de un usuario.
     
-    # Procesar filas de datos (saltar header)
-    i = 1
-    fecha_actual = None
+    Responde 304 si el cliente tiene la versión actual; si no, sirve el JSON
+    desde la caché de páginas (clave por vista, versión de datos del usuario,
+    normas activas y URL) o lo genera con ``generar()`` y lo guarda.
+    """
+    etag, ultima_modificacion = validadores_usuario(usuario)
+    if no_modificado(etag, ultima_modificacion):
+        return respuesta_condicional(Response(status=304), etag, ultima_modificacion)
     
-    while i < len(rows):
-        row = rows[i]
-        
-        # Si la fila está vacía o solo tiene comas, saltar
-        if not row or all(cell.strip() == '' for cell in row):
-            i += 1
-            continue
-        
-        # Verificar si la fila contiene una fecha
-        if len(row) > 0 and row[0].strip() and not row[0].strip().endswith('am') and not row[0].strip().endswith('pm'):
-            # Esta fila podría contener una fecha
-            fecha_str = row[0].strip()
-            try:
-                # Parsear fecha (formato: " 22 Sep 2025")
-                fecha_clean = fecha_str.strip()
-                # Convertir mes en español a inglés
-                meses_es = {
-                    'Ene': 'Jan', 'Feb': 'Feb', 'Mar': 'Mar', 'Abr': 'Apr',
-                    'May': 'May', 'Jun': 'Jun', 'Jul': 'Jul', 'Ago': 'Aug',
-                    'Sep': 'Sep', 'Oct': 'Oct', 'Nov': 'Nov', 'Dic': 'Dec'
-                }
-                for es, en in meses_es.items():
-                    fecha_clean = fecha_clean.replace(es, en)
-                
-                fecha_actual = datetime.strptime(fecha_clean.strip(), '%d %b %Y').date()
-                i += 1
-                continue
-            except (ValueError, AttributeError):
-                i += 1
-                continue
-        
-        # Si tenemos una fecha y esta fila contiene hora y peso
-        if fecha_actual and len(row) >= 2:
-            hora_str = row[0].strip()
-            peso_str = row[1].strip()
-            imc_str = row[3].strip() if len(row) >= 4 else None
-            
-            try:
-                # Parsear hora (formato: "10:12 am")
-                hora_clean = hora_str.strip()
-                hora = datetime.strptime(hora_clean, '%I:%M %p').time()
-                
-                # Combinar fecha y hora
-                fecha_hora = datetime.combine(fecha_actual, hora)
-                
-                # Parsear peso (formato: "98.7 kg")
-                peso_match = re.search(r'(\d+\.?\d*)\s*kg', peso_str)
-                if peso_match:
-                    peso = float(peso_match.group(1))
-                else:
-                    i += 1
-                    continue
-                
-                # Parsear IMC si está disponible
-                imc = None
-                if imc_str and imc_str.strip() != '--':
-                    try:
-                        imc = float(imc_str.strip())
-                    except ValueError:
-                        pass
-                
-                registros.append({
-                    'fecha_hora': fecha_hora,
-                    'peso': peso,
-                    'imc': imc
-                })
-                
-            except (ValueError, AttributeError) as e:
-                # Si hay error parseando esta fila, continuar con la siguiente
-                pass
-        
-        i += 1
+    almacen = current_app.extensions.get('cache_respuestas')
+    clave = f'{request.endpoint}|{usuario.id}|{usuario.version_datos}|{normas.activas().clave}|{request.full_path}'
+    contenido = almacen.obtener(clave) if almacen is not None else None
+    estado = 'HIT'
+    if contenido is None:
+        contenido = json.dumps(generar(), ensure_ascii=False, separators=(',', ':'))
+        if almacen is not None:
+            almacen.guardar(clave, contenido)
+        estado = 'MISS'
     
-    return registros
+    respuesta = Response(contenido, mimetype='application/json')
+    respuesta.headers['X-Cache'] = estado
+    return respuesta_condicional(respuesta, etag, ultima_modificacion)
+
+def respuesta_condicional(respuesta, etag, ultima_modificacion):
+    """
+    Agrega los validadores de caché a una respuesta de la API. Last-Modified se
+    omite si los datos cambiaron en el segundo en curso: otra escritura en ese
+    mismo segundo no cambiaría la fecha y If-Modified-Since daría un 304 falso.
+    """
+    respuesta.set_etag(etag)
+    if ultima_modificacion < datetime.now(timezone.utc).replace(microsecond=0):
+        respuesta.last_modified = ultima_modificacion
+    respuesta.cache_control.private = True
+    respuesta.cache_control.no_cache = True
+    return respuesta
 
 # Rutas
-@app.route('/')
+# Caché de páginas por usuario
+def version_datos_usuario(usuario_id):
+    """Versión de datos del usuario (None si no existe)"""
+    return db.session.scalar(db.select(Usuario.version_datos).filter_by(id=usuario_id))
+
+def usuario_de_registro(id):
+    """Usuario dueño de un registro (None si el registro no existe)"""
+    return db.session.scalar(db.select(RegistroFisico.usuario_id).filter_by(id=id))
+
+def cache_por_usuario(usuario_de_vista):
+    """
+    Sirve desde la caché de páginas el HTML de una vista GET de un usuario.
+
+    ``usuario_de_vista`` recibe los argumentos de la vista y retorna el id del
+    usuario. La clave incluye la versión de sus datos, las normas activas, la
+    fecha (las edades dependen del día) y la URL con sus parámetros, de modo
+    que cualquier escritura invalida sus páginas.
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(**argumentos):
+            almacen = current_app.extensions.get('cache_respuestas')
+            # Las páginas con mensajes flash pendientes no se leen ni se guardan en la caché
+            if almacen is None or session.get('_flashes'):
+                return vista(**argumentos)
+            usuario_id = usuario_de_vista(**argumentos)
+            version = version_datos_usuario(usuario_id) if usuario_id is not None else None
+            if version is None:
+                return vista(**argumentos)
+            clave = (f'{vista.__name__}|{usuario_id}|{version}|{normas.activas().clave}|'
+                     f'{datetime.now().date().isoformat()}|{request.full_path}')
+            html = almacen.obtener(clave)
+            estado = 'HIT'
+            if html is None:
+                html = vista(**argumentos)
+                if not isinstance(html, str):
+                    return html
+                almacen.guardar(clave, html)
+                estado = 'MISS'
+            respuesta = make_response(html)
+            respuesta.headers['X-Cache'] = estado
+            return respuesta
+        return envoltura
+    return decorador
+
+@bp.route('/')
 def index():
     usuarios = Usuario.query.filter_by(activo=True).all()
     return render_template('index.html', usuarios=usuarios)
 
-@app.route('/usuario/<int:usuario_id>')
+@bp.route('/usuario/<int:usuario_id>')
+@cache_por_usuario(lambda usuario_id: usuario_id)
 def ver_usuario(usuario_id):
     usuario = Usuario.query.get_or_404(usuario_id)
-    registros = RegistroFisico.query.filter_by(usuario_id=usuario_id).order_by(RegistroFisico.fecha.desc()).limit(10).all()
+    registros = consultar_registros().filter_by(usuario_id=usuario_id).order_by(RegistroFisico.fecha.desc()).limit(10).all()
     return render_template('usuario.html', usuario=usuario, registros=registros)
 
-@app.route('/usuarios')
+@bp.route('/usuarios')
 def gestion_usuarios():
-    usuarios = Usuario.query.order_by(Usuario.nombre, Usuario.apellido).all()
-    return render_template('usuarios.html', usuarios=usuarios)
+    total = db.session.scalar(db.select(db.func.count(Usuario.id)))
+    paginacion = Paginacion(request.args.get('pagina', 1, type=int), current_app.config['USUARIOS_POR_PAGINA'], total)
+    usuarios = Usuario.query.options(Usuario.con_agregado()).order_by(Usuario.nombre, Usuario.apellido) \
+        .limit(paginacion.por_pagina).offset(paginacion.desplazamiento).all()
+    return render_template('usuarios.html', usuarios=usuarios, paginacion=paginacion)
 
-@app.route('/nuevo_usuario', methods=['GET', 'POST'])
+@bp.route('/nuevo_usuario', methods=['GET', 'POST'])
 def nuevo_usuario():
     if request.method == 'POST':
         try:
@@ -892,22 +1789,27 @@ def nuevo_usuario():
             db.session.add(usuario)
             db.session.commit()
             flash('Usuario creado exitosamente!', 'success')
-            return redirect(url_for('gestion_usuarios'))
+            return redirect(url_for('main.gestion_usuarios'))
         except Exception as e:
             flash(f'Error al crear el usuario: {str(e)}', 'error')
     
     return render_template('nuevo_usuario.html')
 
-@app.route('/editar_usuario/<int:usuario_id>', methods=['GET', 'POST'])
+@bp.route('/editar_usuario/<int:usuario_id>', methods=['GET', 'POST'])
 def editar_usuario(usuario_id):
     usuario = Usuario.query.get_or_404(usuario_id)
     
     if request.method == 'POST':
         try:
+            datos_previos = (usuario.fecha_nacimiento, usuario.genero)
             usuario.nombre = request.form['nombre']
             usuario.apellido = request.form['apellido']
             usuario.fecha_nacimiento = datetime.strptime(request.form['fecha_nacimiento'], '%Y-%m-%d').date() if request.form.get('fecha_nacimiento') else None
             usuario.genero = request.form.get('genero')
+            
+            # La edad y el género determinan las métricas guardadas de todos sus registros
+            if (usuario.fecha_nacimiento, usuario.genero) != datos_previos:
+                recalcular_metricas_usuario(usuario)
             usuario.activo = 'activo' in request.form
             
             # Actualizar altura si se proporciona
@@ -918,23 +1820,25 @@ def editar_usuario(usuario_id):
                 except ValueError:
                     pass  # Si no es un número válido, no actualizar
             
+            usuario.registrar_cambio_datos()
             db.session.commit()
             flash('Usuario actualizado exitosamente!', 'success')
-            return redirect(url_for('gestion_usuarios'))
+            return redirect(url_for('main.gestion_usuarios'))
         except Exception as e:
             flash(f'Error al actualizar el usuario: {str(e)}', 'error')
     
     return render_template('editar_usuario.html', usuario=usuario)
 
-@app.route('/eliminar_usuario/<int:usuario_id>', methods=['POST'])
+@bp.route('/eliminar_usuario/<int:usuario_id>', methods=['POST'])
 def eliminar_usuario(usuario_id):
     usuario = Usuario.query.get_or_404(usuario_id)
     usuario.activo = False
+    usuario.registrar_cambio_datos()
     db.session.commit()
     flash('Usuario desactivado exitosamente!', 'success')
-    return redirect(url_for('gestion_usuarios'))
+    return redirect(url_for('main.gestion_usuarios'))
 
-@app.route('/nuevo_registro/<int:usuario_id>', methods=['GET', 'POST'])
+@bp.route('/nuevo_registro/<int:usuario_id>', methods=['GET', 'POST'])
 def nuevo_registro(usuario_id):
     usuario = Usuario.query.get_or_404(usuario_id)
     
@@ -1048,33 +1952,44 @@ def nuevo_registro(usuario_id):
                 observaciones=request.form.get('observaciones', '')
             )
             
-            # Calcular IMC
+            # Calcular IMC y métricas derivadas
             registro.imc = registro.calcular_imc()
+            registro.actualizar_metricas(usuario)
             
             # Guardar en la base de datos
             db.session.add(registro)
+            db.session.flush()
+            actualizar_agregado(usuario_id, agregadas=[fila_agregado(registro)])
+            usuario.registrar_cambio_datos()
             db.session.commit()
             
             flash('Registro guardado exitosamente!', 'success')
-            return redirect(url_for('ver_usuario', usuario_id=usuario_id))
+            return redirect(url_for('main.ver_usuario', usuario_id=usuario_id))
             
+        except IntegrityError:
+            db.session.rollback()
+            flash('Ya existe un registro para esa fecha y hora', 'error')
+            return redirect(url_for('main.nuevo_registro', usuario_id=usuario_id))
         except Exception as e:
             flash(f'Error al guardar el registro: {str(e)}', 'error')
-            return redirect(url_for('nuevo_registro', usuario_id=usuario_id))
+            return redirect(url_for('main.nuevo_registro', usuario_id=usuario_id))
     
     return render_template('nuevo_registro.html', usuario=usuario)
 
-@app.route('/ver_registro/<int:id>')
+@bp.route('/ver_registro/<int:id>')
+@cache_por_usuario(usuario_de_registro)
 def ver_registro(id):
-    registro = RegistroFisico.query.get_or_404(id)
+    registro = consultar_registros(*GRUPOS_REGISTRO).get_or_404(id)
     return render_template('ver_registro.html', registro=registro)
 
-@app.route('/editar_registro/<int:id>', methods=['GET', 'POST'])
+@bp.route('/editar_registro/<int:id>', methods=['GET', 'POST'])
 def editar_registro(id):
-    registro = RegistroFisico.query.get_or_404(id)
+    registro = consultar_registros(*GRUPOS_REGISTRO).get_or_404(id)
     
     if request.method == 'POST':
         try:
+            previo = fila_agregado(registro)
+            
             # Función auxiliar para convertir string a float de forma segura
             def safe_float(value):
                 if value and value.strip():
@@ -1181,113 +2096,229 @@ def editar_registro(id):
             registro.circunferencia_pantorrilla = safe_float(request.form.get('circunferencia_pantorrilla'))
             registro.observaciones = request.form.get('observaciones', '')
             
-            # Recalcular IMC
+            # Recalcular IMC y métricas derivadas
             registro.imc = registro.calcular_imc()
+            registro.actualizar_metricas()
+            actualizar_agregado(registro.usuario_id, agregadas=[fila_agregado(registro)], quitadas=[previo])
+            registro.usuario.registrar_cambio_datos()
             
             db.session.commit()
             flash('Registro actualizado exitosamente!', 'success')
-            return redirect(url_for('ver_registro', id=id))
+            return redirect(url_for('main.ver_registro', id=id))
             
+        except IntegrityError:
+            db.session.rollback()
+            flash('Ya existe un registro para esa fecha y hora', 'error')
         except Exception as e:
             flash(f'Error al actualizar el registro: {str(e)}', 'error')
     
     return render_template('editar_registro.html', registro=registro)
 
-@app.route('/eliminar_registro/<int:id>', methods=['POST'])
+@bp.route('/eliminar_registro/<int:id>', methods=['POST'])
 def eliminar_registro(id):
-    registro = RegistroFisico.query.get_or_404(id)
+    registro = consultar_registros('metricas').get_or_404(id)
+    registro.usuario.registrar_cambio_datos()
+    previo = fila_agregado(registro)
     db.session.delete(registro)
+    actualizar_agregado(registro.usuario_id, quitadas=[previo])
     db.session.commit()
     flash('Registro eliminado exitosamente!', 'success')
-    return redirect(url_for('ver_usuario', usuario_id=registro.usuario_id))
+    return redirect(url_for('main.ver_usuario', usuario_id=registro.usuario_id))
 
-@app.route('/estadisticas/<int:usuario_id>')
+@bp.route('/estadisticas/<int:usuario_id>')
+@cache_por_usuario(lambda usuario_id: usuario_id)
 def estadisticas(usuario_id):
     usuario = Usuario.query.get_or_404(usuario_id)
-    registros = RegistroFisico.query.filter_by(usuario_id=usuario_id).order_by(RegistroFisico.fecha.desc()).all()
+    agregado = obtener_agregado(usuario_id)
     
-    if not registros:
+    if not agregado.total_registros:
         return render_template('estadisticas.html', estadisticas=None, usuario=usuario)
     
-    # Calcular estadísticas básicas
-    pesos = [r.peso for r in registros]
-    imcs = [r.imc for r in registros]
-    
-    # Calcular estadísticas de grasa corporal
-    porcentajes_grasa = []
-    spc_valores = []
-    for registro in registros:
-        porcentaje = registro.calcular_porcentaje_grasa()
-        if porcentaje:
-            porcentajes_grasa.append(porcentaje)
-        
-        spc = registro.calcular_spc_aaherd()
-        if spc:
-            spc_valores.append(spc)
+    # Historial paginado (el total sale de los agregados)
+    opciones_por_pagina = current_app.config['HISTORIAL_POR_PAGINA']
+    por_pagina = request.args.get('por_pagina', opciones_por_pagina[0], type=int)
+    if por_pagina not in opciones_por_pagina:
+        por_pagina = opciones_por_pagina[0]
+    orden = 'asc' if request.args.get('orden') == 'asc' else 'desc'
+    paginacion = Paginacion(request.args.get('pagina', 1, type=int), por_pagina, agregado.total_registros)
+    registros = historial_registros(usuario_id, paginacion, orden)
     
-    # Obtener información AAHPERD del registro más reciente
-    registro_actual = registros[0] if registros else None
-    spc_actual = registro_actual.calcular_spc_aaherd() if registro_actual else None
-    percentila_spc_actual = registro_actual.calcular_percentila_spc_aaherd() if registro_actual else None
-    clasificacion_spc_actual = registro_actual.clasificar_spc_aaherd() if registro_actual else (None, None)
-    interpretacion_motivacional = registro_actual.obtener_interpretacion_motivacional() if registro_actual else (None, None, None)
+    # Información AAHPERD y de grasa corporal del registro más reciente
+    registro_actual = leer_registros(
+        seleccionar_registros(GRUPOS_REGISTRO['basicos'] + GRUPOS_REGISTRO['metricas'])
+        .where(RegistroFisico.id == agregado.ultimo_registro_id)
+    )[0]
     
     estadisticas = {
-        'total_registros': len(registros),
-        'peso_actual': pesos[0] if pesos else 0,
-        'peso_inicial': pesos[-1] if pesos else 0,
-        'diferencia_peso': pesos[0] - pesos[-1] if len(pesos) > 1 else 0,
-        'peso_promedio': sum(pesos) / len(pesos),
-        'peso_minimo': min(pesos),
-        'peso_maximo': max(pesos),
-        'imc_actual': imcs[0] if imcs else 0,
-        'imc_promedio': sum(imcs) / len(imcs),
-        'clasificacion_actual': registros[0].clasificacion_imc() if registros else 'N/A',
-        'porcentaje_grasa_actual': porcentajes_grasa[0] if porcentajes_grasa else None,
-        'porcentaje_grasa_promedio': sum(porcentajes_grasa) / len(porcentajes_grasa) if porcentajes_grasa else None,
-        'percentila_grasa_actual': registros[0].calcular_percentila_grasa() if registros else None,
-        'clasificacion_grasa_actual': registros[0].clasificar_grasa_corporal() if registros else (None, None),
-        'progreso_grasa': registros[0].calcular_progreso_grasa() if registros else (None, None, None, None),
+        'total_registros': agregado.total_registros,
+        'peso_actual': agregado.peso_actual,
+        'peso_inicial': agregado.peso_inicial,
+        'diferencia_peso': agregado.peso_actual - agregado.peso_inicial if agregado.total_registros > 1 else 0,
+        'peso_promedio': agregado.peso_promedio,
+        'peso_minimo': agregado.peso_minimo,
+        'peso_maximo': agregado.peso_maximo,
+        'imc_actual': registro_actual.imc,
+        'imc_promedio': agregado.imc_promedio,
+        'clasificacion_actual': registro_actual.clasificacion_imc(),
+        'porcentaje_grasa_actual': agregado.ultima_grasa,
+        'porcentaje_grasa_promedio': agregado.grasa_promedio,
+        'percentila_grasa_actual': registro_actual.calcular_percentila_grasa(),
+        'clasificacion_grasa_actual': registro_actual.clasificar_grasa_corporal(),
+        'progreso_grasa': registro_actual.calcular_progreso_grasa(),
         # Nuevas estadísticas AAHPERD
-        'spc_actual': spc_actual,
-        'spc_promedio': sum(spc_valores) / len(spc_valores) if spc_valores else None,
-        'percentila_spc_actual': percentila_spc_actual,
-        'clasificacion_spc_actual': clasificacion_spc_actual,
-        'interpretacion_motivacional': interpretacion_motivacional
+        'spc_actual': registro_actual.calcular_spc_aaherd(),
+        'spc_promedio': agregado.spc_promedio,
+        'percentila_spc_actual': registro_actual.calcular_percentila_spc_aaherd(),
+        'clasificacion_spc_actual': registro_actual.clasificar_spc_aaherd(),
+        'interpretacion_motivacional': registro_actual.obtener_interpretacion_motivacional(),
+        # Tendencias (EMA, cambio semanal y fecha proyectada del siguiente nivel de grasa)
+        'tendencias': resumen_tendencias(usuario, agregado),
     }
     
-    return render_template('estadisticas.html', estadisticas=estadisticas, registros=registros, usuario=usuario)
+    return render_template('estadisticas.html', estadisticas=estadisticas, registros=registros, usuario=usuario,
+                           paginacion=paginacion, orden=orden, opciones_por_pagina=opciones_por_pagina)
 
-@app.route('/api/registros/<int:usuario_id>')
+@bp.route('/api/registros/<int:usuario_id>')
 def api_registros(usuario_id):
-    registros = RegistroFisico.query.filter_by(usuario_id=usuario_id).order_by(RegistroFisico.fecha.desc()).all()
-    return jsonify([{
-        'id': r.id,
-        'fecha': r.fecha.isoformat(),
-        'peso': r.peso,
-        'altura': r.altura,
-        'imc': r.imc,
-        'clasificacion': r.clasificacion_imc()
-    } for r in registros])
-
-@app.route('/exportar_registros/<int:usuario_id>')
+    """
+    Registros de un usuario, del más reciente al más antiguo, paginados por cursor.
+    
+    Parámetros: ``limit`` (registros por página), ``cursor`` (el de la página
+    siguiente, informado en el encabezado Link y en X-Next-Cursor) y ``fields``
+    (grupos opcionales: pliegues, circunferencias, metricas, observaciones).
+    """
+    usuario = Usuario.query.get_or_404(usuario_id)
+    limite = leer_limite()
+    grupos = leer_campos()
+    cursor = request.args.get('cursor')
+    
+    etag, ultima_modificacion = validadores_usuario(usuario)
+    if no_modificado(etag, ultima_modificacion):
+        return respuesta_condicional(Response(status=304), etag, ultima_modificacion)
+    
+    nombres = CAMPOS_API_BASICOS + [c for g in grupos for c in CAMPOS_API[g]]
+    consulta = seleccionar_registros(nombres).where(
+        RegistroFisico.usuario_id == usuario_id
+    ).order_by(RegistroFisico.fecha.desc(), RegistroFisico.id.desc()).limit(limite + 1)
+    if cursor:
+        consulta = consulta.where(db.tuple_(RegistroFisico.fecha, RegistroFisico.id) < decodificar_cursor(cursor))
+    filas = leer_registros(consulta)
+    
+    registros = []
+    for fila in filas[:limite]:
+        registro = fila._asdict()
+        registro['fecha'] = fila.fecha.isoformat()
+        registro['clasificacion'] = fila.clasificacion_imc()
+        if 'metricas' in grupos:
+            registro['nivel_grasa'] = fila.clasificar_grasa_corporal()[0]
+            registro['nivel_spc'] = fila.clasificar_spc_aaherd()[0]
+        registros.append(registro)
+    
+    respuesta = jsonify(registros)
+    if len(filas) > limite:
+        siguiente = codificar_cursor(filas[limite - 1].fecha, filas[limite - 1].id)
+        argumentos = {**request.args.to_dict(), 'cursor': siguiente}
+        respuesta.headers['Link'] = f'<{url_for("main.api_registros", usuario_id=usuario_id, **argumentos)}>; rel="next"'
+        respuesta.headers['X-Next-Cursor'] = siguiente
+    return respuesta_condicional(respuesta, etag, ultima_modificacion)
+
+@bp.route('/api/series/<int:usuario_id>')
+def api_series(usuario_id):
+    """
+    Serie temporal de una métrica de un usuario para gráficos.
+    
+    Parámetros: ``metrica`` (peso, imc, porcentaje_grasa, spc o una
+    circunferencia; por defecto peso), ``desde`` y ``hasta`` (fechas ISO;
+    ``hasta`` sin hora incluye ese día) y ``agrupar`` (dia, semana o mes:
+    mínimo, media y máximo por período) o ``puntos`` (máximo de puntos de la
+    serie sin agrupar, reducida con LTTB). La respuesta se guarda en la caché
+    de páginas por versión de datos del usuario e incluye ETag y Last-Modified.
+    """
+    usuario = Usuario.query.get_or_404(usuario_id)
+    metrica = request.args.get('metrica', 'peso')
+    if metrica not in METRICAS_SERIE:
+        raise ErrorApi(f"Métrica desconocida: {metrica} (disponibles: {', '.join(METRICAS_SERIE)})")
+    agrupar = request.args.get('agrupar')
+    if agrupar is not None and agrupar not in AGRUPACIONES_SERIE:
+        raise ErrorApi(f"agrupar debe ser {', '.join(AGRUPACIONES_SERIE)}")
+    puntos = None if agrupar else leer_puntos()
+    desde = leer_fecha_parametro('desde')
+    hasta = leer_fecha_parametro('hasta', fin=True)
+    
+    def generar():
+        columnas, filas, total = serie_usuario(usuario_id, metrica, desde, hasta, agrupar, puntos)
+        return {
+            'metrica': metrica,
+            'unidad': METRICAS_SERIE[metrica],
+            'agrupar': agrupar,
+            'total_registros': total,
+            'columnas': columnas,
+            'datos': filas,
+        }
+    return json_en_cache(usuario, generar)
+
+@bp.route('/api/tendencias/<int:usuario_id>')
+def api_tendencias(usuario_id):
+    """
+    Tendencia actual del peso y del porcentaje de grasa de un usuario: última
+    medición, EMA, valor de la recta de tendencia, cambio semanal y, para la
+    grasa, la fecha proyectada para el siguiente nivel. Se leen del estado
+    incremental guardado (O(1)).
+    
+    Con ``metrica`` (peso o porcentaje_grasa) incluye la serie de esa métrica
+    con la media móvil, la EMA y el cambio semanal en cada punto, recortada a
+    ``desde``/``hasta`` y reducida con LTTB a ``puntos``.
+    """
+    usuario = Usuario.query.get_or_404(usuario_id)
+    metrica = request.args.get('metrica')
+    if metrica is not None and metrica not in METRICAS_TENDENCIA:
+        raise ErrorApi(f"Métrica sin tendencia: {metrica} (disponibles: {', '.join(METRICAS_TENDENCIA)})")
+    puntos = leer_puntos()
+    desde = leer_fecha_parametro('desde')
+    hasta = leer_fecha_parametro('hasta', fin=True)
+    
+    def generar():
+        resumen = resumen_tendencias(usuario, obtener_agregado(usuario_id))
+        datos = {
+            nombre: None if valores is None else {
+                clave: valor.isoformat() if isinstance(valor, datetime)
+                else round(valor, 3) if isinstance(valor, float) else valor
+                for clave, valor in valores.items()
+            }
+            for nombre, valores in resumen.items()
+        }
+        if metrica is not None:
+            columnas, filas, total = serie_tendencia(usuario_id, metrica, desde, hasta, puntos)
+            datos['serie'] = {'metrica': metrica, 'total_registros': total, 'columnas': columnas, 'datos': filas}
+        return datos
+    return json_en_cache(usuario, generar)
+
+@bp.route('/exportar_registros/<int:usuario_id>')
 def exportar_registros(usuario_id):
-    """Exporta los registros de un usuario a CSV"""
+    """Exporta los registros de un usuario a CSV como una respuesta en streaming"""
     usuario = Usuario.query.get_or_404(usuario_id)
-    csv_content = export_registros_csv(usuario_id)
+    hay_registros = db.session.execute(
+        db.select(RegistroFisico.id).filter_by(usuario_id=usuario_id).limit(1)
+    ).first()
     
-    if not csv_content:
+    if not hay_registros:
         flash('No hay registros para exportar', 'warning')
-        return redirect(url_for('estadisticas', usuario_id=usuario_id))
+        return redirect(url_for('main.estadisticas', usuario_id=usuario_id))
     
-    from flask import Response
-    return Response(
-        csv_content,
-        mimetype='text/csv',
-        headers={'Content-Disposition': f'attachment; filename=registros_{usuario.nombre}_{usuario.apellido}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'}
-    )
+    contenido = export_registros_csv(usuario_id, current_app.config['EXPORTAR_TAMANO_LOTE'])
+    headers = {
+        'Content-Disposition': f'attachment; filename=registros_{usuario.nombre}_{usuario.apellido}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
+        'Vary': 'Accept-Encoding'
+    }
+    
+    # Comprimir al vuelo si el cliente lo acepta
+    if current_app.config['EXPORTAR_GZIP'] and 'gzip' in request.accept_encodings:
+        contenido = comprimir_gzip(contenido)
+        headers['Content-Encoding'] = 'gzip'
+    
+    return Response(stream_with_context(contenido), mimetype='text/csv', headers=headers)
 
-@app.route('/importar_registros/<int:usuario_id>', methods=['GET', 'POST'])
+@bp.route('/importar_registros/<int:usuario_id>', methods=['GET', 'POST'])
 def importar_registros(usuario_id):
     """Importa registros desde CSV"""
     usuario = Usuario.query.get_or_404(usuario_id)
@@ -1295,41 +2326,71 @@ def importar_registros(usuario_id):
     if request.method == 'POST':
         if 'archivo_csv' not in request.files:
             flash('No se seleccionó ningún archivo', 'error')
-            return redirect(url_for('importar_registros', usuario_id=usuario_id))
+            return redirect(url_for('main.importar_registros', usuario_id=usuario_id))
         
         archivo = request.files['archivo_csv']
         if archivo.filename == '':
             flash('No se seleccionó ningún archivo', 'error')
-            return redirect(url_for('importar_registros', usuario_id=usuario_id))
+            return redirect(url_for('main.importar_registros', usuario_id=usuario_id))
         
         if archivo and archivo.filename.endswith('.csv'):
             try:
-                csv_content = archivo.read().decode('utf-8')
-                registros_importados, errores = import_registros_csv(csv_content, usuario_id)
-                
-                if registros_importados:
-                    flash(f'Se importaron {len(registros_importados)} registros exitosamente', 'success')
-                
-                if errores:
-                    for error in errores:
-                        flash(error, 'warning')
-                
-                return redirect(url_for('estadisticas', usuario_id=usuario_id))
+                # La importación se procesa en segundo plano; la petición solo guarda el archivo
+                trabajo = crear_trabajo_importacion(usuario_id, 'registros', archivo)
+                return respuesta_trabajo_creado(trabajo)
                 
             except Exception as e:
                 flash(f'Error al procesar el archivo: {str(e)}', 'error')
-                return redirect(url_for('importar_registros', usuario_id=usuario_id))
+                return redirect(url_for('main.importar_registros', usuario_id=usuario_id))
         else:
             flash('El archivo debe ser un CSV', 'error')
-            return redirect(url_for('importar_registros', usuario_id=usuario_id))
+            return redirect(url_for('main.importar_registros', usuario_id=usuario_id))
     
     return render_template('importar_registros.html', usuario=usuario)
 
-@app.route('/guia_mediciones')
+def respuesta_trabajo_creado(trabajo):
+    """202 con el estado del trabajo para clientes JSON; redirección a la página de progreso para el navegador"""
+    if prefiere_json():
+        respuesta = jsonify(trabajo.resumen())
+        respuesta.status_code = 202
+        respuesta.headers['Location'] = url_for('main.api_trabajo', trabajo_id=trabajo.id)
+        return respuesta
+    return redirect(url_for('main.ver_trabajo', trabajo_id=trabajo.id))
+
+@bp.route('/trabajos/<int:trabajo_id>')
+def ver_trabajo(trabajo_id):
+    """Progreso y resultado de una importación en segundo plano"""
+    trabajo = TrabajoImportacion.query.get_or_404(trabajo_id)
+    revisar_trabajo(trabajo)
+    usuario = db.session.get(Usuario, trabajo.usuario_id)
+    return render_template('trabajo.html', trabajo=trabajo, usuario=usuario)
+
+@bp.route('/api/trabajos/<int:trabajo_id>')
+def api_trabajo(trabajo_id):
+    """Estado, progreso y resultado de una importación en JSON"""
+    trabajo = TrabajoImportacion.query.get_or_404(trabajo_id)
+    revisar_trabajo(trabajo)
+    respuesta = jsonify(trabajo.resumen())
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
+
+@bp.route('/trabajos/<int:trabajo_id>/cancelar', methods=['POST'])
+def cancelar_trabajo(trabajo_id):
+    """Pide cancelar una importación; se detiene después del lote en curso"""
+    trabajo = TrabajoImportacion.query.get_or_404(trabajo_id)
+    if not trabajo.terminado:
+        trabajo.cancelar = True
+        db.session.commit()
+    if prefiere_json():
+        return jsonify(trabajo.resumen()), 202
+    flash('Se pidió cancelar la importación', 'info')
+    return redirect(url_for('main.ver_trabajo', trabajo_id=trabajo_id))
+
+@bp.route('/guia_mediciones')
 def guia_mediciones():
     return render_template('guia_mediciones.html')
 
-@app.route('/importar_csv/<int:usuario_id>', methods=['GET', 'POST'])
+@bp.route('/importar_csv/<int:usuario_id>', methods=['GET', 'POST'])
 def importar_csv(usuario_id):
     usuario = Usuario.query.get_or_404(usuario_id)
     
@@ -1338,84 +2399,120 @@ def importar_csv(usuario_id):
             # Verificar que se subió un archivo
             if 'archivo_csv' not in request.files:
                 flash('No se seleccionó ningún archivo', 'error')
-                return redirect(url_for('importar_csv', usuario_id=usuario_id))
+                return redirect(url_for('main.importar_csv', usuario_id=usuario_id))
             
             archivo = request.files['archivo_csv']
             if archivo.filename == '':
                 flash('No se seleccionó ningún archivo', 'error')
-                return redirect(url_for('importar_csv', usuario_id=usuario_id))
+                return redirect(url_for('main.importar_csv', usuario_id=usuario_id))
             
             if not archivo.filename.lower().endswith('.csv'):
                 flash('El archivo debe ser un CSV', 'error')
-                return redirect(url_for('importar_csv', usuario_id=usuario_id))
-            
-            # Leer el contenido del archivo
-            contenido = archivo.read().decode('utf-8')
-            
-            # Parsear el CSV
-            registros_csv = parse_garmin_csv(contenido)
-            
-            if not registros_csv:
-                flash('No se pudieron extraer datos válidos del archivo CSV', 'error')
-                return redirect(url_for('importar_csv', usuario_id=usuario_id))
+                return redirect(url_for('main.importar_csv', usuario_id=usuario_id))
             
             # Verificar que el usuario tenga altura guardada
             if not usuario.altura:
                 flash('El usuario debe tener una altura configurada antes de importar datos. Por favor, edita el usuario y agrega su altura.', 'error')
-                return redirect(url_for('editar_usuario', usuario_id=usuario_id))
-            
-            # Crear registros en la base de datos
-            registros_creados = 0
-            registros_duplicados = 0
-            
-            for datos in registros_csv:
-                # Verificar si ya existe un registro para esta fecha/hora
-                registro_existente = RegistroFisico.query.filter_by(
-                    usuario_id=usuario_id,
-                    fecha=datos['fecha_hora']
-                ).first()
-                
-                if registro_existente:
-                    registros_duplicados += 1
-                    continue
-                
-                # Crear nuevo registro
-                registro = RegistroFisico(
-                    usuario_id=usuario_id,
-                    fecha=datos['fecha_hora'],
-                    peso=datos['peso'],
-                    altura=usuario.altura,
-                    imc=datos['imc'] if datos['imc'] else None
-                )
-                
-                # Calcular IMC si no se proporcionó
-                if not registro.imc:
-                    registro.imc = registro.calcular_imc()
-                
-                db.session.add(registro)
-                registros_creados += 1
+                return redirect(url_for('main.editar_usuario', usuario_id=usuario_id))
             
-            db.session.commit()
-            
-            # Mensaje de éxito
-            mensaje = f'Importación completada: {registros_creados} registros creados'
-            if registros_duplicados > 0:
-                mensaje += f', {registros_duplicados} registros duplicados omitidos'
-            
-            flash(mensaje, 'success')
-            return redirect(url_for('ver_usuario', usuario_id=usuario_id))
+            # La importación se procesa en segundo plano; la petición solo guarda el archivo
+            trabajo = crear_trabajo_importacion(usuario_id, 'garmin', archivo)
+            return respuesta_trabajo_creado(trabajo)
             
         except Exception as e:
             flash(f'Error al importar el archivo: {str(e)}', 'error')
-            return redirect(url_for('importar_csv', usuario_id=usuario_id))
+            return redirect(url_for('main.importar_csv', usuario_id=usuario_id))
     
-    return render_template('importar_csv.html', usuario=usuario)
+    registros_recientes = consultar_registros().filter_by(usuario_id=usuario_id) \
+        .order_by(RegistroFisico.fecha.desc()).limit(5).all()
+    return render_template('importar_csv.html', usuario=usuario, registros_recientes=registros_recientes)
+
+@bp.route('/healthz')
+def healthz():
+    """Verificación de vida: el proceso atiende peticiones (no consulta la base de datos)"""
+    respuesta = jsonify(estado='ok', pid=os.getpid())
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
+
+@bp.route('/readyz')
+def readyz():
+    """
+    Verificación de disponibilidad: la base de datos responde dentro de
+    READYZ_TIMEOUT_DB y su esquema está al día. Informa la versión del esquema,
+    la latencia del ping y el estado del pool; responde 503 si no está lista.
+    """
+    tiempo_maximo = current_app.config['READYZ_TIMEOUT_DB']
+    esperada = migraciones.MIGRACIONES[-1].version
+    consulta = db.select(db.func.max(migraciones.tabla_version.c.version))
+    version = None
+    try:
+        version, latencia = current_app.extensions['ping_db'].ejecutar(consulta, tiempo_maximo)
+        base_datos = {'ok': True, 'latencia_ms': round(latencia * 1000, 2)}
+    except TimeoutError:
+        base_datos = {'ok': False, 'error': f'La base de datos no respondió en {tiempo_maximo:g} s'}
+    except Exception as e:
+        base_datos = {'ok': False, 'error': str(getattr(e, 'orig', None) or e)}
+
+    al_dia = version is not None and version >= esperada
+    listo = base_datos['ok'] and al_dia
+    respuesta = jsonify(
+        estado='listo' if listo else 'no_listo',
+        pid=os.getpid(),
+        base_datos=base_datos,
+        esquema={'version': version, 'esperada': esperada, 'al_dia': al_dia},
+        pool=basedatos.estado_pool(db.engine)
+    )
+    respuesta.status_code = 200 if listo else 503
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
+
+@bp.route('/metrics')
+def metrics():
+    """Métricas en formato Prometheus (sumadas entre workers si hay METRICAS_DIRECTORIO)"""
+    if not current_app.config['METRICAS_HABILITADAS']:
+        return Response('Métricas desactivadas\n', status=404, mimetype='text/plain')
+    respuesta = Response(metricas.registro.texto(), content_type=metricas.TIPO_CONTENIDO)
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
+
+def create_app(config=None):
+    """
+    Crea la aplicación con la configuración del entorno.
+
+    ``config`` reemplaza valores de la configuración (por ejemplo
+    ``{'SQLALCHEMY_DATABASE_URI': 'sqlite://'}`` para usar una base en memoria en
+    pruebas y benchmarks). Importar este módulo no abre la base de datos: el
+    motor se crea aquí y las conexiones se abren con la primera consulta.
+    """
+    app = Flask(__name__)
+    app.config.update(configuracion_entorno())
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', basedatos.opciones_motor(app.config))
+    basedatos.crear_directorio(app.config['SQLALCHEMY_DATABASE_URI'])
+    normas.catalogo.configurar(
+        directorios=[normas.DIRECTORIO_NORMAS, app.config['NORMAS_DIR']],
+        poblacion=app.config['NORMAS_POBLACION'],
+        intervalo=app.config['NORMAS_INTERVALO_RECARGA']
+    )
+
+    db.init_app(app)
+    with app.app_context():
+        app.extensions['checkpoint_wal'] = basedatos.configurar_motor(db.engine, app.config)
+        app.extensions['ping_db'] = basedatos.PingBaseDatos(db.engine)
+        if app.config['METRICAS_HABILITADAS']:
+            metricas.instrumentar(app, db.engine)
+    app.extensions['cache_respuestas'] = cache.crear_cache(app.config)
+    app.extensions['trabajos'] = trabajos.EjecutorTrabajos(app.config['TRABAJOS_HILOS'])
+    app.register_blueprint(bp)
+    return app
 
 if __name__ == '__main__':
+    # Servidor de desarrollo; en producción: gunicorn -c gunicorn.conf.py wsgi:app
+    app = create_app()
     with app.app_context():
-        db.create_all()
+        inicializar_base_datos()
     
     # Configuración para Docker
-    host = '0.0.0.0' if os.environ.get('FLASK_ENV') == 'production' else '0.0.0.0'
+    host = '0.0.0.0'
     debug = os.environ.get('FLASK_ENV') != 'production'
     app.run(host=host, debug=debug)
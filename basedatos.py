@@ -0,0 +1,199 @@
+"""
+Configuración de SQLite para servir con varios procesos e hilos.
+
+Cada conexión nueva recibe los PRAGMA configurados (modo WAL, nivel de
+sincronización, caché, mmap, almacenamiento temporal y espera ante bloqueos)
+mediante el evento ``connect`` del motor de SQLAlchemy. En modo WAL los
+lectores no se bloquean mientras una importación escribe; un hilo de fondo
+ejecuta además un checkpoint periódico para que el archivo ``-wal`` no crezca
+sin límite entre los checkpoints automáticos. Los procesos hijos creados con
+fork (los workers de gunicorn) descartan las conexiones heredadas del pool.
+``PingBaseDatos`` y ``estado_pool`` sirven a la verificación de disponibilidad
+(``/readyz``).
+"""
+
+import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+MODOS_JOURNAL = ('WAL', 'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'OFF')
+NIVELES_SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+MODOS_TEMP_STORE = ('DEFAULT', 'FILE', 'MEMORY')
+MODOS_CHECKPOINT = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+
+def _opcion(config, clave, permitidos):
+    valor = str(config[clave]).upper()
+    if valor not in permitidos:
+        raise ValueError(f'{clave} inválido: {config[clave]} (valores posibles: {", ".join(permitidos)})')
+    return valor
+
+
+def pragmas(config):
+    """Lista de sentencias PRAGMA a ejecutar en cada conexión nueva"""
+    return [
+        f"PRAGMA journal_mode={_opcion(config, 'SQLITE_JOURNAL_MODE', MODOS_JOURNAL)}",
+        f"PRAGMA synchronous={_opcion(config, 'SQLITE_SYNCHRONOUS', NIVELES_SYNCHRONOUS)}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA temp_store={_opcion(config, 'SQLITE_TEMP_STORE', MODOS_TEMP_STORE)}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA wal_autocheckpoint={int(config['SQLITE_WAL_AUTOCHECKPOINT'])}",
+    ]
+
+
+def crear_directorio(uri):
+    """Crea el directorio de un archivo de base de datos SQLite si no existe"""
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+        directorio = os.path.dirname(os.path.abspath(url.database))
+        os.makedirs(directorio, exist_ok=True)
+
+
+def opciones_motor(config):
+    """Opciones del pool de conexiones para SQLALCHEMY_ENGINE_OPTIONS"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if uri in ('sqlite://', 'sqlite:///:memory:'):
+        # Las bases en memoria usan un pool de una conexión por hilo
+        return {}
+    return {
+        'pool_size': int(config['DB_POOL_SIZE']),
+        'max_overflow': int(config['DB_MAX_OVERFLOW']),
+        'pool_timeout': float(config['DB_POOL_TIMEOUT']),
+        'pool_recycle': int(config['DB_POOL_RECYCLE']),
+    }
+
+
+class CheckpointPeriodico:
+    """Hilo de fondo que ejecuta ``PRAGMA wal_checkpoint`` cada cierto intervalo"""
+
+    def __init__(self, motor, intervalo, modo='PASSIVE'):
+        self.motor = motor
+        self.intervalo = intervalo
+        self.modo = modo
+        self._detener = threading.Event()
+        self._hilo = None
+        self._pid = None
+
+    def iniciar(self):
+        """Inicia el hilo en el proceso actual (los hilos no sobreviven a un fork)"""
+        if self.intervalo <= 0 or (self._hilo is not None and self._pid == os.getpid()):
+            return
+        self._pid = os.getpid()
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._ejecutar, name='sqlite-checkpoint', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    def checkpoint(self):
+        """Ejecuta un checkpoint; retorna (ocupado, páginas en el WAL, páginas copiadas)"""
+        with self.motor.connect() as conexion:
+            resultado = conexion.exec_driver_sql(f'PRAGMA wal_checkpoint({self.modo})').first()
+        return tuple(resultado) if resultado else None
+
+    def _ejecutar(self):
+        while not self._detener.wait(self.intervalo):
+            try:
+                ocupado, paginas, copiadas = self.checkpoint()
+                if ocupado:
+                    logger.info('Checkpoint WAL incompleto: %s de %s páginas copiadas', copiadas, paginas)
+            except Exception:
+                logger.exception('Error en el checkpoint periódico de SQLite')
+
+
+class PingBaseDatos:
+    """
+    Consulta de verificación con tiempo máximo de espera.
+
+    La consulta se ejecuta en un hilo propio del proceso (se crea con el primer
+    ping de cada proceso, como el pool de trabajos): si la base no responde a
+    tiempo, la petición de verificación termina igual y los pings siguientes
+    esperan detrás del bloqueado, por lo que también fallan hasta que responda.
+    """
+
+    def __init__(self, motor):
+        self.motor = motor
+        self._hilo = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ejecutar(self, consulta, tiempo_maximo):
+        """Retorna (primer valor de la consulta, segundos); lanza TimeoutError si no responde a tiempo"""
+        with self._lock:
+            if self._hilo is None or self._pid != os.getpid():
+                self._hilo = ThreadPoolExecutor(1, thread_name_prefix='ping-db')
+                self._pid = os.getpid()
+        return self._hilo.submit(self._consultar, consulta).result(timeout=tiempo_maximo)
+
+    def _consultar(self, consulta):
+        inicio = time.perf_counter()
+        with self.motor.connect() as conexion:
+            valor = conexion.execute(consulta).scalar()
+        return valor, time.perf_counter() - inicio
+
+
+def estado_pool(motor):
+    """Estado del pool de conexiones del motor (los valores que informe su clase de pool)"""
+    pool = motor.pool
+    estado = {'clase': type(pool).__name__}
+    for clave, metodo in (('tamano', 'size'), ('en_uso', 'checkedout'), ('disponibles', 'checkedin'),
+                          ('desborde', 'overflow')):
+        if hasattr(pool, metodo):
+            estado[clave] = getattr(pool, metodo)()
+    return estado
+
+
+def _descartar_pool_al_bifurcar(motor):
+    """
+    Tras un fork (gunicorn con preload_app) el proceso hijo descarta las
+    conexiones heredadas del pool sin cerrarlas, para no compartir con el
+    proceso padre el mismo archivo abierto.
+    """
+    referencia = weakref.ref(motor)
+
+    def descartar():
+        motor_vivo = referencia()
+        if motor_vivo is not None:
+            motor_vivo.dispose(close=False)
+
+    os.register_at_fork(after_in_child=descartar)
+
+
+def configurar_motor(motor, config):
+    """
+    Registra los PRAGMA en las conexiones de un motor SQLite y prepara el
+    checkpoint periódico, que arranca con la primera conexión de cada proceso.
+    Retorna el ``CheckpointPeriodico`` (None si el motor no es SQLite).
+    """
+    _descartar_pool_al_bifurcar(motor)
+    if motor.dialect.name != 'sqlite':
+        return None
+    sentencias = pragmas(config)
+    checkpoint = CheckpointPeriodico(
+        motor,
+        float(config['SQLITE_CHECKPOINT_INTERVALO']),
+        _opcion(config, 'SQLITE_CHECKPOINT_MODO', MODOS_CHECKPOINT),
+    )
+
+    @event.listens_for(motor, 'connect')
+    def aplicar_pragmas(conexion_dbapi, registro_conexion):
+        cursor = conexion_dbapi.cursor()
+        try:
+            for sentencia in sentencias:
+                cursor.execute(sentencia)
+        finally:
+            cursor.close()
+        if config['SQLITE_JOURNAL_MODE'].upper() == 'WAL':
+            checkpoint.iniciar()
+
+    return checkpoint
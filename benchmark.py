@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Benchmarks de los caminos críticos de la aplicación.
+
+Crea una base SQLite temporal con datos sintéticos (``datos_sinteticos``) y
+mide el motor de composición corporal, la exportación e importación CSV, la
+lectura de exportaciones de Garmin y las rutas de estadísticas y de la API
+con el cliente de pruebas de Flask. Cada benchmark se ejecuta una vez de
+calentamiento y luego ``--repeticiones`` veces; se informan la mediana, el
+mínimo y la dispersión de cada uno.
+
+Uso::
+
+    python benchmark.py ejecutar --salida base.json
+    python benchmark.py ejecutar --usuarios 10 --registros 5000 --salida nuevo.json
+    python benchmark.py comparar base.json nuevo.json --umbral 0.10
+
+``comparar`` marca como regresión cada benchmark cuya mediana empeoró más
+que el umbral y termina con código 1 si hay alguna, para usarlo en CI. Los
+resultados solo son comparables si se tomaron en la misma máquina y con los
+mismos parámetros.
+"""
+
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+import composicion
+import datos_sinteticos
+from app import (
+    Usuario, calcular_metricas_lote, create_app, db, export_registros_csv, import_registros_csv,
+    importar_garmin_csv, inicializar_base_datos, parse_garmin_csv
+)
+
+VERSION_FORMATO = 1
+
+
+def medir(funcion, repeticiones, preparar=None):
+    """
+    Tiempos en segundos de ``repeticiones`` ejecuciones de ``funcion``, tras
+    una de calentamiento. ``preparar`` (opcional) se ejecuta antes de cada
+    llamada, fuera de la medición, y retorna sus argumentos. Como ``timeit``,
+    el recolector de basura se desactiva durante cada medición.
+    """
+    tiempos = []
+    for i in range(repeticiones + 1):
+        argumentos = preparar() if preparar else ()
+        gc.collect()
+        gc.disable()
+        try:
+            inicio = time.perf_counter()
+            funcion(*argumentos)
+            transcurrido = time.perf_counter() - inicio
+        finally:
+            gc.enable()
+        if i:
+            tiempos.append(transcurrido)
+    return tiempos
+
+
+def resumen(tiempos, operaciones, unidad):
+    return {
+        'mediana': statistics.median(tiempos),
+        'minimo': min(tiempos),
+        'maximo': max(tiempos),
+        'media': statistics.fmean(tiempos),
+        'desviacion': statistics.stdev(tiempos) if len(tiempos) > 1 else 0.0,
+        'repeticiones': len(tiempos),
+        'operaciones': operaciones,
+        'unidad': unidad,
+    }
+
+
+def nuevo_usuario(usuario):
+    """Crea un usuario vacío con los datos de otro (destino de las importaciones)"""
+    copia = Usuario(nombre=usuario.nombre, apellido=usuario.apellido, fecha_nacimiento=usuario.fecha_nacimiento,
+                    genero=usuario.genero, altura=usuario.altura)
+    db.session.add(copia)
+    db.session.commit()
+    return copia.id
+
+
+def benchmarks(app, ids, repeticiones, peticiones):
+    """Ejecuta todos los benchmarks y retorna sus resultados por nombre"""
+    resultados = {}
+
+    def registrar(nombre, funcion, operaciones, unidad, preparar=None):
+        tiempos = medir(funcion, repeticiones, preparar)
+        resultados[nombre] = resumen(tiempos, operaciones, unidad)
+        mediana = resultados[nombre]['mediana']
+        print(f'  {nombre:<36} {mediana * 1000:10.2f} ms  {operaciones / mediana:12.0f} {unidad}/s', flush=True)
+
+    with app.app_context():
+        usuario = db.session.get(Usuario, ids[0])
+        registros = datos_sinteticos.registros_usuario(usuario.id)
+        fechas = [r['fecha'] for r in registros]
+        pliegues = [[r[f'pliegue_{sitio}_promedio'] for r in registros]
+                    for sitio in ('tricipital', 'subescapular', 'suprailiaco', 'abdominal')]
+        edades = [composicion.calcular_edad(usuario.fecha_nacimiento, fecha) for fecha in fechas]
+
+        # Motor de composición corporal: un registro por llamada (métodos de RegistroFisico) y en lote
+        def por_registro():
+            for tric, subesc, supra, abd, edad in zip(*pliegues, edades):
+                composicion.calcular_registro(tric, subesc, supra, abd, edad, usuario.genero)
+        registrar('composicion.calcular_registro', por_registro, len(registros), 'registros')
+        registrar('composicion.calcular_lote', lambda: composicion.calcular_lote(*pliegues, edades, usuario.genero),
+                  len(registros), 'registros')
+        registrar('calcular_metricas_lote', lambda: calcular_metricas_lote(pliegues, fechas, usuario),
+                  len(registros), 'registros')
+
+        # Exportación e importación CSV
+        registrar('export_registros_csv', lambda: ''.join(export_registros_csv(usuario.id)), len(registros), 'registros')
+        contenido = ''.join(export_registros_csv(usuario.id))
+        registrar('import_registros_csv', lambda destino: import_registros_csv(contenido, destino),
+                  len(registros), 'registros', preparar=lambda: (nuevo_usuario(usuario),))
+
+        # Exportaciones de Garmin: lectura y importación
+        garmin = datos_sinteticos.csv_garmin(registros)
+        registrar('parse_garmin_csv', lambda: parse_garmin_csv(garmin), len(registros), 'mediciones')
+        registrar('importar_garmin_csv', lambda destino: importar_garmin_csv(io.StringIO(garmin), destino),
+                  len(registros), 'mediciones', preparar=lambda: (nuevo_usuario(usuario),))
+        db.session.remove()
+
+    # Rutas, con el cliente de pruebas (cada petición en su propio contexto, como en el servidor)
+    cliente = app.test_client()
+    rutas = {
+        'ruta ver_usuario': f'/usuario/{ids[0]}',
+        'ruta estadisticas': f'/estadisticas/{ids[0]}',
+        'ruta estadisticas (pagina 5)': f'/estadisticas/{ids[0]}?pagina=5&por_pagina=50',
+        'ruta api_registros': f'/api/registros/{ids[0]}?limit=100',
+        'ruta api_registros (todos los campos)':
+            f'/api/registros/{ids[0]}?limit=100&fields=pliegues,circunferencias,metricas,observaciones',
+        'ruta api_series': f'/api/series/{ids[0]}?puntos=200',
+        'ruta api_series (semana)': f'/api/series/{ids[0]}?agrupar=semana',
+        'ruta api_tendencias': f'/api/tendencias/{ids[0]}',
+        'ruta api_tendencias (serie)': f'/api/tendencias/{ids[0]}?metrica=peso&puntos=200',
+    }
+    for nombre, url in rutas.items():
+        respuesta = cliente.get(url)
+        if respuesta.status_code != 200:
+            raise RuntimeError(f'{url} respondió {respuesta.status_code}')
+
+        def pedir(url=url):
+            for _ in range(peticiones):
+                cliente.get(url).close()
+        registrar(nombre, pedir, peticiones, 'peticiones')
+    return resultados
+
+
+def commit_actual():
+    """Commit de git del árbol medido (con '+' si tiene cambios sin confirmar), o None"""
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=directorio,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        cambios = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=directorio,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+' if cambios else '')
+
+
+def ejecutar(argumentos):
+    directorio = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(directorio, "benchmark.db")}',
+            # Se mide el trabajo de cada petición, no la caché de páginas
+            'CACHE_BACKEND': 'ninguna',
+            'SQLITE_CHECKPOINT_INTERVALO': 0,
+            'TRABAJOS_HILOS': 0,
+        })
+        app.logger.disabled = True
+        print(f'Generando {argumentos.usuarios} usuarios x {argumentos.registros} registros...', flush=True)
+        with app.app_context():
+            inicializar_base_datos()
+            ids = datos_sinteticos.poblar(argumentos.usuarios, argumentos.registros, argumentos.semilla)
+            db.session.remove()
+        resultados = benchmarks(app, ids, argumentos.repeticiones, argumentos.peticiones)
+        with app.app_context():
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    documento = {
+        'version_formato': VERSION_FORMATO,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit_actual(),
+        'entorno': {
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'procesador': platform.processor() or platform.machine(),
+            'cpus': os.cpu_count(),
+            'numpy': np.__version__,
+            'sqlite': sqlite3.sqlite_version,
+        },
+        'parametros': {
+            'usuarios': argumentos.usuarios,
+            'registros': argumentos.registros,
+            'repeticiones': argumentos.repeticiones,
+            'peticiones': argumentos.peticiones,
+            'semilla': argumentos.semilla,
+        },
+        'resultados': resultados,
+    }
+    if argumentos.salida:
+        with open(argumentos.salida, 'w', encoding='utf-8') as archivo:
+            json.dump(documento, archivo, indent=2, ensure_ascii=False)
+            archivo.write('\n')
+        print(f'Resultados guardados en {argumentos.salida}')
+    return 0
+
+
+def cargar(ruta):
+    with open(ruta, encoding='utf-8') as archivo:
+        documento = json.load(archivo)
+    if documento.get('version_formato') != VERSION_FORMATO:
+        raise SystemExit(f'{ruta}: formato de resultados no soportado ({documento.get("version_formato")})')
+    return documento
+
+
+def comparar(argumentos):
+    """Compara dos archivos de resultados; retorna 1 si hay regresiones"""
+    base = cargar(argumentos.base)
+    nuevo = cargar(argumentos.nuevo)
+    print(f'Base:  {base["commit"] or "?"} ({base["fecha"]})')
+    print(f'Nuevo: {nuevo["commit"] or "?"} ({nuevo["fecha"]})')
+    if base['parametros'] != nuevo['parametros']:
+        print('Atención: los parámetros difieren, los tiempos no son directamente comparables')
+    if base['entorno'] != nuevo['entorno']:
+        print('Atención: los resultados se tomaron en entornos distintos')
+
+    estadistico = argumentos.estadistico
+    regresiones = []
+    print(f'\n{"benchmark":<38} {"base ms":>10} {"nuevo ms":>10} {"cambio":>8}')
+    for nombre, resultado in nuevo['resultados'].items():
+        anterior = base['resultados'].get(nombre)
+        if anterior is None:
+            print(f'{nombre:<38} {"-":>10} {resultado[estadistico] * 1000:10.2f}    nuevo')
+            continue
+        # Tiempo por operación: admite resultados con distinta cantidad de operaciones
+        antes = anterior[estadistico] / anterior['operaciones']
+        despues = resultado[estadistico] / resultado['operaciones']
+        cambio = despues / antes - 1
+        if cambio > argumentos.umbral:
+            marca = 'REGRESIÓN'
+            regresiones.append(nombre)
+        elif cambio < -argumentos.umbral:
+            marca = 'mejora'
+        else:
+            marca = ''
+        print(f'{nombre:<38} {anterior[estadistico] * 1000:10.2f} {resultado[estadistico] * 1000:10.2f} '
+              f'{cambio:+8.1%}  {marca}')
+    for nombre in base['resultados'].keys() - nuevo['resultados'].keys():
+        print(f'{nombre:<38} (ya no se mide)')
+
+    if regresiones:
+        print(f'\n{len(regresiones)} regresiones de más del {argumentos.umbral:.0%}: {", ".join(regresiones)}')
+        return 1
+    print(f'\nSin regresiones de más del {argumentos.umbral:.0%}')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks de Registro Físico')
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+
+    ejecucion = subcomandos.add_parser('ejecutar', help='Ejecuta los benchmarks sobre datos sintéticos')
+    ejecucion.add_argument('--usuarios', type=int, default=3, help='Usuarios sintéticos (por defecto 3)')
+    ejecucion.add_argument('--registros', type=int, default=2000, help='Registros por usuario (por defecto 2000)')
+    ejecucion.add_argument('--repeticiones', type=int, default=7, help='Mediciones por benchmark (por defecto 7)')
+    ejecucion.add_argument('--peticiones', type=int, default=20,
+                           help='Peticiones por medición en los benchmarks de rutas (por defecto 20)')
+    ejecucion.add_argument('--semilla', type=int, default=1, help='Semilla de los datos sintéticos')
+    ejecucion.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+    ejecucion.set_defaults(funcion=ejecutar)
+
+    comparacion = subcomandos.add_parser('comparar', help='Compara dos resultados y marca las regresiones')
+    comparacion.add_argument('base', help='Resultados de referencia (JSON)')
+    comparacion.add_argument('nuevo', help='Resultados a evaluar (JSON)')
+    comparacion.add_argument('--umbral', type=float, default=0.10,
+                             help='Empeoramiento relativo tolerado (por defecto 0.10 = 10%%)')
+    comparacion.add_argument('--estadistico', choices=('mediana', 'minimo', 'media'), default='mediana',
+                             help='Estadístico a comparar (por defecto la mediana)')
+    comparacion.set_defaults(funcion=comparar)
+
+    argumentos = parser.parse_args(argv)
+    return argumentos.funcion(argumentos)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Caché de respuestas renderizadas.
+
+Las páginas de un usuario se guardan con una clave que incluye la versión de
+sus datos (``Usuario.version_datos``), que se incrementa en cada escritura:
+al cambiar los datos la clave cambia y la versión anterior deja de pedirse,
+por lo que la invalidación es exacta y el TTL solo libera memoria.
+
+Hay dos implementaciones con la misma interfaz (``obtener``, ``guardar``,
+``limpiar``):
+
+* ``CacheLRU``: en memoria del proceso, con un máximo de entradas y TTL.
+* ``CacheCompartida``: sobre un cliente con la interfaz de redis-py
+  (``get``, ``set(..., ex=)``, ``scan_iter``, ``delete``), compartida entre workers y servidores. Con
+  ``CACHE_URL=local://`` usa ``ClienteLocal``, un sustituto en memoria para
+  desarrollo y pruebas.
+"""
+
+import fnmatch
+import threading
+import time
+from collections import OrderedDict
+
+BACKENDS = ('memoria', 'compartida', 'ninguna')
+
+
+class CacheLRU:
+    """Caché en memoria del proceso con expulsión LRU y expiración por TTL"""
+
+    def __init__(self, maximo=512, ttl=300):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._entradas = OrderedDict()  # clave -> (vence, valor)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def obtener(self, clave):
+        """Valor guardado (None si no existe o venció)"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] < time.monotonic():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return entrada[1]
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+
+class ClienteLocal:
+    """Sustituto en memoria de un cliente redis (solo get/set/scan_iter/delete) para desarrollo y pruebas"""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or (entrada[0] is not None and entrada[0] < time.monotonic()):
+                self._datos.pop(clave, None)
+                return None
+            return entrada[1]
+
+    def set(self, clave, valor, ex=None):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + ex if ex else None, valor)
+        return True
+
+    def scan_iter(self, match=None, count=None):
+        with self._lock:
+            claves = list(self._datos)
+        if match is None:
+            return iter(claves)
+        return (c for c in claves if fnmatch.fnmatchcase(c, match))
+
+    def delete(self, *claves):
+        with self._lock:
+            return sum(self._datos.pop(c, None) is not None for c in claves)
+
+
+class CacheCompartida:
+    """Caché sobre un cliente compartido (redis o ``ClienteLocal``); los valores son texto"""
+
+    def __init__(self, cliente, ttl=300, prefijo='registro-fisico'):
+        self.cliente = cliente
+        self.ttl = ttl
+        self.prefijo = prefijo
+
+    def obtener(self, clave):
+        valor = self.cliente.get(f'{self.prefijo}:{clave}')
+        if valor is None:
+            return None
+        return valor.decode('utf-8') if isinstance(valor, bytes) else valor
+
+    def guardar(self, clave, valor):
+        self.cliente.set(f'{self.prefijo}:{clave}', valor.encode('utf-8'), ex=max(int(self.ttl), 1))
+
+    def limpiar(self):
+        """Borra solo las claves con el prefijo de esta caché (la base puede ser compartida)"""
+        lote = []
+        for clave in self.cliente.scan_iter(match=f'{self.prefijo}:*', count=500):
+            lote.append(clave)
+            if len(lote) >= 500:
+                self.cliente.delete(*lote)
+                lote = []
+        if lote:
+            self.cliente.delete(*lote)
+
+
+def crear_cache(config):
+    """Crea la caché configurada por CACHE_BACKEND (None si está desactivada)"""
+    backend = config['CACHE_BACKEND']
+    if backend not in BACKENDS:
+        raise ValueError(f'CACHE_BACKEND inválido: {backend} (valores posibles: {", ".join(BACKENDS)})')
+    if backend == 'ninguna':
+        return None
+    if backend == 'memoria':
+        return CacheLRU(config['CACHE_MAXIMO'], config['CACHE_TTL'])
+
+    url = config['CACHE_URL']
+    if not url:
+        raise ValueError('CACHE_BACKEND=compartida requiere CACHE_URL')
+    if url == 'local://':
+        cliente = ClienteLocal()
+    else:
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('La caché compartida requiere el paquete redis (pip install redis)') from e
+        cliente = redis.Redis.from_url(url)
+    return CacheCompartida(cliente, config['CACHE_TTL'], config['CACHE_PREFIJO'])
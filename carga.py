@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Generador de carga y reporte de SLO para una instancia en ejecución.
+
+Simula entrenadores que usan la aplicación al mismo tiempo: cada cliente
+elige un usuario, recorre sus páginas (inicio, perfil, estadísticas, API),
+carga registros nuevos y sube exportaciones de Garmin, y después pasa a otro
+usuario. Al terminar informa, por ruta y en total, el throughput, las
+latencias p50/p95/p99 y la tasa de errores, y las compara con los umbrales
+de SLO configurados. Funciona sin conexión a internet contra una base
+sembrada con datos sintéticos::
+
+    python carga.py sembrar --base /tmp/carga.db --usuarios 50 --registros 500
+    DATABASE_URL=sqlite:////tmp/carga.db gunicorn -c gunicorn.conf.py wsgi:app
+    python carga.py ejecutar --url http://127.0.0.1:8000 --clientes 16 --duracion 60
+
+Las altas de registros y las importaciones escriben en la base: usar una base
+sembrada para la prueba, no la de producción. ``ejecutar`` termina con
+código 1 si alguna ruta no cumple los SLO.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+import datos_sinteticos
+
+# Peso de cada acción en la mezcla de tráfico predeterminada
+MEZCLA = {
+    'index': 15,
+    'ver_usuario': 30,
+    'estadisticas': 25,
+    'api_registros': 10,
+    'nuevo_registro': 15,
+    'importar_csv': 5,
+}
+
+# Umbrales predeterminados por ruta: latencias en ms y fracción de peticiones con error
+SLO = {'p50': 200.0, 'p95': 500.0, 'p99': 1000.0, 'errores': 0.01}
+
+# Acciones seguidas sobre el mismo usuario antes de pasar a otro (en promedio)
+ACCIONES_POR_USUARIO = 6
+
+
+class Conexion:
+    """Conexión HTTP persistente de un cliente (se reabre tras un error)"""
+
+    def __init__(self, url, tiempo_espera):
+        partes = urlsplit(url)
+        self.clase = http.client.HTTPSConnection if partes.scheme == 'https' else http.client.HTTPConnection
+        self.servidor = partes.netloc
+        self.prefijo = partes.path.rstrip('/')
+        self.tiempo_espera = tiempo_espera
+        self._conexion = None
+
+    def pedir(self, metodo, ruta, cuerpo=None, cabeceras=None):
+        """Envía una petición y lee la respuesta completa; retorna (estado, Location, cuerpo)"""
+        if self._conexion is None:
+            self._conexion = self.clase(self.servidor, timeout=self.tiempo_espera)
+        try:
+            self._conexion.request(metodo, self.prefijo + ruta, body=cuerpo, headers=cabeceras or {})
+            respuesta = self._conexion.getresponse()
+            contenido = respuesta.read()
+        except Exception:
+            self.cerrar()
+            raise
+        if respuesta.will_close:
+            self.cerrar()
+        return respuesta.status, respuesta.getheader('Location', ''), contenido
+
+    def cerrar(self):
+        if self._conexion is not None:
+            self._conexion.close()
+            self._conexion = None
+
+
+def formulario_multipart(campo, nombre_archivo, contenido):
+    """Cuerpo y Content-Type de un formulario con un único archivo"""
+    limite = uuid.uuid4().hex
+    cuerpo = (
+        f'--{limite}\r\n'
+        f'Content-Disposition: form-data; name="{campo}"; filename="{nombre_archivo}"\r\n'
+        f'Content-Type: text/csv\r\n\r\n{contenido}\r\n--{limite}--\r\n'
+    ).encode('utf-8')
+    return cuerpo, f'multipart/form-data; boundary={limite}'
+
+
+class Simulacion:
+    """Acciones de los clientes y resultados de la prueba"""
+
+    def __init__(self, argumentos, usuarios):
+        self.argumentos = argumentos
+        self.usuarios = usuarios
+        self.acciones = list(argumentos.mezcla)
+        self.pesos = list(argumentos.mezcla.values())
+        # Latencias (s) y códigos de estado por acción; cada cliente escribe en las suyas
+        self.resultados = []
+
+    def cliente(self, indice, inicio_medicion, fin):
+        argumentos = self.argumentos
+        rng = random.Random(f'{argumentos.semilla}-{indice}')
+        conexion = Conexion(argumentos.url, argumentos.tiempo_espera)
+        latencias = {accion: [] for accion in self.acciones}
+        estados = {accion: {} for accion in self.acciones}
+        self.resultados.append((latencias, estados))
+        usuario = rng.choice(self.usuarios)
+
+        while time.monotonic() < fin:
+            if rng.random() < 1 / ACCIONES_POR_USUARIO:
+                usuario = rng.choice(self.usuarios)
+            accion = rng.choices(self.acciones, self.pesos)[0]
+            inicio = time.perf_counter()
+            try:
+                estado = getattr(self, accion)(conexion, rng, usuario)
+            except Exception as e:
+                estado = type(e).__name__
+            transcurrido = time.perf_counter() - inicio
+            if time.monotonic() >= inicio_medicion:
+                latencias[accion].append(transcurrido)
+                estados[accion][estado] = estados[accion].get(estado, 0) + 1
+            if argumentos.pausa:
+                time.sleep(rng.expovariate(1 / argumentos.pausa))
+        conexion.cerrar()
+
+    # Cada acción retorna 'ok' o una descripción del error (código HTTP o redirección inesperada)
+
+    @staticmethod
+    def _esperar(estado, ubicacion, esperado, destino=None):
+        if estado != esperado:
+            return str(estado)
+        if destino and destino not in ubicacion:
+            # Los formularios redirigen a sí mismos con un mensaje de error
+            return f'{estado} {urlsplit(ubicacion).path}'
+        return 'ok'
+
+    def index(self, conexion, rng, usuario):
+        estado, ubicacion, _ = conexion.pedir('GET', '/')
+        return self._esperar(estado, ubicacion, 200)
+
+    def ver_usuario(self, conexion, rng, usuario):
+        estado, ubicacion, _ = conexion.pedir('GET', f'/usuario/{usuario}')
+        return self._esperar(estado, ubicacion, 200)
+
+    def estadisticas(self, conexion, rng, usuario):
+        # La mayoría abre la primera página del historial; algunos navegan las siguientes
+        ruta = f'/estadisticas/{usuario}'
+        if rng.random() < 0.2:
+            ruta += f'?pagina={rng.randint(2, 10)}'
+        estado, ubicacion, _ = conexion.pedir('GET', ruta)
+        return self._esperar(estado, ubicacion, 200)
+
+    def api_registros(self, conexion, rng, usuario):
+        campos = rng.choice(['', 'pliegues', 'pliegues,metricas'])
+        estado, ubicacion, _ = conexion.pedir('GET', f'/api/registros/{usuario}?limit=100&fields={campos}')
+        return self._esperar(estado, ubicacion, 200)
+
+    def nuevo_registro(self, conexion, rng, usuario):
+        # Fecha al azar en un rango amplio para no repetir la de un registro existente; no sale de la
+        # semilla para que una nueva ejecución contra la misma base no repita las fechas de la anterior
+        fecha = datetime(2100, 1, 1) + timedelta(minutes=random.randrange(500 * 365 * 24 * 60))
+        formulario = {
+            'peso': f'{rng.gauss(75, 12):.1f}',
+            'altura': f'{rng.gauss(1.70, 0.08):.2f}',
+            'fecha_muestra': f'{fecha:%Y-%m-%d}',
+            'hora_muestra': f'{fecha:%H:%M}',
+            'observaciones': '',
+        }
+        for sitio, media in datos_sinteticos.PLIEGUES[rng.choice('MF')].items():
+            for i in range(1, 4):
+                formulario[f'pliegue_{sitio}_{i}'] = f'{media * rng.gauss(1, 0.1):.1f}'
+        for sitio, media in datos_sinteticos.CIRCUNFERENCIAS['M'].items():
+            formulario[f'circunferencia_{sitio}'] = f'{media * rng.gauss(1, 0.05):.1f}'
+        estado, ubicacion, _ = conexion.pedir(
+            'POST', f'/nuevo_registro/{usuario}', urlencode(formulario),
+            {'Content-Type': 'application/x-www-form-urlencoded'}
+        )
+        return self._esperar(estado, ubicacion, 302, f'/usuario/{usuario}')
+
+    def importar_csv(self, conexion, rng, usuario):
+        perfil = {'genero': rng.choice('MF'), 'altura': round(rng.gauss(1.70, 0.08), 2)}
+        inicio = datetime(2100, 1, 1) + timedelta(days=random.randrange(500 * 365))
+        registros = datos_sinteticos.generar_registros(rng, perfil, self.argumentos.mediciones_garmin, inicio, 0)
+        cuerpo, tipo = formulario_multipart('archivo_csv', 'garmin.csv', datos_sinteticos.csv_garmin(registros))
+        estado, ubicacion, _ = conexion.pedir('POST', f'/importar_csv/{usuario}', cuerpo, {'Content-Type': tipo})
+        return self._esperar(estado, ubicacion, 302, '/trabajos/')
+
+
+def percentil(ordenados, p):
+    """Percentil ``p`` (0-100) de una lista ordenada, por rango más cercano"""
+    return ordenados[max(math.ceil(p / 100 * len(ordenados)) - 1, 0)]
+
+
+def estadisticas_ruta(latencias, estados, duracion):
+    ordenados = sorted(latencias)
+    total = len(ordenados)
+    errores = total - estados.get('ok', 0)
+    return {
+        'peticiones': total,
+        'throughput': total / duracion,
+        'p50': percentil(ordenados, 50) * 1000,
+        'p95': percentil(ordenados, 95) * 1000,
+        'p99': percentil(ordenados, 99) * 1000,
+        'maximo': ordenados[-1] * 1000,
+        'errores': errores / total,
+        'estados': estados,
+    }
+
+
+def descubrir_usuarios(argumentos):
+    """Ids de los usuarios activos, leídos de los enlaces de la página de inicio"""
+    conexion = Conexion(argumentos.url, argumentos.tiempo_espera)
+    estado, _, contenido = conexion.pedir('GET', '/')
+    conexion.cerrar()
+    if estado != 200:
+        raise SystemExit(f'La página de inicio respondió {estado}')
+    ids = sorted({int(i) for i in re.findall(r'/usuario/(\d+)', contenido.decode('utf-8', 'replace'))})
+    if not ids:
+        raise SystemExit('No hay usuarios activos: sembrar la base con "python carga.py sembrar"')
+    return ids
+
+
+def ejecutar(argumentos):
+    usuarios = argumentos.usuarios or descubrir_usuarios(argumentos)
+    print(f'{argumentos.clientes} clientes durante {argumentos.duracion:g} s '
+          f'(+{argumentos.calentamiento:g} s de calentamiento) contra {argumentos.url}, {len(usuarios)} usuarios',
+          flush=True)
+
+    simulacion = Simulacion(argumentos, usuarios)
+    inicio_medicion = time.monotonic() + argumentos.calentamiento
+    fin = inicio_medicion + argumentos.duracion
+    hilos = [threading.Thread(target=simulacion.cliente, args=(i, inicio_medicion, fin), daemon=True)
+             for i in range(argumentos.clientes)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    # Unir los resultados de todos los clientes
+    latencias = {accion: [] for accion in simulacion.acciones}
+    estados = {accion: {} for accion in simulacion.acciones}
+    for latencias_cliente, estados_cliente in simulacion.resultados:
+        for accion in simulacion.acciones:
+            latencias[accion].extend(latencias_cliente[accion])
+            for estado, cantidad in estados_cliente[accion].items():
+                estados[accion][estado] = estados[accion].get(estado, 0) + cantidad
+
+    rutas = {accion: estadisticas_ruta(latencias[accion], estados[accion], argumentos.duracion)
+             for accion in simulacion.acciones if latencias[accion]}
+    if not rutas:
+        raise SystemExit('No se completó ninguna petición durante la medición')
+    todos_estados = {}
+    for accion in rutas:
+        for estado, cantidad in estados[accion].items():
+            todos_estados[estado] = todos_estados.get(estado, 0) + cantidad
+    total = estadisticas_ruta(list(itertools.chain(*latencias.values())), todos_estados, argumentos.duracion)
+
+    violaciones = []
+    print(f'\n{"ruta":<16} {"pet.":>7} {"pet./s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+          f'{"máx ms":>8} {"errores":>8}  SLO')
+    for nombre, resultado in [*rutas.items(), ('total', total)]:
+        fallas = []
+        if nombre != 'total':
+            for metrica, umbral in argumentos.slo.get(nombre, argumentos.slo_general).items():
+                if resultado[metrica] > umbral:
+                    valor = f'{resultado[metrica]:.2%}' if metrica == 'errores' else f'{resultado[metrica]:.0f} ms'
+                    limite = f'{umbral:.2%}' if metrica == 'errores' else f'{umbral:.0f} ms'
+                    fallas.append(f'{metrica} {valor} > {limite}')
+            violaciones.extend(f'{nombre}: {falla}' for falla in fallas)
+        marca = '' if nombre == 'total' else ('FALLA' if fallas else 'ok')
+        print(f'{nombre:<16} {resultado["peticiones"]:7d} {resultado["throughput"]:8.1f} {resultado["p50"]:8.1f} '
+              f'{resultado["p95"]:8.1f} {resultado["p99"]:8.1f} {resultado["maximo"]:8.1f} '
+              f'{resultado["errores"]:8.2%}  {marca}')
+
+    for nombre, resultado in rutas.items():
+        otros = {estado: cantidad for estado, cantidad in resultado['estados'].items() if estado != 'ok'}
+        if otros:
+            print(f'Errores en {nombre}: ' + ', '.join(f'{estado} ×{cantidad}' for estado, cantidad in otros.items()))
+
+    if argumentos.salida:
+        documento = {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'parametros': {
+                'url': argumentos.url,
+                'clientes': argumentos.clientes,
+                'duracion': argumentos.duracion,
+                'calentamiento': argumentos.calentamiento,
+                'pausa': argumentos.pausa,
+                'mezcla': argumentos.mezcla,
+                'usuarios': len(usuarios),
+                'semilla': argumentos.semilla,
+            },
+            'slo': {'general': argumentos.slo_general, 'rutas': argumentos.slo},
+            'rutas': rutas,
+            'total': total,
+            'violaciones': violaciones,
+        }
+        with open(argumentos.salida, 'w', encoding='utf-8') as archivo:
+            json.dump(documento, archivo, indent=2, ensure_ascii=False)
+            archivo.write('\n')
+        print(f'\nResultados guardados en {argumentos.salida}')
+
+    if violaciones:
+        print('\nSLO incumplidos:\n  ' + '\n  '.join(violaciones))
+        return 1
+    print('\nTodas las rutas cumplen los SLO')
+    return 0
+
+
+def sembrar(argumentos):
+    from app import create_app, db, inicializar_base_datos
+
+    ruta = os.path.abspath(argumentos.base)
+    if os.path.exists(ruta):
+        raise SystemExit(f'{ruta} ya existe: usar otra ruta o borrarla antes de sembrar')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{ruta}', 'SQLITE_CHECKPOINT_INTERVALO': 0})
+    with app.app_context():
+        inicializar_base_datos()
+        ids = datos_sinteticos.poblar(argumentos.usuarios, argumentos.registros, argumentos.semilla)
+        db.session.remove()
+        db.engine.dispose()
+    print(f'Base {ruta} sembrada con {len(ids)} usuarios x {argumentos.registros} registros')
+    print(f'Iniciar el servidor con DATABASE_URL=sqlite:///{ruta}')
+    return 0
+
+
+def leer_mezcla(texto):
+    """'accion=peso,...' -> diccionario de pesos (acciones de MEZCLA)"""
+    mezcla = {}
+    for parte in texto.split(','):
+        accion, _, peso = parte.partition('=')
+        accion = accion.strip()
+        if accion not in MEZCLA:
+            raise argparse.ArgumentTypeError(f'acción desconocida: {accion} (posibles: {", ".join(MEZCLA)})')
+        try:
+            mezcla[accion] = float(peso)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'peso inválido para {accion}: {peso!r}') from None
+    if not any(mezcla.values()):
+        raise argparse.ArgumentTypeError('la mezcla no tiene ninguna acción con peso')
+    return {accion: peso for accion, peso in mezcla.items() if peso > 0}
+
+
+def leer_slo(texto):
+    """'ruta.metrica=valor' -> (ruta, metrica, valor)"""
+    clave, _, valor = texto.partition('=')
+    ruta, _, metrica = clave.rpartition('.')
+    if ruta not in MEZCLA or metrica not in SLO:
+        raise argparse.ArgumentTypeError(f'SLO inválido: {texto} (formato ruta.{"|".join(SLO)}=valor)')
+    try:
+        return ruta, metrica, float(valor)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'valor inválido en {texto}') from None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generador de carga y reporte de SLO de Registro Físico')
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+
+    siembra = subcomandos.add_parser('sembrar', help='Crea una base SQLite con datos sintéticos para la prueba')
+    siembra.add_argument('--base', required=True, help='Archivo de la base a crear')
+    siembra.add_argument('--usuarios', type=int, default=50, help='Usuarios sintéticos (por defecto 50)')
+    siembra.add_argument('--registros', type=int, default=500, help='Registros por usuario (por defecto 500)')
+    siembra.add_argument('--semilla', type=int, default=1, help='Semilla de los datos sintéticos')
+    siembra.set_defaults(funcion=sembrar)
+
+    prueba = subcomandos.add_parser('ejecutar', help='Genera carga contra una instancia en ejecución')
+    prueba.add_argument('--url', default='http://127.0.0.1:5000', help='URL base de la instancia')
+    prueba.add_argument('--clientes', type=int, default=8, help='Clientes concurrentes (por defecto 8)')
+    prueba.add_argument('--duracion', type=float, default=60, help='Segundos de medición (por defecto 60)')
+    prueba.add_argument('--calentamiento', type=float, default=5,
+                        help='Segundos iniciales que no se miden (por defecto 5)')
+    prueba.add_argument('--pausa', type=float, default=0.0,
+                        help='Pausa media entre acciones de un cliente en segundos (por defecto 0: carga máxima)')
+    prueba.add_argument('--mezcla', type=leer_mezcla, default=MEZCLA,
+                        help='Pesos de las acciones, p. ej. "ver_usuario=30,estadisticas=25,importar_csv=5" '
+                             f'(por defecto {",".join(f"{a}={p}" for a, p in MEZCLA.items())})')
+    prueba.add_argument('--usuarios', type=lambda t: [int(i) for i in t.split(',')],
+                        help='Ids de usuarios a usar, separados por coma (por defecto, los activos de la página de inicio)')
+    prueba.add_argument('--mediciones-garmin', type=int, default=200,
+                        help='Mediciones de cada CSV de Garmin subido (por defecto 200)')
+    prueba.add_argument('--tiempo-espera', type=float, default=30, help='Tiempo máximo por petición en segundos')
+    prueba.add_argument('--semilla', type=int, default=1, help='Semilla de la secuencia de acciones')
+    for metrica, umbral in SLO.items():
+        unidad = 'fracción' if metrica == 'errores' else 'ms'
+        prueba.add_argument(f'--{metrica}', type=float, default=umbral,
+                            help=f'SLO de {metrica} para todas las rutas ({unidad}, por defecto {umbral:g})')
+    prueba.add_argument('--slo', type=leer_slo, action='append', default=[],
+                        help='SLO de una ruta, p. ej. "estadisticas.p95=300" (se puede repetir)')
+    prueba.add_argument('--salida', help='Archivo JSON donde guardar el reporte')
+    prueba.set_defaults(funcion=ejecutar)
+
+    argumentos = parser.parse_args(argv)
+    if argumentos.comando == 'ejecutar':
+        argumentos.slo_general = {metrica: getattr(argumentos, metrica) for metrica in SLO}
+        slo = {}
+        for ruta, metrica, valor in argumentos.slo:
+            slo.setdefault(ruta, dict(argumentos.slo_general))[metrica] = valor
+        argumentos.slo = slo
+    return argumentos.funcion(argumentos)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+Motor vectorizado de composición corporal.
+
+Calcula en una sola pasada de NumPy la densidad de Durnin-Womersley, el
+porcentaje de grasa (ecuación de Siri), la SPC AAHPERD, sus percentilas y las
+clasificaciones para un conjunto completo de registros. Las tablas de
+referencia provienen del catálogo de ``normas``; los registros se agrupan por
+género y tramo de edad y cada grupo se clasifica por búsqueda binaria. Para
+un único registro, ``calcular_registro`` hace el mismo cálculo en Python puro
+y da los mismos resultados sin el costo fijo de armar los arrays.
+"""
+
+import bisect
+from datetime import datetime
+
+import numpy as np
+
+import normas
+
+# Niveles de clasificación (el índice es el código devuelto por el motor)
+NIVELES_GRASA = ("Muy Bajo", "Bajo", "Aceptable", "Promedio", "Alto", "Muy Alto")
+COLORES_GRASA = ("danger", "warning", "info", "success", "warning", "danger")
+
+NIVELES_SPC = ("Excelente", "Muy Bueno", "Bueno", "Promedio", "Bajo Promedio", "Necesita Mejora")
+COLORES_SPC = ("success", "info", "primary", "warning", "warning", "danger")
+
+
+def calcular_edad(fecha_nacimiento, fecha=None):
+    """Edad en años cumplidos a una fecha dada (por defecto, hoy)"""
+    if not fecha_nacimiento:
+        return None
+    if fecha is None:
+        fecha = datetime.now().date()
+    elif isinstance(fecha, datetime):
+        fecha = fecha.date()
+    edad = fecha.year - fecha_nacimiento.year
+    if (fecha.month, fecha.day) < (fecha_nacimiento.month, fecha_nacimiento.day):
+        edad -= 1
+    return edad
+
+
+def _como_array(valores, n):
+    """Convierte valores (escalares o secuencias con None) en un array float de tamaño n"""
+    return np.broadcast_to(np.asarray(valores, dtype=float), (n,))
+
+
+def _grupos(conjunto, tabla, es_hombre, edad):
+    """Recorre los grupos (género, tramo de edad) del lote con sus valores de referencia"""
+    for genero, del_genero in (('M', es_hombre), ('F', ~es_hombre)):
+        if not del_genero.any():
+            continue
+        tabla_genero = conjunto.tabla(tabla, genero)
+        tramos = tabla_genero.indices(edad)
+        for tramo in np.unique(tramos[del_genero]):
+            yield del_genero & (tramos == tramo), tabla_genero.valores[tramo]
+
+
+def calcular_lote(tricipital, subescapular, suprailiaco, abdominal, edades, generos, conjunto=None):
+    """
+    Calcula todas las métricas derivadas para un lote de registros.
+
+    Los pliegues son los promedios en mm (None o NaN si faltan), ``edades`` la
+    edad en años de cada registro (None si se desconoce) y ``generos`` el
+    género del usuario ('M' o 'F'). Edades y géneros pueden ser escalares.
+    ``conjunto`` permite usar normas distintas de las activas del catálogo.
+    Retorna un diccionario de arrays; los valores ausentes son NaN en los
+    arrays float y -1 en los códigos enteros.
+    """
+    conjunto = conjunto or normas.activas()
+    tric = np.atleast_1d(np.asarray(tricipital, dtype=float))
+    n = tric.shape[0]
+    subesc = _como_array(subescapular, n)
+    supra = _como_array(suprailiaco, n)
+    abdom = _como_array(abdominal, n)
+    edad = _como_array(edades, n)
+    es_hombre = np.broadcast_to(np.asarray(generos, dtype=object) == 'M', (n,))
+    edad_valida = ~np.isnan(edad)
+    percentilas = np.asarray(conjunto.percentilas)
+
+    # Durnin-Womersley sobre la sumatoria de 4 pliegues (los ausentes cuentan como 0)
+    suma_4 = (np.nan_to_num(tric) + np.nan_to_num(subesc) +
+              np.nan_to_num(supra) + np.nan_to_num(abdom))
+    densidad = np.full(n, np.nan)
+    for mascara, (constante, pendiente) in _grupos(conjunto, 'durnin_womersley', es_hombre, edad):
+        densidad[mascara] = constante - pendiente * (suma_4[mascara] / 10)
+    densidad[(suma_4 == 0) | ~edad_valida] = np.nan
+
+    # Ecuación de Siri
+    with np.errstate(divide='ignore', invalid='ignore'):
+        porcentaje = np.where(densidad > 0, ((4.95 / densidad) - 4.50) * 100, np.nan)
+    porcentaje = np.round(porcentaje, 1)
+
+    # Clasificación, percentila y progreso de grasa corporal
+    con_grasa = ~np.isnan(porcentaje) & (porcentaje != 0)
+    nivel_grasa = np.full(n, -1)
+    objetivo = np.full(n, np.nan)
+    percentila_grasa = np.full(n, -1)
+    for mascara, rangos in _grupos(conjunto, 'rangos_grasa', es_hombre, edad):
+        mascara = mascara & con_grasa
+        niveles = np.searchsorted(rangos[:5], porcentaje[mascara], side='right')
+        nivel_grasa[mascara] = niveles
+        objetivo[mascara] = np.where(niveles < 5, rangos[np.minimum(niveles, 5)], np.nan)
+    for mascara, tabla in _grupos(conjunto, 'percentilas_grasa', es_hombre, edad):
+        mascara = mascara & con_grasa
+        percentila_grasa[mascara] = percentilas[np.searchsorted(tabla[:6], porcentaje[mascara], side='left')]
+    diferencia = objetivo - porcentaje
+
+    # SPC AAHPERD (Tríceps + Subescapular)
+    con_spc = (np.nan_to_num(tric) != 0) & (np.nan_to_num(subesc) != 0)
+    spc = np.where(con_spc, tric + subesc, np.nan)
+    con_spc_edad = con_spc & edad_valida & (spc != 0)
+    percentila_spc = np.full(n, -1)
+    nivel_spc = np.full(n, -1)
+    for mascara, tabla in _grupos(conjunto, 'percentilas_spc', es_hombre, edad):
+        mascara = mascara & con_spc_edad
+        percentila_spc[mascara] = percentilas[np.searchsorted(tabla[:6], spc[mascara], side='left')]
+    for mascara, umbrales in _grupos(conjunto, 'umbrales_spc', es_hombre, edad):
+        mascara = mascara & con_spc_edad
+        nivel_spc[mascara] = np.searchsorted(umbrales, spc[mascara], side='left')
+
+    return {
+        'densidad': densidad,
+        'porcentaje_grasa': porcentaje,
+        'percentila_grasa': percentila_grasa,
+        'nivel_grasa': nivel_grasa,
+        'objetivo_grasa': objetivo,
+        'diferencia_grasa': diferencia,
+        'spc': spc,
+        'percentila_spc': percentila_spc,
+        'nivel_spc': nivel_spc,
+    }
+
+
+def _escalar(valor):
+    """Convierte un elemento del lote en un valor de Python (None si está ausente)"""
+    if isinstance(valor, np.floating):
+        return None if np.isnan(valor) else float(valor)
+    if isinstance(valor, np.integer):
+        return None if valor < 0 else int(valor)
+    return valor
+
+
+def metricas_fila(lote, indice):
+    """Extrae las métricas de una fila del lote como valores de Python"""
+    return {clave: _escalar(valores[indice]) for clave, valores in lote.items()}
+
+
+def a_listas(lote):
+    """Convierte el lote en listas de valores de Python (None para los valores ausentes)"""
+    listas = {}
+    for clave, valores in lote.items():
+        if valores.dtype.kind == 'f':
+            listas[clave] = [None if v != v else v for v in valores.tolist()]
+        else:
+            listas[clave] = [None if v < 0 else v for v in valores.tolist()]
+    return listas
+
+
+def _pliegue(valor):
+    """Pliegue de un registro como float (los ausentes cuentan como 0, igual que en el lote)"""
+    return 0.0 if valor is None or valor != valor else float(valor)
+
+
+def calcular_registro(tricipital, subescapular, suprailiaco, abdominal, edad, genero, conjunto=None):
+    """
+    Calcula las métricas de un único registro con valores de Python (None si
+    faltan): el mismo resultado que ``metricas_fila(calcular_lote(...), 0)``,
+    sin arrays de NumPy.
+    """
+    conjunto = conjunto or normas.activas()
+    tric, subesc = _pliegue(tricipital), _pliegue(subescapular)
+    suma_4 = tric + subesc + _pliegue(suprailiaco) + _pliegue(abdominal)
+    edad_valida = edad is not None and edad == edad
+    metricas = dict.fromkeys((
+        'densidad', 'porcentaje_grasa', 'percentila_grasa', 'nivel_grasa', 'objetivo_grasa',
+        'diferencia_grasa', 'spc', 'percentila_spc', 'nivel_spc',
+    ))
+
+    if edad_valida and suma_4 != 0:
+        constante, pendiente = conjunto.tabla('durnin_womersley', genero).buscar(edad)
+        densidad = constante - pendiente * (suma_4 / 10)
+        if densidad == densidad:
+            metricas['densidad'] = densidad
+        if densidad > 0:
+            # round(x * 10) / 10 redondea igual que np.round(x, 1)
+            porcentaje = round(((4.95 / densidad) - 4.50) * 100 * 10) / 10
+            metricas['porcentaje_grasa'] = porcentaje
+            if porcentaje != 0:
+                rangos = conjunto.tabla('rangos_grasa', genero).buscar(edad)
+                # Sin tabla para la edad (fila NaN), searchsorted del lote da el nivel 0
+                nivel = 0 if rangos[0] != rangos[0] else bisect.bisect_right(rangos, porcentaje, 0, 5)
+                metricas['nivel_grasa'] = nivel
+                if nivel < 5 and rangos[nivel] == rangos[nivel]:
+                    metricas['objetivo_grasa'] = float(rangos[nivel])
+                    metricas['diferencia_grasa'] = float(rangos[nivel]) - porcentaje
+                tabla = conjunto.tabla('percentilas_grasa', genero).buscar(edad)
+                metricas['percentila_grasa'] = int(conjunto.percentilas[bisect.bisect_left(tabla, porcentaje, 0, 6)])
+
+    # SPC AAHPERD (Tríceps + Subescapular)
+    if tric != 0 and subesc != 0:
+        spc = tric + subesc
+        metricas['spc'] = spc
+        if edad_valida and spc != 0:
+            tabla = conjunto.tabla('percentilas_spc', genero).buscar(edad)
+            metricas['percentila_spc'] = int(conjunto.percentilas[bisect.bisect_left(tabla, spc, 0, 6)])
+            metricas['nivel_spc'] = bisect.bisect_left(conjunto.tabla('umbrales_spc', genero).buscar(edad), spc)
+    return metricas
+
+
+def clasificacion_imc(imc):
+    """Clasificación del IMC"""
+    if imc < 18.5:
+        return "Bajo peso"
+    elif imc < 25:
+        return "Peso normal"
+    elif imc < 30:
+        return "Sobrepeso"
+    else:
+        return "Obesidad"
+
+
+def clasificacion_grasa(nivel):
+    """Nombre y color de un código de nivel de grasa corporal"""
+    if nivel is None or nivel < 0:
+        return None, None
+    return NIVELES_GRASA[nivel], COLORES_GRASA[nivel]
+
+
+def clasificacion_spc(nivel):
+    """Nombre y color de un código de nivel SPC AAHPERD"""
+    if nivel is None or nivel < 0:
+        return None, None
+    return NIVELES_SPC[nivel], COLORES_SPC[nivel]
+
+
+def objetivo_grasa(nivel, edad, genero):
+    """Límite superior del nivel de grasa corporal para la edad y el género dados"""
+    if nivel is None or nivel < 0 or nivel >= len(NIVELES_GRASA) - 1:
+        return None
+    return float(normas.activas().objetivo_grasa(nivel, edad, genero))
+
+
+def progreso_grasa(nivel, objetivo, diferencia):
+    """Nivel actual, siguiente, porcentaje objetivo y diferencia para un código de nivel"""
+    if nivel is None or nivel < 0:
+        return None, None, None, None
+    if nivel >= len(NIVELES_GRASA) - 1:
+        return NIVELES_GRASA[nivel], None, None, None
+    if objetivo is not None and float(objetivo).is_integer():
+        objetivo = int(objetivo)
+    return NIVELES_GRASA[nivel], NIVELES_GRASA[nivel + 1], objetivo, diferencia
+
+
+def interpretacion_motivacional(percentila_spc):
+    """Mensaje, consejo y color de la interpretación motivacional de una percentila SPC AAHPERD"""
+    if not percentila_spc:
+        return None, None, None
+
+    if percentila_spc <= 5:
+        mensaje = "¡Excelente! Estás en el top 5% de la población universitaria. Tu composición corporal es excepcional."
+        consejo = "Mantén tu rutina actual de ejercicio y alimentación balanceada."
+        color = "success"
+    elif percentila_spc <= 10:
+        mensaje = "¡Muy bien! Estás en el top 10% de la población universitaria. Tu composición corporal es muy buena."
+        consejo = "Continúa con tu estilo de vida saludable y considera agregar entrenamiento de fuerza."
+        color = "info"
+    elif percentila_spc <= 25:
+        mensaje = "¡Bien! Estás por encima del promedio de la población universitaria. Tu composición corporal es buena."
+        consejo = "Mantén el ejercicio regular y considera optimizar tu alimentación."
+        color = "primary"
+    elif percentila_spc <= 50:
+        mensaje = "Estás en el promedio de la población universitaria. Hay espacio para mejorar tu composición corporal."
+        consejo = "Incorpora ejercicio cardiovascular regular y revisa tus hábitos alimentarios."
+        color = "warning"
+    elif percentila_spc <= 75:
+        mensaje = "Estás por debajo del promedio de la población universitaria. Es momento de tomar acción."
+        consejo = "Inicia un programa de ejercicio estructurado y consulta con un nutricionista."
+        color = "warning"
+    elif percentila_spc <= 90:
+        mensaje = "Tu composición corporal está significativamente por debajo del promedio. Es importante actuar ahora."
+        consejo = "Busca asesoría profesional para crear un plan de ejercicio y nutrición personalizado."
+        color = "danger"
+    else:
+        mensaje = "Tu composición corporal está muy por debajo del promedio. Es crucial buscar ayuda profesional."
+        consejo = "Consulta inmediatamente con un médico, nutricionista y entrenador personal certificado."
+        color = "danger"
+        
+    return mensaje, consejo, color
@@ -0,0 +1,147 @@
+"""
+Generador de datos sintéticos para benchmarks y pruebas de carga.
+
+Crea usuarios con altura, edad y género plausibles y, para cada uno, una
+serie de registros a lo largo del tiempo: el IMC sigue una tendencia lenta
+con variaciones de un día a otro, y los pliegues y
+circunferencias se derivan de un perfil por usuario (distribución
+log-normal por sitio, según el género y escalada con el IMC) con tres
+mediciones ruidosas por pliegue, como las toma un evaluador. Solo una parte
+de los registros trae pliegues y circunferencias (el resto son pesajes, como
+los importados de una balanza). Con la misma semilla los datos son idénticos.
+"""
+
+import random
+from datetime import date, datetime, timedelta
+
+from app import (
+    COLUMNAS_CSV_MEDIDAS, RegistroFisico, Usuario, actualizar_agregado, calcular_metricas_lote, db,
+    insertar_registros, seleccionar_registros
+)
+
+# Promedio poblacional de cada pliegue en mm (IMC 24) por género
+PLIEGUES = {
+    'M': {'tricipital': 12, 'subescapular': 16, 'suprailiaco': 18, 'abdominal': 22, 'muslo_anterior': 16, 'pantorrilla': 10},
+    'F': {'tricipital': 20, 'subescapular': 16, 'suprailiaco': 16, 'abdominal': 22, 'muslo_anterior': 26, 'pantorrilla': 16},
+}
+
+# Promedio de cada circunferencia en cm (IMC 24) por género
+CIRCUNFERENCIAS = {
+    'M': {'cuello': 38, 'pecho': 100, 'brazo': 31, 'antebrazo': 27, 'cintura': 86, 'cadera': 98, 'muslo': 55, 'pantorrilla': 37},
+    'F': {'cuello': 32, 'pecho': 90, 'brazo': 28, 'antebrazo': 24, 'cintura': 74, 'cadera': 100, 'muslo': 56, 'pantorrilla': 35},
+}
+
+NOMBRES = ('Ana', 'Lucía', 'Sofía', 'Valentina', 'Martina', 'Juan', 'Mateo', 'Santiago', 'Tomás', 'Diego')
+APELLIDOS = ('García', 'Fernández', 'González', 'Rodríguez', 'López', 'Martínez', 'Pérez', 'Romero', 'Sosa', 'Díaz')
+
+
+def generar_usuario(rng, indice):
+    """Datos de un usuario sintético (diccionario con los campos de ``Usuario``)"""
+    genero = rng.choice('MF')
+    altura = rng.gauss(1.76, 0.07) if genero == 'M' else rng.gauss(1.63, 0.065)
+    nacimiento = date(2007, 1, 1) - timedelta(days=rng.randint(0, 42 * 365))
+    return {
+        'nombre': f'{rng.choice(NOMBRES)} {indice}',
+        'apellido': rng.choice(APELLIDOS),
+        'fecha_nacimiento': nacimiento,
+        'genero': genero,
+        'altura': round(altura, 2),
+    }
+
+
+def generar_registros(rng, usuario, cantidad, inicio=datetime(2015, 1, 5), fraccion_medidas=0.6):
+    """
+    Genera ``cantidad`` registros de un usuario ordenados por fecha, a partir
+    de ``inicio`` y con uno a siete días entre mediciones. Cada registro es un
+    diccionario con las columnas de ``COLUMNAS_CSV_MEDIDAS`` y ``observaciones``.
+    """
+    genero = usuario['genero']
+    altura = usuario['altura']
+    imc = min(max(rng.gauss(25, 3.5), 17), 40)
+    # El IMC se acerca a un objetivo que se desplaza lentamente (a lo sumo 4 puntos del inicial)
+    inicial = objetivo = imc
+    tendencia = rng.gauss(0, 0.003)  # IMC por día
+    # Perfil del usuario: cuánto se aparta de la población en cada sitio
+    perfil_pliegues = {sitio: media * rng.lognormvariate(0, 0.3) for sitio, media in PLIEGUES[genero].items()}
+    perfil_circunferencias = {sitio: media * rng.gauss(1, 0.05) for sitio, media in CIRCUNFERENCIAS[genero].items()}
+
+    dia = inicio.replace(hour=0, minute=0, second=0, microsecond=0)
+    registros = []
+    for _ in range(cantidad):
+        dias = rng.randint(1, 7)
+        dia += timedelta(days=dias)
+        # Mediciones por la mañana en su mayoría
+        minutos = rng.randint(6 * 60, 10 * 60) if rng.random() < 0.8 else rng.randint(10 * 60, 21 * 60)
+        fecha = dia + timedelta(minutes=minutos)
+        objetivo = min(max(objetivo + tendencia * dias, inicial - 4, 17), inicial + 4)
+        imc += (objetivo - imc) * 0.1 + rng.gauss(0, 0.1)
+        peso = round(imc * altura ** 2, 1)
+        registro = dict.fromkeys(COLUMNAS_CSV_MEDIDAS)
+        registro.update(fecha=fecha, peso=peso, altura=altura, imc=round(peso / altura ** 2, 2), observaciones=None)
+
+        if rng.random() < fraccion_medidas:
+            # Los pliegues crecen más rápido que el IMC; tres tomas con error del evaluador
+            escala = (imc / 24) ** 1.5
+            for sitio, media in perfil_pliegues.items():
+                valor = max(media * escala, 3)
+                tomas = [round(valor * rng.gauss(1, 0.04) * 2) / 2 for _ in range(3)]
+                for i, toma in enumerate(tomas, start=1):
+                    registro[f'pliegue_{sitio}_{i}'] = toma
+                registro[f'pliegue_{sitio}_promedio'] = round(sum(tomas) / 3, 1)
+            escala = (imc / 24) ** 0.5
+            for sitio, media in perfil_circunferencias.items():
+                registro[f'circunferencia_{sitio}'] = round(media * escala * rng.gauss(1, 0.01), 1)
+            if rng.random() < 0.1:
+                registro['observaciones'] = 'Medición realizada por la mañana, en ayunas'
+        registros.append(registro)
+    return registros
+
+
+def poblar(usuarios, registros, semilla=1):
+    """
+    Crea ``usuarios`` usuarios con ``registros`` registros cada uno en la base
+    de datos de la aplicación activa, con las métricas derivadas y las
+    estadísticas acumuladas calculadas. Retorna los ids de los usuarios creados.
+    """
+    rng = random.Random(semilla)
+    ids = []
+    for indice in range(usuarios):
+        datos = generar_usuario(rng, indice + 1)
+        usuario = Usuario(**datos)
+        db.session.add(usuario)
+        db.session.flush()
+        filas = generar_registros(rng, datos, registros)
+        pliegues = [[fila[f'pliegue_{sitio}_promedio'] for fila in filas]
+                    for sitio in ('tricipital', 'subescapular', 'suprailiaco', 'abdominal')]
+        metricas = calcular_metricas_lote(pliegues, [fila['fecha'] for fila in filas], usuario)
+        for fila, valores in zip(filas, metricas):
+            fila.update(valores, usuario_id=usuario.id)
+        actualizar_agregado(usuario.id, agregadas=insertar_registros(filas))
+        usuario.registrar_cambio_datos()
+        db.session.commit()
+        ids.append(usuario.id)
+    return ids
+
+
+def csv_garmin(registros):
+    """
+    Texto de una exportación de peso de Garmin Connect con las mediciones de
+    los registros: una fila por día y una por medición, del día más reciente
+    al más antiguo, como las genera Garmin.
+    """
+    lineas = ['Time,Weight,Change,BMI,Body Fat,Skeletal Muscle Mass,Bone Mass,Body Water,']
+    dia = None
+    for registro in sorted(registros, key=lambda r: r['fecha'], reverse=True):
+        fecha = registro['fecha']
+        if fecha.date() != dia:
+            dia = fecha.date()
+            lineas.append(f' {fecha:%d %b %Y},,,,,,,,')
+        hora = f'{fecha:%I:%M %p}'.lstrip('0').lower()
+        lineas.append(f'{hora},{registro["peso"]} kg,0.2 kg,{registro["imc"]},--,--,--,--,')
+    return '\n'.join(lineas) + '\n'
+
+
+def registros_usuario(usuario_id):
+    """Registros de un usuario como diccionarios con las columnas de ``COLUMNAS_CSV_MEDIDAS``"""
+    consulta = seleccionar_registros(COLUMNAS_CSV_MEDIDAS).where(RegistroFisico.usuario_id == usuario_id)
+    return [fila._asdict() for fila in db.session.execute(consulta)]
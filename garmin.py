@@ -0,0 +1,161 @@
+"""
+Lectura de las exportaciones de peso de Garmin Connect.
+
+El CSV de Garmin agrupa las mediciones por día: una fila con la fecha
+(" 22 Sep 2025") seguida de una fila por medición con la hora, el peso y el
+IMC ("10:12 am,98.7 kg,0.2 kg,29.5,..."). ``leer_mediciones`` recorre las
+líneas una sola vez como una máquina de estados (la fecha vigente es el
+estado) y entrega cada medición a medida que la encuentra, sin cargar el
+archivo en memoria. Las columnas se ubican por el encabezado (en inglés o en
+español) y las fechas y horas se reconocen con expresiones precompiladas en
+los formatos de ambos idiomas: día-mes-año o mes-día-año con el nombre del
+mes abreviado o completo, ISO, y horas de 12 ("10:12 am", "10:12 p. m.") o de
+24 horas.
+"""
+
+import csv
+import re
+from datetime import date, datetime, time
+
+# Número de mes por las tres primeras letras del nombre (inglés y español)
+MESES = {
+    'jan': 1, 'ene': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'abr': 4,
+    'may': 5, 'jun': 6, 'jul': 7, 'aug': 8, 'ago': 8,
+    'sep': 9, 'set': 9, 'oct': 10, 'nov': 11, 'dec': 12, 'dic': 12,
+}
+
+# Nombres de las columnas del encabezado según el idioma de la exportación
+COLUMNAS_PESO = ('weight', 'peso')
+COLUMNAS_IMC = ('bmi', 'imc')
+
+_HORA = re.compile(r'(\d{1,2}):(\d{2})(?::\d{2})?\s*(?:([aApP])\.?\s*[mM]\.?)?$')
+_FECHA_DIA_MES = re.compile(r'(\d{1,2})\s+(?:de\s+)?([^\W\d_]+)\.?,?\s+(?:de\s+)?(\d{4})$')
+_FECHA_MES_DIA = re.compile(r'([^\W\d_]+)\.?\s+(\d{1,2}),?\s+(\d{4})$')
+_FECHA_ISO = re.compile(r'(\d{4})-(\d{2})-(\d{2})$')
+_PESO = re.compile(r'(\d+(?:[.,]\d+)?)\s*kg')
+
+# Horas distintas que se recuerdan ya interpretadas (memoria acotada)
+MAXIMO_HORAS = 4096
+
+
+def _columna(encabezado, nombres, defecto):
+    """Posición de la primera columna del encabezado con alguno de los nombres"""
+    for i, nombre in enumerate(encabezado):
+        if nombre.strip().lstrip('\ufeff').lower() in nombres:
+            return i
+    return defecto
+
+
+def leer_fecha(texto):
+    """Fecha de una fila de día de Garmin (None si el texto no es una fecha)"""
+    try:
+        coincidencia = _FECHA_DIA_MES.match(texto)
+        if coincidencia:
+            dia, mes, anio = coincidencia.groups()
+            return date(int(anio), MESES[mes[:3].lower()], int(dia))
+        coincidencia = _FECHA_MES_DIA.match(texto)
+        if coincidencia:
+            mes, dia, anio = coincidencia.groups()
+            return date(int(anio), MESES[mes[:3].lower()], int(dia))
+        coincidencia = _FECHA_ISO.match(texto)
+        if coincidencia:
+            return date(*map(int, coincidencia.groups()))
+    except (KeyError, ValueError):
+        pass
+    return None
+
+
+def leer_hora(texto):
+    """Hora de una fila de medición de Garmin (None si el texto no es una hora)"""
+    coincidencia = _HORA.match(texto)
+    if coincidencia is None:
+        return None
+    horas, minutos, meridiano = coincidencia.groups()
+    horas = int(horas)
+    minutos = int(minutos)
+    if meridiano:
+        if not 1 <= horas <= 12:
+            return None
+        horas = horas % 12 + (12 if meridiano in 'pP' else 0)
+    if horas > 23 or minutos > 59:
+        return None
+    return time(horas, minutos)
+
+
+def leer_peso(texto):
+    """Peso en kg de una celda ("98.7 kg", "98,7 kg"; None si no está en kg)"""
+    coincidencia = _PESO.search(texto)
+    return float(coincidencia.group(1).replace(',', '.')) if coincidencia else None
+
+
+def leer_mediciones(lineas):
+    """
+    Recorre las líneas de una exportación de Garmin y genera una medición por
+    fila válida: diccionarios con ``fecha_hora`` (datetime), ``peso`` (kg) e
+    ``imc`` (None si no figura). Las filas que no se pueden interpretar se
+    omiten.
+    """
+    lineas = iter(lineas)
+    encabezado = next(csv.reader(lineas), None)
+    if encabezado is None:
+        return
+    col_peso = _columna(encabezado, COLUMNAS_PESO, 1)
+    col_imc = _columna(encabezado, COLUMNAS_IMC, 3)
+    minima = max(col_peso, 1) + 1
+    # Solo se separan las celdas hasta la última columna utilizada
+    divisiones = max(col_peso, col_imc) + 1
+    fecha = None
+    # Las horas se repiten entre días: se interpretan una sola vez
+    horas = {}
+    combinar = datetime.combine
+
+    for linea in lineas:
+        if '"' in linea:
+            # Solo las celdas entre comillas (decimales con coma) necesitan el lector CSV
+            fila = next(csv.reader([linea]), None)
+            if not fila:
+                continue
+        else:
+            fila = linea.split(',', divisiones)
+
+        # Las celdas se usan tal cual y solo se limpian cuando el caso habitual no aplica
+        hora = horas.get(fila[0])
+        if hora is None:
+            primera = fila[0].strip()
+            if not primera:
+                continue
+            hora = leer_hora(primera) if ':' in primera else None
+            if hora is None:
+                # Fila de día: cambia la fecha de las mediciones siguientes
+                fecha = leer_fecha(primera) or fecha
+                continue
+            if len(horas) < MAXIMO_HORAS:
+                horas[fila[0]] = hora
+        if fecha is None or len(fila) < minima:
+            continue
+
+        texto_peso = fila[col_peso]
+        try:
+            # Caso habitual "98.7 kg"; el resto (coma decimal, otros espacios) por expresión regular
+            peso = float(texto_peso[:-3]) if texto_peso.endswith(' kg') else leer_peso(texto_peso)
+        except ValueError:
+            peso = leer_peso(texto_peso)
+        if peso is None:
+            continue
+
+        imc = None
+        if col_imc < len(fila):
+            texto_imc = fila[col_imc]
+            if texto_imc != '--':
+                try:
+                    imc = float(texto_imc)
+                except ValueError:
+                    # Celda vacía, con espacios o con coma decimal
+                    texto_imc = texto_imc.strip().replace(',', '.')
+                    if texto_imc and texto_imc != '--':
+                        try:
+                            imc = float(texto_imc)
+                        except ValueError:
+                            pass
+
+        yield {'fecha_hora': combinar(fecha, hora), 'peso': peso, 'imc': imc}
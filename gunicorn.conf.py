@@ -0,0 +1,52 @@
+"""
+Configuración de gunicorn para producción.
+
+Varios workers (procesos) con hilos atienden las peticiones en paralelo, de
+modo que una página de estadísticas lenta no bloquea al resto. La aplicación
+se carga una sola vez en el proceso maestro (preload_app) y los workers la
+heredan con fork; cada worker se recicla tras ``max_requests`` peticiones
+(con un margen aleatorio para que no se reinicien todos a la vez).
+
+Señales al proceso maestro:
+    HUP   relee esta configuración y reemplaza los workers de forma ordenada
+    TTIN  agrega un worker / TTOU quita uno
+    USR2  inicia un maestro nuevo con el código actualizado (luego QUIT al anterior)
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+
+# Reciclado de workers
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Tiempos: petición máxima, espera del cierre ordenado y keep-alive
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Archivo de latido de los workers en memoria (evita bloqueos en discos lentos de contenedores)
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# Métricas: cada worker guarda su estado en este directorio y /metrics informa la suma
+os.environ.setdefault('METRICAS_DIRECTORIO', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'registro-fisico-metricas'))
+
+
+def on_starting(server):
+    # Los contadores empiezan de cero con cada arranque del servidor (no con HUP)
+    shutil.rmtree(os.environ['METRICAS_DIRECTORIO'], ignore_errors=True)
+
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
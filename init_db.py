@@ -10,11 +10,12 @@ from pathlib import Path
 # Agregar el directorio actual al path
 sys.path.insert(0, '/app')
 
-from app import app, db, Usuario
+from app import create_app, db, Usuario, inicializar_base_datos
 
 def init_database():
     """Inicializa la base de datos y crea un usuario por defecto"""
     
+    app = create_app()
     with app.app_context():
         try:
             # Crear directorio instance si no existe
@@ -42,8 +43,8 @@ def init_database():
             
             print(f"✅ Permisos de escritura verificados")
             
-            # Crear todas las tablas
-            db.create_all()
+            # Crear las tablas y aplicar las migraciones pendientes
+            inicializar_base_datos()
             print("✅ Base de datos inicializada correctamente")
             
             # Verificar si ya existe un usuario
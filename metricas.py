@@ -0,0 +1,450 @@
+"""
+Métricas de la aplicación en el formato de texto de Prometheus.
+
+``instrumentar`` agrega a la aplicación:
+
+* un middleware WSGI que mide cada petición hasta que termina de enviarse la
+  respuesta (incluidas las exportaciones en streaming) y registra su
+  duración, su código de estado y las consultas SQL que ejecutó;
+* los eventos ``before_cursor_execute``/``after_cursor_execute`` del motor de
+  SQLAlchemy, que cuentan y cronometran cada consulta y la asignan a la
+  petición en curso (las de los trabajos en segundo plano quedan bajo el
+  endpoint ``ninguno``);
+* las señales de Flask de renderizado de plantillas;
+* opcionalmente, un registro de peticiones lentas con las consultas
+  capturadas agrupadas por sentencia, donde un patrón N+1 aparece como una
+  misma sentencia repetida muchas veces.
+
+Las métricas viven en memoria del proceso. Con varios workers,
+``METRICAS_DIRECTORIO`` hace que cada proceso guarde periódicamente su
+estado en un archivo y que ``/metrics`` informe la suma de todos; los
+archivos de los workers que terminaron se acumulan en uno solo para que los
+contadores no retrocedan.
+"""
+
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import before_render_template, request, request_started, template_rendered
+from sqlalchemy import event
+from werkzeug.wsgi import ClosingIterator
+
+from trabajos import proceso_vivo
+
+logger = logging.getLogger(__name__)
+
+PREFIJO = 'registro_fisico_'
+TIPO_CONTENIDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Endpoint de las peticiones sin ruta y de las consultas fuera de una petición
+SIN_ENDPOINT = 'ninguno'
+
+LIMITES_DURACION = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+LIMITES_FILAS_POR_SEGUNDO = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+ARCHIVO_FINALIZADOS = 'finalizados.json'
+
+
+class Metrica:
+    """Métrica con etiquetas; los valores se guardan por tupla de etiquetas"""
+
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas, lock):
+        self.nombre = PREFIJO + nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.valores = {}
+        self._lock = lock
+
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def incrementar(self, *etiquetas, valor=1):
+        with self._lock:
+            self.valores[etiquetas] = self.valores.get(etiquetas, 0) + valor
+
+
+class Histograma(Metrica):
+    """Histograma; por etiquetas guarda la cuenta de cada intervalo (no acumulada), la de +Inf y la suma"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas, lock, limites):
+        super().__init__(nombre, ayuda, etiquetas, lock)
+        self.limites = tuple(limites)
+
+    def observar(self, valor, *etiquetas):
+        with self._lock:
+            datos = self.valores.get(etiquetas)
+            if datos is None:
+                datos = self.valores[etiquetas] = [0] * (len(self.limites) + 2)
+            datos[bisect.bisect_left(self.limites, valor)] += 1
+            datos[-1] += valor
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(nombres, valores, extra=''):
+    partes = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return '{' + ','.join(partes) + '}' if partes else ''
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Registro:
+    """Conjunto de métricas del proceso, con el estado combinado de varios procesos opcional"""
+
+    def __init__(self):
+        self.metricas = {}
+        self.directorio = None
+        self.intervalo = 5
+        self._lock = threading.Lock()
+        self._guardado = 0
+        self._pid = os.getpid()
+        os.register_at_fork(after_in_child=self._despues_de_fork)
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._agregar(Contador(nombre, ayuda, etiquetas, self._lock))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), limites=LIMITES_DURACION):
+        return self._agregar(Histograma(nombre, ayuda, etiquetas, self._lock, limites))
+
+    def _agregar(self, metrica):
+        self.metricas[metrica.nombre] = metrica
+        return metrica
+
+    def _despues_de_fork(self):
+        # El proceso hijo (un worker) empieza sin las mediciones del padre
+        self._lock = threading.Lock()
+        for metrica in self.metricas.values():
+            metrica._lock = self._lock
+            metrica.valores = {}
+        self._guardado = 0
+
+    def estado(self):
+        """Copia de los valores de todas las métricas, serializable en JSON"""
+        with self._lock:
+            return {
+                nombre: {json.dumps(etiquetas): (list(valor) if isinstance(valor, list) else valor)
+                         for etiquetas, valor in metrica.valores.items()}
+                for nombre, metrica in self.metricas.items()
+            }
+
+    @staticmethod
+    def sumar(destino, origen):
+        """Suma el estado ``origen`` sobre ``destino``"""
+        for nombre, valores in origen.items():
+            acumulado = destino.setdefault(nombre, {})
+            for clave, valor in valores.items():
+                actual = acumulado.get(clave)
+                if actual is None:
+                    acumulado[clave] = list(valor) if isinstance(valor, list) else valor
+                elif isinstance(valor, list):
+                    acumulado[clave] = [a + b for a, b in zip(actual, valor)]
+                else:
+                    acumulado[clave] = actual + valor
+        return destino
+
+    # Estado compartido entre procesos
+
+    def configurar_directorio(self, directorio, intervalo=5):
+        self.directorio = directorio
+        self.intervalo = intervalo
+        atexit.register(self.guardar, forzar=True)
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio, nombre)
+
+    def guardar(self, forzar=False):
+        """Escribe el estado del proceso en su archivo (como máximo una vez por intervalo)"""
+        if not self.directorio:
+            return
+        ahora = time.monotonic()
+        if not forzar and ahora - self._guardado < self.intervalo:
+            return
+        self._guardado = ahora
+        try:
+            with self._bloqueo():
+                if self._pid != os.getpid():
+                    # Primer guardado del proceso: un archivo con su pid es de un proceso anterior
+                    self._pid = os.getpid()
+                    self._archivar(self._ruta(f'{self._pid}.json'))
+                self._escribir(self._ruta(f'{self._pid}.json'), self.estado())
+        except OSError:
+            logger.exception('No se pudieron guardar las métricas en %s', self.directorio)
+
+    def combinado(self):
+        """Estado de este proceso sumado al de los demás procesos (y al de los que terminaron)"""
+        estado = self.estado()
+        if not self.directorio:
+            return estado
+        propio = f'{os.getpid()}.json'
+        with self._bloqueo():
+            for nombre in os.listdir(self.directorio):
+                if not nombre.endswith('.json') or nombre in (propio, ARCHIVO_FINALIZADOS):
+                    continue
+                ruta = self._ruta(nombre)
+                pid = nombre[:-5]
+                if pid.isdigit() and not proceso_vivo(int(pid)):
+                    self._archivar(ruta)
+                    continue
+                self.sumar(estado, self._leer(ruta))
+            self.sumar(estado, self._leer(self._ruta(ARCHIVO_FINALIZADOS)))
+        return estado
+
+    def _archivar(self, ruta):
+        """Acumula el archivo de un proceso terminado en el de finalizados y lo elimina"""
+        datos = self._leer(ruta)
+        if datos:
+            finalizados = self._ruta(ARCHIVO_FINALIZADOS)
+            self._escribir(finalizados, self.sumar(self._leer(finalizados), datos))
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+    def _bloqueo(self):
+        return _BloqueoArchivo(self._ruta('.lock'))
+
+    @staticmethod
+    def _leer(ruta):
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @staticmethod
+    def _escribir(ruta, estado):
+        temporal = f'{ruta}.{os.getpid()}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(estado, archivo)
+        os.replace(temporal, ruta)
+
+    def texto(self, estado=None):
+        """Métricas en el formato de texto de Prometheus"""
+        estado = self.combinado() if estado is None else estado
+        lineas = []
+        for nombre, metrica in self.metricas.items():
+            lineas.append(f'# HELP {nombre} {metrica.ayuda}')
+            lineas.append(f'# TYPE {nombre} {metrica.tipo}')
+            for clave, valor in sorted(estado.get(nombre, {}).items()):
+                etiquetas = json.loads(clave)
+                if metrica.tipo == 'counter':
+                    lineas.append(f'{nombre}{_etiquetas(metrica.etiquetas, etiquetas)} {_numero(valor)}')
+                    continue
+                acumulado = 0
+                for limite, cantidad in zip((*metrica.limites, '+Inf'), valor[:-1]):
+                    acumulado += cantidad
+                    le = 'le="{}"'.format(limite if limite == '+Inf' else format(limite, 'g'))
+                    lineas.append(f'{nombre}_bucket{_etiquetas(metrica.etiquetas, etiquetas, le)} {acumulado}')
+                lineas.append(f'{nombre}_sum{_etiquetas(metrica.etiquetas, etiquetas)} {_numero(valor[-1])}')
+                lineas.append(f'{nombre}_count{_etiquetas(metrica.etiquetas, etiquetas)} {acumulado}')
+        return '\n'.join(lineas) + '\n'
+
+
+class _BloqueoArchivo:
+    """Bloqueo exclusivo entre procesos sobre un archivo (fcntl; sin efecto donde no existe)"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._archivo = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        self._archivo = open(self.ruta, 'a')
+        fcntl.flock(self._archivo, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._archivo is not None:
+            self._archivo.close()  # cerrar libera el bloqueo
+            self._archivo = None
+
+
+registro = Registro()
+
+PETICIONES = registro.contador('http_peticiones_total', 'Peticiones atendidas', ('endpoint', 'metodo', 'estado'))
+DURACION_PETICION = registro.histograma(
+    'http_peticion_duracion_segundos', 'Duración de las peticiones hasta enviar la respuesta completa',
+    ('endpoint', 'metodo'))
+CONSULTAS_SQL = registro.contador('sql_consultas_total', 'Consultas SQL ejecutadas', ('endpoint',))
+DURACION_SQL = registro.contador('sql_duracion_segundos_total', 'Tiempo total en consultas SQL', ('endpoint',))
+CONSULTAS_POR_PETICION = registro.histograma(
+    'sql_consultas_por_peticion', 'Consultas SQL ejecutadas por cada petición', ('endpoint',), LIMITES_CONSULTAS)
+DURACION_SQL_POR_PETICION = registro.histograma(
+    'sql_duracion_por_peticion_segundos', 'Tiempo en consultas SQL de cada petición', ('endpoint',))
+DURACION_PLANTILLA = registro.histograma(
+    'plantilla_duracion_segundos', 'Duración del renderizado de cada plantilla', ('plantilla',))
+IMPORTACIONES = registro.contador('importaciones_total', 'Trabajos de importación terminados', ('tipo', 'estado'))
+FILAS_IMPORTADAS = registro.contador('importacion_filas_total', 'Filas leídas por las importaciones', ('tipo',))
+DURACION_IMPORTACION = registro.contador(
+    'importacion_duracion_segundos_total', 'Tiempo total de los trabajos de importación', ('tipo',))
+FILAS_POR_SEGUNDO = registro.histograma(
+    'importacion_filas_por_segundo', 'Filas por segundo de cada trabajo de importación', ('tipo',),
+    LIMITES_FILAS_POR_SEGUNDO)
+
+
+class Medicion:
+    """Mediciones de la petición en curso"""
+
+    __slots__ = ('endpoint', 'consultas', 'tiempo_sql', 'sentencias', 'omitidas', 'capturar', 'maximo_sentencias', 'plantillas')
+
+    def __init__(self, capturar, maximo_sentencias):
+        self.endpoint = SIN_ENDPOINT
+        self.consultas = 0
+        self.tiempo_sql = 0.0
+        self.sentencias = {}  # sentencia -> [cantidad, segundos] (solo con el registro de peticiones lentas)
+        self.omitidas = 0
+        self.capturar = capturar
+        self.maximo_sentencias = maximo_sentencias
+        self.plantillas = []
+
+
+_medicion = contextvars.ContextVar('medicion', default=None)
+
+
+class Instrumentacion:
+    """Middleware WSGI que mide cada petición y registra las peticiones lentas"""
+
+    def __init__(self, wsgi_app, peticion_lenta=0, maximo_sentencias=20):
+        self.wsgi_app = wsgi_app
+        self.peticion_lenta = peticion_lenta
+        self.maximo_sentencias = maximo_sentencias
+
+    def __call__(self, environ, start_response):
+        medicion = Medicion(self.peticion_lenta > 0, self.maximo_sentencias)
+        _medicion.set(medicion)
+        inicio = time.perf_counter()
+        estado = ['500']
+
+        def iniciar_respuesta(status, headers, exc_info=None):
+            estado[0] = status.split(' ', 1)[0]
+            return start_response(status, headers, exc_info)
+
+        try:
+            respuesta = self.wsgi_app(environ, iniciar_respuesta)
+        except BaseException:
+            self._finalizar(environ, medicion, inicio, '500')
+            raise
+        return ClosingIterator(respuesta, lambda: self._finalizar(environ, medicion, inicio, estado[0]))
+
+    def _finalizar(self, environ, medicion, inicio, estado):
+        duracion = time.perf_counter() - inicio
+        _medicion.set(None)
+        endpoint = medicion.endpoint
+        metodo = environ.get('REQUEST_METHOD', 'GET')
+
+        PETICIONES.incrementar(endpoint, metodo, estado)
+        DURACION_PETICION.observar(duracion, endpoint, metodo)
+        CONSULTAS_POR_PETICION.observar(medicion.consultas, endpoint)
+        DURACION_SQL_POR_PETICION.observar(medicion.tiempo_sql, endpoint)
+        if medicion.consultas:
+            CONSULTAS_SQL.incrementar(endpoint, valor=medicion.consultas)
+            DURACION_SQL.incrementar(endpoint, valor=medicion.tiempo_sql)
+
+        if medicion.capturar and duracion >= self.peticion_lenta:
+            self._registrar_lenta(environ, endpoint, estado, duracion, medicion)
+        registro.guardar()
+
+    def _registrar_lenta(self, environ, endpoint, estado, duracion, medicion):
+        ruta = environ.get('PATH_INFO', '')
+        if environ.get('QUERY_STRING'):
+            ruta += '?' + environ['QUERY_STRING']
+        lineas = [
+            f'Petición lenta: {environ.get("REQUEST_METHOD")} {ruta} ({endpoint}, {estado}) {duracion:.3f} s, '
+            f'{medicion.consultas} consultas SQL en {medicion.tiempo_sql:.3f} s'
+        ]
+        # Las sentencias repetidas (N+1) quedan primero: ordenadas por tiempo total
+        sentencias = sorted(medicion.sentencias.items(), key=lambda item: item[1][1], reverse=True)
+        for sentencia, (cantidad, segundos) in sentencias:
+            lineas.append(f'  ×{cantidad:<4} {segundos * 1000:9.1f} ms  {" ".join(sentencia.split())[:500]}')
+        if medicion.omitidas:
+            lineas.append(f'  ... y {medicion.omitidas} consultas de otras sentencias')
+        logger.warning('\n'.join(lineas))
+
+
+def _antes_de_cursor(conexion, cursor, sentencia, parametros, contexto, varias):
+    if contexto is not None:
+        contexto._inicio_metricas = time.perf_counter()
+
+
+def _despues_de_cursor(conexion, cursor, sentencia, parametros, contexto, varias):
+    inicio = getattr(contexto, '_inicio_metricas', None)
+    duracion = time.perf_counter() - inicio if inicio is not None else 0.0
+    medicion = _medicion.get()
+    if medicion is None:
+        CONSULTAS_SQL.incrementar(SIN_ENDPOINT)
+        DURACION_SQL.incrementar(SIN_ENDPOINT, valor=duracion)
+        return
+    medicion.consultas += 1
+    medicion.tiempo_sql += duracion
+    if medicion.capturar:
+        datos = medicion.sentencias.get(sentencia)
+        if datos is not None:
+            datos[0] += 1
+            datos[1] += duracion
+        elif len(medicion.sentencias) < medicion.maximo_sentencias:
+            medicion.sentencias[sentencia] = [1, duracion]
+        else:
+            medicion.omitidas += 1
+
+
+def _peticion_iniciada(app, **extra):
+    # El endpoint se conoce después del enrutamiento y el contexto de Flask se descarta antes del final
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion.endpoint = request.endpoint or SIN_ENDPOINT
+
+
+def _antes_de_plantilla(app, template, context, **extra):
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion.plantillas.append(time.perf_counter())
+
+
+def _plantilla_renderizada(app, template, context, **extra):
+    medicion = _medicion.get()
+    if medicion is not None and medicion.plantillas:
+        DURACION_PLANTILLA.observar(time.perf_counter() - medicion.plantillas.pop(), template.name or 'sin nombre')
+
+
+def instrumentar(app, motor):
+    """Instala el middleware, los eventos SQL del motor y las señales de plantillas en la aplicación"""
+    if not event.contains(motor, 'before_cursor_execute', _antes_de_cursor):
+        event.listen(motor, 'before_cursor_execute', _antes_de_cursor)
+        event.listen(motor, 'after_cursor_execute', _despues_de_cursor)
+    request_started.connect(_peticion_iniciada, app)
+    before_render_template.connect(_antes_de_plantilla, app)
+    template_rendered.connect(_plantilla_renderizada, app)
+    if app.config['METRICAS_DIRECTORIO']:
+        registro.configurar_directorio(app.config['METRICAS_DIRECTORIO'], app.config['METRICAS_INTERVALO'])
+    app.wsgi_app = Instrumentacion(app.wsgi_app, app.config['METRICAS_PETICION_LENTA'],
+                                   app.config['METRICAS_MAXIMO_SENTENCIAS'])
+
+
+def registrar_importacion(tipo, estado, filas, segundos):
+    """Registra un trabajo de importación terminado (las filas se cuentan a medida que avanza)"""
+    IMPORTACIONES.incrementar(tipo, estado)
+    DURACION_IMPORTACION.incrementar(tipo, valor=segundos)
+    if filas and segundos > 0:
+        FILAS_POR_SEGUNDO.observar(filas / segundos, tipo)
@@ -0,0 +1,338 @@
+"""
+Migraciones versionadas del esquema de la base de datos.
+
+Cada migración tiene un número de versión, una descripción y una función que
+recibe la sesión de SQLAlchemy. Las versiones aplicadas se guardan en la tabla
+``schema_version``; al iniciar la aplicación solo se ejecutan las pendientes,
+por lo que con el esquema al día ``migrar`` se reduce a una consulta. Las
+migraciones son idempotentes (comprueban columnas e índices antes de crearlos)
+para convivir con las tablas que ``db.create_all()`` ya creó con el modelo
+actual, y usan SQL propio en lugar de los modelos para no depender de su
+forma futura.
+"""
+
+import logging
+from datetime import datetime
+
+import sqlalchemy as sa
+
+import composicion
+from composicion import calcular_edad
+
+logger = logging.getLogger(__name__)
+
+metadata = sa.MetaData()
+
+tabla_version = sa.Table(
+    'schema_version', metadata,
+    sa.Column('version', sa.Integer, primary_key=True),
+    sa.Column('descripcion', sa.String(200), nullable=False),
+    sa.Column('aplicada', sa.DateTime, nullable=False),
+)
+
+
+class Migracion:
+    """Paso de migración del esquema"""
+
+    __slots__ = ('version', 'descripcion', 'funcion')
+
+    def __init__(self, version, descripcion, funcion):
+        self.version = version
+        self.descripcion = descripcion
+        self.funcion = funcion
+
+    def __repr__(self):
+        return f'<Migracion {self.version}: {self.descripcion}>'
+
+
+MIGRACIONES = []
+
+
+def migracion(version, descripcion):
+    """Registra una función como la migración ``version`` (en orden creciente)"""
+    def registrar(funcion):
+        if MIGRACIONES and version <= MIGRACIONES[-1].version:
+            raise ValueError(f'La migración {version} debe ser posterior a la {MIGRACIONES[-1].version}')
+        MIGRACIONES.append(Migracion(version, descripcion, funcion))
+        return funcion
+    return registrar
+
+
+def version_esquema(sesion):
+    """Última versión de migración aplicada (0 si no se aplicó ninguna)"""
+    tabla_version.create(sesion.connection(), checkfirst=True)
+    return sesion.execute(sa.select(sa.func.max(tabla_version.c.version))).scalar() or 0
+
+
+def pendientes(sesion):
+    """Migraciones registradas que todavía no se aplicaron"""
+    actual = version_esquema(sesion)
+    return [m for m in MIGRACIONES if m.version > actual]
+
+
+def migrar(sesion):
+    """
+    Aplica las migraciones pendientes, cada una en su propia transacción.
+
+    Retorna la lista de migraciones aplicadas (vacía si el esquema ya estaba al día).
+    """
+    aplicadas = []
+    for paso in pendientes(sesion):
+        logger.info('Aplicando migración %s: %s', paso.version, paso.descripcion)
+        try:
+            paso.funcion(sesion)
+            sesion.execute(tabla_version.insert().values(
+                version=paso.version, descripcion=paso.descripcion, aplicada=datetime.utcnow()
+            ))
+            sesion.commit()
+        except Exception:
+            sesion.rollback()
+            raise
+        aplicadas.append(paso)
+    sesion.commit()
+    return aplicadas
+
+
+# Utilidades para escribir migraciones
+
+def columnas(sesion, tabla):
+    """Nombres de las columnas existentes de una tabla"""
+    return {c['name'] for c in sa.inspect(sesion.connection()).get_columns(tabla)}
+
+
+def indices(sesion, tabla):
+    """Nombres de los índices existentes de una tabla"""
+    return {i['name'] for i in sa.inspect(sesion.connection()).get_indexes(tabla)}
+
+
+def agregar_columnas(sesion, tabla, definiciones):
+    """Agrega las columnas (nombre -> tipo SQL) que falten en la tabla; retorna las agregadas"""
+    existentes = columnas(sesion, tabla)
+    agregadas = [nombre for nombre in definiciones if nombre not in existentes]
+    for nombre in agregadas:
+        sesion.execute(sa.text(f'ALTER TABLE {tabla} ADD COLUMN {nombre} {definiciones[nombre]}'))
+    return agregadas
+
+
+# Migraciones del esquema
+
+def _fecha(valor):
+    """Convierte una fecha leída con SQL de texto (cadena en SQLite) en date/datetime"""
+    if isinstance(valor, str):
+        return datetime.fromisoformat(valor)
+    return valor
+
+
+@migracion(1, 'Métricas derivadas guardadas en registro_fisico')
+def _metricas_guardadas(sesion):
+    agregadas = agregar_columnas(sesion, 'registro_fisico', {
+        'edad_en_medicion': 'INTEGER',
+        'porcentaje_grasa': 'FLOAT',
+        'percentila_grasa': 'INTEGER',
+        'nivel_grasa': 'INTEGER',
+        'spc': 'FLOAT',
+        'percentila_spc': 'INTEGER',
+        'nivel_spc': 'INTEGER',
+    })
+    if not agregadas:
+        return
+
+    # Completar las métricas de los registros existentes, usuario por usuario
+    usuarios = sesion.execute(sa.text('SELECT id, fecha_nacimiento, genero FROM usuario')).all()
+    for usuario_id, fecha_nacimiento, genero in usuarios:
+        filas = sesion.execute(sa.text(
+            'SELECT id, fecha, pliegue_tricipital_promedio, pliegue_subescapular_promedio, '
+            'pliegue_suprailiaco_promedio, pliegue_abdominal_promedio '
+            'FROM registro_fisico WHERE usuario_id = :usuario_id'
+        ), {'usuario_id': usuario_id}).all()
+        if not filas:
+            continue
+        ids, fechas, *pliegues = zip(*filas)
+        fecha_nacimiento = _fecha(fecha_nacimiento)
+        edades = [calcular_edad(fecha_nacimiento, _fecha(fecha)) for fecha in fechas]
+        listas = composicion.a_listas(composicion.calcular_lote(*pliegues, edades, genero))
+        sesion.execute(sa.text(
+            'UPDATE registro_fisico SET edad_en_medicion = :edad, porcentaje_grasa = :porcentaje_grasa, '
+            'percentila_grasa = :percentila_grasa, nivel_grasa = :nivel_grasa, spc = :spc, '
+            'percentila_spc = :percentila_spc, nivel_spc = :nivel_spc WHERE id = :id'
+        ), [
+            {
+                'id': registro_id,
+                'edad': edad,
+                **{clave: listas[clave][i] for clave in (
+                    'porcentaje_grasa', 'percentila_grasa', 'nivel_grasa',
+                    'spc', 'percentila_spc', 'nivel_spc'
+                )}
+            }
+            for i, (registro_id, edad) in enumerate(zip(ids, edades))
+        ])
+
+
+@migracion(2, 'Índice único (usuario_id, fecha DESC) en registro_fisico')
+def _indice_registros_usuario_fecha(sesion):
+    # Reemplaza el índice único ascendente de versiones anteriores
+    sesion.execute(sa.text('DROP INDEX IF EXISTS uq_registro_usuario_fecha'))
+    if 'ix_registro_usuario_fecha' in indices(sesion, 'registro_fisico'):
+        return
+    duplicados = sesion.execute(sa.text(
+        'SELECT 1 FROM registro_fisico GROUP BY usuario_id, fecha HAVING COUNT(*) > 1 LIMIT 1'
+    )).first()
+    if duplicados:
+        # Con registros duplicados no se puede exigir unicidad; el índice igual acelera las consultas
+        logger.warning('Hay registros duplicados por usuario y fecha: se crea ix_registro_usuario_fecha sin unicidad')
+        sesion.execute(sa.text('CREATE INDEX ix_registro_usuario_fecha ON registro_fisico (usuario_id, fecha DESC)'))
+    else:
+        sesion.execute(sa.text('CREATE UNIQUE INDEX ix_registro_usuario_fecha ON registro_fisico (usuario_id, fecha DESC)'))
+
+
+@migracion(3, 'Índices de usuario para el listado de activos y el orden por nombre')
+def _indices_usuario(sesion):
+    sesion.execute(sa.text('CREATE INDEX IF NOT EXISTS ix_usuario_activo ON usuario (activo)'))
+    sesion.execute(sa.text('CREATE INDEX IF NOT EXISTS ix_usuario_nombre_apellido ON usuario (nombre, apellido)'))
+
+
+@migracion(4, 'Fecha de última modificación de los datos de cada usuario')
+def _datos_modificados_usuario(sesion):
+    if agregar_columnas(sesion, 'usuario', {'datos_modificados': 'DATETIME'}):
+        sesion.execute(sa.text('UPDATE usuario SET datos_modificados = :ahora'), {'ahora': datetime.utcnow()})
+
+
+@migracion(5, 'Estadísticas acumuladas por usuario (agregado_usuario)')
+def _agregados_usuario(sesion):
+    sesion.execute(sa.text(
+        'CREATE TABLE IF NOT EXISTS agregado_usuario ('
+        'usuario_id INTEGER NOT NULL PRIMARY KEY REFERENCES usuario (id), '
+        'total_registros INTEGER NOT NULL, suma_peso FLOAT NOT NULL, peso_minimo FLOAT, peso_maximo FLOAT, '
+        'suma_imc FLOAT NOT NULL, registros_grasa INTEGER NOT NULL, suma_grasa FLOAT NOT NULL, '
+        'registros_spc INTEGER NOT NULL, suma_spc FLOAT NOT NULL, primera_fecha DATETIME, peso_inicial FLOAT, '
+        'ultimo_registro_id INTEGER, ultima_fecha DATETIME, peso_actual FLOAT, '
+        'fecha_ultima_grasa DATETIME, ultima_grasa FLOAT)'
+    ))
+    # Reconstruir las estadísticas de todos los usuarios desde sus registros
+    sesion.execute(sa.text('DELETE FROM agregado_usuario'))
+    sesion.execute(sa.text('''
+        INSERT INTO agregado_usuario (
+            usuario_id, total_registros, suma_peso, peso_minimo, peso_maximo, suma_imc,
+            registros_grasa, suma_grasa, registros_spc, suma_spc, primera_fecha, peso_inicial,
+            ultimo_registro_id, ultima_fecha, peso_actual, fecha_ultima_grasa, ultima_grasa
+        )
+        SELECT u.id, COUNT(r.id), COALESCE(SUM(r.peso), 0), MIN(r.peso), MAX(r.peso), COALESCE(SUM(r.imc), 0),
+               COUNT(NULLIF(r.porcentaje_grasa, 0)), COALESCE(SUM(r.porcentaje_grasa), 0),
+               COUNT(NULLIF(r.spc, 0)), COALESCE(SUM(r.spc), 0), MIN(r.fecha),
+               (SELECT peso FROM registro_fisico WHERE usuario_id = u.id ORDER BY fecha, id LIMIT 1),
+               (SELECT id FROM registro_fisico WHERE usuario_id = u.id ORDER BY fecha DESC, id DESC LIMIT 1),
+               MAX(r.fecha),
+               (SELECT peso FROM registro_fisico WHERE usuario_id = u.id ORDER BY fecha DESC, id DESC LIMIT 1),
+               (SELECT fecha FROM registro_fisico WHERE usuario_id = u.id AND porcentaje_grasa != 0
+                ORDER BY fecha DESC, id DESC LIMIT 1),
+               (SELECT porcentaje_grasa FROM registro_fisico WHERE usuario_id = u.id AND porcentaje_grasa != 0
+                ORDER BY fecha DESC, id DESC LIMIT 1)
+        FROM usuario u LEFT JOIN registro_fisico r ON r.usuario_id = u.id
+        GROUP BY u.id
+    '''))
+
+
+@migracion(6, 'Versión de los datos de cada usuario (caché de páginas)')
+def _version_datos_usuario(sesion):
+    agregar_columnas(sesion, 'usuario', {'version_datos': 'INTEGER NOT NULL DEFAULT 0'})
+
+
+@migracion(7, 'Trabajos de importación en segundo plano')
+def _trabajos_importacion(sesion):
+    sesion.execute(sa.text(
+        'CREATE TABLE IF NOT EXISTS trabajo_importacion ('
+        'id INTEGER NOT NULL PRIMARY KEY, usuario_id INTEGER NOT NULL REFERENCES usuario (id), '
+        'tipo VARCHAR(20) NOT NULL, archivo VARCHAR(255), estado VARCHAR(20) NOT NULL, '
+        'cancelar BOOLEAN NOT NULL, pid INTEGER, filas_leidas INTEGER NOT NULL, importados INTEGER NOT NULL, '
+        'duplicados INTEGER NOT NULL, total_errores INTEGER NOT NULL, errores TEXT, mensaje TEXT, '
+        'creado DATETIME, iniciado DATETIME, finalizado DATETIME)'
+    ))
+    sesion.execute(sa.text(
+        'CREATE INDEX IF NOT EXISTS ix_trabajo_importacion_usuario_id ON trabajo_importacion (usuario_id)'
+    ))
+
+
+# Columnas que pasan de registro_fisico a medidas_registro
+SITIOS_PLIEGUES = ('tricipital', 'subescapular', 'suprailiaco', 'abdominal', 'muslo_anterior', 'pantorrilla')
+SITIOS_CIRCUNFERENCIAS = ('cuello', 'pecho', 'brazo', 'antebrazo', 'cintura', 'cadera', 'muslo', 'pantorrilla')
+COLUMNAS_MEDIDAS = (
+    [f'pliegue_{sitio}_{toma}' for sitio in SITIOS_PLIEGUES for toma in ('1', '2', '3', 'promedio')]
+    + [f'circunferencia_{sitio}' for sitio in SITIOS_CIRCUNFERENCIAS]
+)
+
+
+@migracion(8, 'Pliegues, circunferencias y observaciones en medidas_registro')
+def _medidas_registro(sesion):
+    if 'pliegue_tricipital_1' not in columnas(sesion, 'registro_fisico'):
+        return
+    sesion.execute(sa.text(
+        'CREATE TABLE IF NOT EXISTS medidas_registro ('
+        'registro_id INTEGER NOT NULL PRIMARY KEY REFERENCES registro_fisico (id) ON DELETE CASCADE, '
+        + ''.join(f'{nombre} FLOAT, ' for nombre in COLUMNAS_MEDIDAS) + 'observaciones TEXT)'
+    ))
+    # Solo los registros con alguna medida tienen fila en medidas_registro
+    lista = ', '.join(COLUMNAS_MEDIDAS + ['observaciones'])
+    con_medidas = ' OR '.join(f'{nombre} IS NOT NULL' for nombre in COLUMNAS_MEDIDAS)
+    sesion.execute(sa.text(
+        f'INSERT OR IGNORE INTO medidas_registro (registro_id, {lista}) '
+        f"SELECT id, {lista} FROM registro_fisico WHERE {con_medidas} OR COALESCE(observaciones, '') != ''"
+    ))
+
+    # SQLite no quita columnas sin reescribir la tabla: se crea la tabla angosta, se copian
+    # los registros y se recrean sus índices
+    definiciones_indices = sesion.execute(sa.text(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'registro_fisico' AND sql IS NOT NULL"
+    )).scalars().all()
+    sesion.execute(sa.text(
+        'CREATE TABLE registro_fisico_angosta ('
+        'id INTEGER NOT NULL PRIMARY KEY, usuario_id INTEGER NOT NULL REFERENCES usuario (id), fecha DATETIME, '
+        'peso FLOAT NOT NULL, altura FLOAT NOT NULL, imc FLOAT NOT NULL, edad_en_medicion INTEGER, '
+        'porcentaje_grasa FLOAT, percentila_grasa INTEGER, nivel_grasa INTEGER, spc FLOAT, '
+        'percentila_spc INTEGER, nivel_spc INTEGER)'
+    ))
+    lista = ('id, usuario_id, fecha, peso, altura, imc, edad_en_medicion, porcentaje_grasa, percentila_grasa, '
+             'nivel_grasa, spc, percentila_spc, nivel_spc')
+    sesion.execute(sa.text(f'INSERT INTO registro_fisico_angosta ({lista}) SELECT {lista} FROM registro_fisico'))
+    sesion.execute(sa.text('DROP TABLE registro_fisico'))
+    sesion.execute(sa.text('ALTER TABLE registro_fisico_angosta RENAME TO registro_fisico'))
+    for definicion in definiciones_indices:
+        sesion.execute(sa.text(definicion))
+    logger.info('Medidas separadas de registro_fisico; VACUUM reduce el archivo de la base de datos')
+
+
+@migracion(9, 'Estado incremental de las tendencias por usuario (tendencia_usuario)')
+def _tendencias_usuario(sesion):
+    # Las filas se crean desde los registros la primera vez que se leen o actualizan las tendencias
+    sesion.execute(sa.text(
+        'CREATE TABLE IF NOT EXISTS tendencia_usuario ('
+        'usuario_id INTEGER NOT NULL REFERENCES usuario (id), metrica VARCHAR(20) NOT NULL, '
+        'registros INTEGER NOT NULL, fecha DATETIME, valor FLOAT, ponderacion_ema FLOAT NOT NULL, '
+        'suma_ema FLOAT NOT NULL, ponderacion FLOAT NOT NULL, suma_x FLOAT NOT NULL, suma_y FLOAT NOT NULL, '
+        'suma_xx FLOAT NOT NULL, suma_xy FLOAT NOT NULL, PRIMARY KEY (usuario_id, metrica))'
+    ))
+
+
+@migracion(10, 'Objetivo y diferencia de grasa guardados junto con el nivel en registro_fisico')
+def _objetivo_grasa_guardado(sesion):
+    if not agregar_columnas(sesion, 'registro_fisico', {'objetivo_grasa': 'FLOAT', 'diferencia_grasa': 'FLOAT'}):
+        return
+
+    # El objetivo depende solo del nivel, la edad y el género: una actualización por combinación
+    combinaciones = sesion.execute(sa.text(
+        'SELECT DISTINCT r.nivel_grasa, r.edad_en_medicion, u.genero FROM registro_fisico r '
+        'JOIN usuario u ON u.id = r.usuario_id WHERE r.nivel_grasa >= 0'
+    )).all()
+    for nivel, edad, genero in combinaciones:
+        objetivo = composicion.objetivo_grasa(nivel, edad, genero)
+        if objetivo is None:
+            continue
+        sesion.execute(sa.text(
+            'UPDATE registro_fisico SET objetivo_grasa = :objetivo, diferencia_grasa = :objetivo - porcentaje_grasa '
+            'WHERE nivel_grasa = :nivel AND edad_en_medicion IS :edad '
+            'AND usuario_id IN (SELECT id FROM usuario WHERE genero IS :genero)'
+        ), {'objetivo': objetivo, 'nivel': nivel, 'edad': edad, 'genero': genero})
+
+
+@migracion(11, 'Máquina y latido de los trabajos de importación')
+def _latido_trabajos(sesion):
+    agregar_columnas(sesion, 'trabajo_importacion', {'host': 'VARCHAR(255)', 'latido': 'DATETIME'})
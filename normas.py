@@ -0,0 +1,244 @@
+"""
+Catálogo de tablas de referencia (normas) para la composición corporal.
+
+Las constantes de Durnin-Womersley, los rangos y percentilas de grasa corporal
+y las tablas AAHPERD se leen de archivos JSON versionados (``normas/*.json`` y,
+opcionalmente, directorios adicionales configurables). Cada tabla se guarda en
+arrays ordenados por género y tramo de edad; la búsqueda del tramo, de la
+clasificación y de la percentila se resuelve por búsqueda binaria. Los
+archivos se vuelven a leer cuando cambian, sin reiniciar la aplicación.
+"""
+
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO_NORMAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'normas')
+
+PERCENTILAS = (5, 10, 25, 50, 75, 90, 95)
+
+# Cantidad de valores por tramo de cada tabla y si son umbrales (ordenados de menor a mayor)
+COLUMNAS_TABLAS = {
+    'durnin_womersley': (2, False),
+    'rangos_grasa': (6, True),
+    'percentilas_grasa': (7, True),
+    'percentilas_spc': (7, True),
+    'umbrales_spc': (5, True),
+}
+
+
+class TablaPorEdad:
+    """Valores de referencia de un género, ordenados por tramo de edad"""
+
+    __slots__ = ('edades_min', 'edades_max', 'filas', 'valores')
+
+    def __init__(self, tramos, defecto, columnas):
+        tramos = sorted(tramos, key=lambda t: t['edades'][0])
+        self.edades_min = [t['edades'][0] for t in tramos]
+        self.edades_max = [t['edades'][1] for t in tramos]
+        # La última fila es la tabla por defecto, para edades fuera de todos los tramos
+        filas = [tuple(t['valores']) for t in tramos]
+        filas.append(tuple(defecto) if defecto is not None else (float('nan'),) * columnas)
+        self.filas = filas
+        self.valores = np.array(filas, dtype=float)
+
+    def indice(self, edad):
+        """Índice del tramo que contiene la edad (o de la tabla por defecto)"""
+        if edad is not None:
+            i = bisect.bisect_right(self.edades_min, edad) - 1
+            if i >= 0 and edad <= self.edades_max[i]:
+                return i
+        return len(self.filas) - 1
+
+    def indices(self, edades):
+        """Índices de tramo para un array de edades (NaN usa la tabla por defecto)"""
+        edades = np.asarray(edades, dtype=float)
+        i = np.searchsorted(self.edades_min, edades, side='right') - 1
+        maximos = np.asarray(self.edades_max + [-np.inf], dtype=float)
+        dentro = (i >= 0) & (edades <= maximos[i])
+        return np.where(dentro, i, len(self.filas) - 1)
+
+    def buscar(self, edad):
+        """Valores de referencia para una edad"""
+        return self.filas[self.indice(edad)]
+
+
+class ConjuntoNormas:
+    """Conjunto versionado de tablas de referencia de una población"""
+
+    def __init__(self, datos, archivo=None):
+        try:
+            self.poblacion = str(datos['poblacion'])
+            self.version = int(datos['version'])
+            self.descripcion = datos.get('descripcion', '')
+            self.percentilas = tuple(datos.get('percentilas', PERCENTILAS))
+            self.archivo = archivo
+            self._tablas = {}
+            for nombre, (columnas, umbrales) in COLUMNAS_TABLAS.items():
+                for genero in ('M', 'F'):
+                    definicion = datos['tablas'][nombre][genero]
+                    tramos = definicion['tramos']
+                    defecto = definicion.get('defecto')
+                    for valores in [t['valores'] for t in tramos] + ([defecto] if defecto else []):
+                        if len(valores) != columnas:
+                            raise ValueError(f'{nombre}/{genero}: se esperaban {columnas} valores por tramo')
+                        if umbrales and list(valores) != sorted(valores):
+                            raise ValueError(f'{nombre}/{genero}: los umbrales deben ser crecientes')
+                    self._tablas[(nombre, genero)] = TablaPorEdad(tramos, defecto, columnas)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f'Archivo de normas inválido {archivo or ""}: {e}') from e
+        if len(self.percentilas) != 7:
+            raise ValueError(f'Archivo de normas inválido {archivo or ""}: se esperaban 7 percentilas')
+
+    def __repr__(self):
+        return f'<ConjuntoNormas {self.clave}>'
+
+    @property
+    def clave(self):
+        return f'{self.poblacion}@{self.version}'
+
+    def tabla(self, nombre, genero):
+        """Tabla de referencia de un género ('M'; cualquier otro valor usa la tabla femenina)"""
+        return self._tablas[(nombre, 'M' if genero == 'M' else 'F')]
+
+    def clasificar_grasa(self, porcentaje, edad, genero):
+        """Código de nivel de grasa corporal (índice del primer rango mayor al porcentaje)"""
+        rangos = self.tabla('rangos_grasa', genero).buscar(edad)
+        return bisect.bisect_right(rangos, porcentaje, hi=5)
+
+    def objetivo_grasa(self, nivel, edad, genero):
+        """Límite superior del nivel de grasa corporal para la edad y el género dados"""
+        return self.tabla('rangos_grasa', genero).buscar(edad)[nivel]
+
+    def percentila_grasa(self, porcentaje, edad, genero):
+        """Percentila del porcentaje de grasa corporal"""
+        tabla = self.tabla('percentilas_grasa', genero).buscar(edad)
+        return self.percentilas[bisect.bisect_left(tabla, porcentaje, hi=6)]
+
+    def percentila_spc(self, spc, edad, genero):
+        """Percentila de la SPC según las tablas AAHPERD"""
+        tabla = self.tabla('percentilas_spc', genero).buscar(edad)
+        return self.percentilas[bisect.bisect_left(tabla, spc, hi=6)]
+
+    def clasificar_spc(self, spc, edad, genero):
+        """Código de nivel SPC AAHPERD"""
+        return bisect.bisect_left(self.tabla('umbrales_spc', genero).buscar(edad), spc)
+
+
+class CatalogoNormas:
+    """Carga los archivos de normas, resuelve la población activa y los recarga cuando cambian"""
+
+    def __init__(self, directorios=None, poblacion='aahperd', intervalo=5.0):
+        self._lock = threading.Lock()
+        self.directorios = list(directorios or [DIRECTORIO_NORMAS])
+        self.poblacion = poblacion
+        self.intervalo = intervalo
+        self._por_archivo = {}  # ruta -> (firma, ConjuntoNormas)
+        self._activas = None
+        self._ultima_revision = None
+
+    def configurar(self, directorios=None, poblacion=None, intervalo=None):
+        """Cambia la configuración y carga las normas; falla si la población activa no existe"""
+        with self._lock:
+            if directorios is not None:
+                self.directorios = [d for d in directorios if d]
+            if poblacion is not None:
+                self.poblacion = poblacion
+            if intervalo is not None:
+                self.intervalo = intervalo
+            self._por_archivo = {}
+            self._activas = None
+            self._cargar(estricto=True)
+
+    def _archivos(self):
+        archivos = {}
+        for directorio in self.directorios:
+            for ruta in sorted(glob.glob(os.path.join(directorio, '*.json'))):
+                try:
+                    estado = os.stat(ruta)
+                except OSError:
+                    continue
+                archivos[ruta] = (estado.st_mtime_ns, estado.st_size)
+        return archivos
+
+    def _cargar(self, estricto=False):
+        archivos = self._archivos()
+        por_archivo = {}
+        for ruta, firma in archivos.items():
+            previo = self._por_archivo.get(ruta)
+            if previo and previo[0] == firma:
+                por_archivo[ruta] = previo
+                continue
+            try:
+                with open(ruta, encoding='utf-8') as f:
+                    conjunto = ConjuntoNormas(json.load(f), archivo=ruta)
+            except (OSError, ValueError) as e:
+                if estricto:
+                    raise
+                # Se conserva la versión anterior del archivo hasta que se corrija
+                logger.error('No se pudo recargar %s: %s', ruta, e)
+                if previo:
+                    por_archivo[ruta] = (firma, previo[1])
+                continue
+            if previo:
+                logger.warning('Normas recargadas: %s (recalcular métricas con "flask recalcular-metricas")', conjunto.clave)
+            por_archivo[ruta] = (firma, conjunto)
+
+        self._por_archivo = por_archivo
+        self._ultima_revision = time.monotonic()
+        try:
+            self._activas = self._resolver(self.poblacion)
+        except LookupError:
+            if estricto or self._activas is None:
+                raise
+            logger.error('La población de normas %s ya no está disponible; se mantiene %s',
+                         self.poblacion, self._activas.clave)
+
+    def _resolver(self, especificacion):
+        poblacion, _, version = especificacion.partition('@')
+        candidatos = [c for _, c in self._por_archivo.values() if c.poblacion == poblacion
+                      and (not version or c.version == int(version))]
+        if not candidatos:
+            raise LookupError(f'No hay normas para la población {especificacion}')
+        return max(candidatos, key=lambda c: c.version)
+
+    def revisar(self):
+        """Recarga los archivos modificados si pasó el intervalo de revisión"""
+        if self._ultima_revision is not None and time.monotonic() - self._ultima_revision < self.intervalo:
+            return
+        with self._lock:
+            if self._activas is None or self._archivos() != {r: f for r, (f, _) in self._por_archivo.items()}:
+                self._cargar(estricto=self._activas is None)
+            else:
+                self._ultima_revision = time.monotonic()
+
+    def activas(self):
+        """Conjunto de normas de la población activa (la versión más alta salvo que se fije con '@')"""
+        self.revisar()
+        return self._activas
+
+    def obtener(self, especificacion):
+        """Conjunto de normas de una población ('nombre' o 'nombre@version')"""
+        self.revisar()
+        return self._resolver(especificacion)
+
+    def conjuntos(self):
+        """Todos los conjuntos cargados, ordenados por población y versión"""
+        self.revisar()
+        return sorted((c for _, c in self._por_archivo.values()), key=lambda c: (c.poblacion, c.version))
+
+
+catalogo = CatalogoNormas()
+
+
+def activas():
+    """Conjunto de normas de la población activa del catálogo global"""
+    return catalogo.activas()
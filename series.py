@@ -0,0 +1,60 @@
+"""
+Reducción de series temporales para gráficos.
+
+``lttb`` elige, de una serie ordenada por tiempo, a lo sumo ``puntos``
+puntos que conservan su forma visual con el algoritmo Largest-Triangle-Three-
+Buckets (Steinarsson, 2013): el primer y el último punto se mantienen y el
+resto de la serie se divide en ``puntos - 2`` tramos de igual cantidad de
+puntos; de cada tramo se elige el punto que forma el triángulo de mayor área
+con el punto elegido en el tramo anterior y el promedio del tramo siguiente.
+Los promedios de todos los tramos y las áreas de cada tramo se calculan con
+NumPy; solo el recorrido de los tramos (cada elección depende de la anterior)
+es secuencial.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+_EPOCA = datetime(1970, 1, 1)
+
+
+def lttb(x, y, puntos):
+    """
+    Índices (crecientes) de los puntos de la serie ``x``, ``y`` elegidos por
+    LTTB. Si la serie tiene ``puntos`` puntos o menos se retornan todos.
+    ``x`` debe ser creciente (por ejemplo, segundos desde una fecha fija).
+    """
+    n = len(x)
+    if n <= puntos:
+        return np.arange(n)
+    if puntos < 3:
+        raise ValueError('LTTB necesita al menos 3 puntos')
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Tramos [bordes[i], bordes[i + 1]) sobre los puntos 1..n-2; el último "tramo" es el punto final
+    bordes = np.append(np.linspace(1, n - 1, puntos - 1).astype(np.int64), n)
+    cantidades = np.diff(bordes)
+    promedios_x = np.add.reduceat(x, bordes[:-1]) / cantidades
+    promedios_y = np.add.reduceat(y, bordes[:-1]) / cantidades
+
+    indices = np.empty(puntos, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    elegido = 0
+    for tramo in range(puntos - 2):
+        inicio, fin = bordes[tramo], bordes[tramo + 1]
+        ax, ay = x[elegido], y[elegido]
+        cx, cy = promedios_x[tramo + 1], promedios_y[tramo + 1]
+        # El doble del área del triángulo (a, punto, c); el factor no cambia el máximo
+        areas = np.abs((ax - cx) * (y[inicio:fin] - ay) - (ax - x[inicio:fin]) * (cy - ay))
+        elegido = inicio + int(areas.argmax())
+        indices[tramo + 1] = elegido
+    return indices
+
+
+def segundos(fechas):
+    """Segundos desde 1970 de una secuencia de datetime sin zona horaria (eje x de ``lttb``)"""
+    # Convertir cada fecha en Python es varias veces más rápido que np.array(dtype='datetime64')
+    return np.array([(fecha - _EPOCA).total_seconds() for fecha in fechas], dtype=float)
@@ -0,0 +1,206 @@
+"""
+Tendencias de peso y grasa corporal.
+
+Suaviza la serie de una métrica y estima su ritmo de cambio con ponderación
+exponencial en el tiempo: un punto medido ``d`` días antes pesa
+``2 ** (-d / vida_media)``, de modo que las mediciones irregulares (varias en
+un día, semanas sin medir) se ponderan por su antigüedad y no por su
+posición en la serie.
+
+- EMA: media ponderada con vida media ``VIDA_MEDIA_EMA`` (la ``ewm`` de
+  pandas con ``times`` y ``adjust=True``).
+- Pendiente: recta de mínimos cuadrados ponderados con vida media
+  ``VIDA_MEDIA_TENDENCIA``.
+- Media móvil: promedio simple de los últimos ``VENTANA_MEDIA_MOVIL`` días.
+
+``suavizar`` calcula las tres para cada punto de una serie con NumPy.
+``estado_serie`` resume una serie en el estado incremental de la tendencia
+(sumas ponderadas respecto de la fecha del último punto), que ``agregar``
+actualiza en O(1) con cada medición nueva, sea posterior o anterior a las
+guardadas. Como los pesos dependen solo de las fechas, agregar puntos de a
+uno o reconstruir el estado desde la serie da el mismo resultado.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+
+import series
+
+VIDA_MEDIA_EMA = 7  # días
+VIDA_MEDIA_TENDENCIA = 28  # días
+VENTANA_MEDIA_MOVIL = 7  # días
+HORIZONTE_PROYECCION = 730  # días: más allá no se informa fecha proyectada
+
+# Largo máximo (en vidas medias) de los tramos de ``_sumas_exponenciales``: 2 ** 256 no desborda
+_TRAMO = 256
+
+# Campos del estado incremental (columnas de TendenciaUsuario)
+CAMPOS_ESTADO = (
+    'registros', 'fecha', 'valor', 'ponderacion_ema', 'suma_ema',
+    'ponderacion', 'suma_x', 'suma_y', 'suma_xx', 'suma_xy',
+)
+
+
+def dias(fechas):
+    """Días desde 1970 (con fracción) de una secuencia de datetime sin zona horaria"""
+    return series.segundos(fechas) / 86400
+
+
+def media_movil(t, y, ventana=VENTANA_MEDIA_MOVIL):
+    """Media de los valores de los ``ventana`` días que terminan en cada punto (``t`` en días, creciente)"""
+    t = np.asarray(t, dtype=float)
+    acumulada = np.concatenate(([0.0], np.cumsum(y, dtype=float)))
+    inicios = np.searchsorted(t, t - ventana, side='right')
+    fines = np.arange(1, len(t) + 1)
+    return (acumulada[fines] - acumulada[inicios]) / (fines - inicios)
+
+
+def _sumas_exponenciales(t, columnas, vida_media):
+    """
+    Para cada punto ``i``, la suma de cada fila de ``columnas`` sobre los
+    puntos ``k <= i`` ponderada por ``2 ** (-(t[i] - t[k]) / vida_media)``.
+
+    Dentro de un tramo de tiempo acotado es una suma acumulada de los valores
+    escalados por ``2 ** ((t[k] - inicio) / vida_media)``; lo acumulado hasta
+    el tramo anterior se arrastra decayendo desde su último punto.
+    """
+    t = np.asarray(t, dtype=float)
+    columnas = np.asarray(columnas, dtype=float)
+    sumas = np.empty_like(columnas)
+    tramos = np.floor((t - t[0]) / (_TRAMO * vida_media))
+    bordes = np.flatnonzero(np.diff(tramos)) + 1
+    for inicio, fin in zip(np.concatenate(([0], bordes)), np.concatenate((bordes, [len(t)]))):
+        escala = np.exp2((t[inicio:fin] - t[inicio]) / vida_media)
+        sumas[:, inicio:fin] = np.cumsum(columnas[:, inicio:fin] * escala, axis=1) / escala
+        if inicio:
+            sumas[:, inicio:fin] += sumas[:, inicio - 1:inicio] * np.exp2(-(t[inicio:fin] - t[inicio - 1]) / vida_media)
+    return sumas
+
+
+def _pendiente(ponderacion, suma_x, suma_y, suma_xx, suma_xy):
+    """Pendiente (por día) de la recta de mínimos cuadrados ponderados; NaN sin dispersión en el tiempo"""
+    determinante = ponderacion * suma_xx - suma_x * suma_x
+    # Varianza ponderada de las fechas menor a ~0,1 s: un único punto con peso apreciable
+    valida = determinante > 1e-12 * ponderacion * ponderacion
+    numerador = ponderacion * suma_xy - suma_x * suma_y
+    if np.ndim(determinante) == 0:
+        # Escalares de Python (el estado incremental): dividir por 0 lanzaría ZeroDivisionError
+        return numerador / determinante if valida else np.nan
+    return np.divide(numerador, determinante, out=np.full_like(determinante, np.nan), where=valida)
+
+
+def suavizar(fechas, valores):
+    """
+    Media móvil, EMA y pendiente semanal de la tendencia en cada punto de una
+    serie ordenada por fecha. Retorna tres arrays del largo de la serie (la
+    pendiente es NaN mientras no hay puntos en fechas distintas).
+    """
+    t = dias(fechas)
+    y = np.asarray(valores, dtype=float)
+    if not len(t):
+        return np.empty(0), np.empty(0), np.empty(0)
+    unos = np.ones_like(y)
+    ponderacion_ema, suma_ema = _sumas_exponenciales(t, [unos, y], VIDA_MEDIA_EMA)
+    # Fechas respecto del primer punto: sumas positivas y de magnitud acotada
+    x = t - t[0]
+    sumas = _sumas_exponenciales(t, [unos, x, y, x * x, x * y], VIDA_MEDIA_TENDENCIA)
+    return media_movil(t, y), suma_ema / ponderacion_ema, _pendiente(*sumas) * 7
+
+
+def estado_inicial():
+    """Estado de una métrica sin mediciones"""
+    return dict.fromkeys(CAMPOS_ESTADO, 0.0) | {'registros': 0, 'fecha': None, 'valor': None}
+
+
+def estado_serie(fechas, valores):
+    """Estado incremental de una serie completa, con las fechas respecto de la última"""
+    estado = estado_inicial()
+    if not len(fechas):
+        return estado
+    t = dias(fechas)
+    y = np.asarray(valores, dtype=float)
+    ultimo = int(t.argmax())
+    x = t - t[ultimo]
+    peso_ema = np.exp2(x / VIDA_MEDIA_EMA)
+    peso = np.exp2(x / VIDA_MEDIA_TENDENCIA)
+    estado.update(
+        registros=len(t), fecha=fechas[ultimo], valor=float(y[ultimo]),
+        ponderacion_ema=float(peso_ema.sum()), suma_ema=float(peso_ema @ y),
+        ponderacion=float(peso.sum()), suma_x=float(peso @ x), suma_y=float(peso @ y),
+        suma_xx=float(peso @ (x * x)), suma_xy=float(peso @ (x * y)),
+    )
+    return estado
+
+
+def agregar(estado, fecha, valor):
+    """
+    Agrega una medición al estado (en el lugar). Si es la más reciente, las
+    sumas se trasladan a su fecha y decaen según el tiempo transcurrido; si
+    es anterior, se suma con el peso que le corresponde por su antigüedad.
+    """
+    if estado['fecha'] is None:
+        estado['fecha'] = fecha
+    x = (fecha - estado['fecha']).total_seconds() / 86400
+    if x > 0:
+        decaimiento_ema = 2 ** (-x / VIDA_MEDIA_EMA)
+        decaimiento = 2 ** (-x / VIDA_MEDIA_TENDENCIA)
+        ponderacion, suma_x, suma_y = estado['ponderacion'], estado['suma_x'], estado['suma_y']
+        estado.update(
+            fecha=fecha, valor=valor,
+            ponderacion_ema=estado['ponderacion_ema'] * decaimiento_ema,
+            suma_ema=estado['suma_ema'] * decaimiento_ema,
+            ponderacion=ponderacion * decaimiento,
+            suma_x=(suma_x - x * ponderacion) * decaimiento,
+            suma_y=suma_y * decaimiento,
+            suma_xx=(estado['suma_xx'] - 2 * x * suma_x + x * x * ponderacion) * decaimiento,
+            suma_xy=(estado['suma_xy'] - x * suma_y) * decaimiento,
+        )
+        x = 0.0
+    elif x == 0:
+        estado['valor'] = valor
+    peso_ema = 2 ** (x / VIDA_MEDIA_EMA)
+    peso = 2 ** (x / VIDA_MEDIA_TENDENCIA)
+    estado['registros'] += 1
+    estado['ponderacion_ema'] += peso_ema
+    estado['suma_ema'] += peso_ema * valor
+    estado['ponderacion'] += peso
+    estado['suma_x'] += peso * x
+    estado['suma_y'] += peso * valor
+    estado['suma_xx'] += peso * x * x
+    estado['suma_xy'] += peso * x * valor
+    return estado
+
+
+def resumen(estado, objetivo=None):
+    """
+    Tendencia actual de una métrica: fecha y valor de la última medición, EMA,
+    valor de la recta de tendencia a esa fecha y cambio por semana. Con un
+    ``objetivo``, la fecha en que la recta lo alcanza (None si la tendencia se
+    aleja de él o tardaría más de ``HORIZONTE_PROYECCION`` días).
+    """
+    if not estado['registros']:
+        return None
+    pendiente = float(_pendiente(*(estado[c] for c in ('ponderacion', 'suma_x', 'suma_y', 'suma_xx', 'suma_xy'))))
+    tendencia = None
+    if not np.isnan(pendiente):
+        # Valor de la recta en x = 0 (la fecha de la última medición)
+        tendencia = (estado['suma_y'] - pendiente * estado['suma_x']) / estado['ponderacion']
+    datos = {
+        'fecha': estado['fecha'],
+        'valor': estado['valor'],
+        'registros': estado['registros'],
+        'ema': estado['suma_ema'] / estado['ponderacion_ema'],
+        'valor_tendencia': tendencia,
+        'cambio_semanal': None if tendencia is None else pendiente * 7,
+    }
+    if objetivo is not None:
+        datos['objetivo'] = objetivo
+        datos['fecha_objetivo'] = None
+        # Solo si la tendencia va desde la última medición hacia el objetivo; si la recta ya lo
+        # pasó, se alcanzaría en la fecha de la última medición
+        if tendencia is not None and pendiente * (objetivo - estado['valor']) > 0:
+            dias_objetivo = max((objetivo - tendencia) / pendiente, 0)
+            if dias_objetivo <= HORIZONTE_PROYECCION:
+                datos['fecha_objetivo'] = estado['fecha'] + timedelta(days=dias_objetivo)
+    return datos
@@ -0,0 +1,37 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import Usuario, create_app, db, inicializar_base_datos  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Aplicación con una base en memoria, sin caché y con los trabajos en el hilo de la petición"""
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'CACHE_BACKEND': 'ninguna',
+        'TRABAJOS_HILOS': 0,
+        'TRABAJOS_DIRECTORIO': str(tmp_path / 'trabajos'),
+        'METRICAS_HABILITADAS': False,
+    })
+    with app.app_context():
+        inicializar_base_datos()
+        yield app
+
+
+@pytest.fixture
+def cliente(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def usuario(app):
+    usuario = Usuario(nombre='Ana', apellido='Pérez', fecha_nacimiento=date(1995, 5, 10), genero='F', altura=1.65)
+    db.session.add(usuario)
+    db.session.commit()
+    return usuario
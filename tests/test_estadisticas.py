@@ -0,0 +1,40 @@
+import pytest
+
+PLIEGUES = {
+    f'pliegue_{sitio}_{toma}': valor
+    for sitio, valor in (('tricipital', '12'), ('subescapular', '10'), ('suprailiaco', '9'), ('abdominal', '14'))
+    for toma in (1, 2, 3)
+}
+
+
+def nuevo_registro(cliente, usuario, fecha, peso, **campos):
+    respuesta = cliente.post(f'/nuevo_registro/{usuario.id}', data={
+        'fecha_muestra': fecha, 'hora_muestra': '08:00', 'peso': str(peso), 'altura': '1.65', **campos,
+    })
+    assert respuesta.status_code == 302
+    assert respuesta.headers['Location'].endswith(f'/usuario/{usuario.id}')
+
+
+@pytest.mark.parametrize('con_pliegues', [False, True])
+def test_un_registro(cliente, usuario, con_pliegues):
+    nuevo_registro(cliente, usuario, '2024-03-01', 62.5, **(PLIEGUES if con_pliegues else {}))
+
+    assert cliente.get(f'/estadisticas/{usuario.id}').status_code == 200
+    respuesta = cliente.get(f'/api/tendencias/{usuario.id}')
+    assert respuesta.status_code == 200
+    peso = respuesta.get_json()['peso']
+    assert peso['registros'] == 1
+    assert peso['cambio_semanal'] is None
+
+
+def test_varios_pesajes_y_un_registro_con_pliegues(cliente, usuario):
+    for dia, peso in enumerate((63.0, 62.6, 62.4, 62.1), start=1):
+        nuevo_registro(cliente, usuario, f'2024-03-{dia:02d}', peso)
+    nuevo_registro(cliente, usuario, '2024-03-05', 61.9, **PLIEGUES)
+
+    assert cliente.get(f'/estadisticas/{usuario.id}').status_code == 200
+    datos = cliente.get(f'/api/tendencias/{usuario.id}').get_json()
+    assert datos['peso']['registros'] == 5
+    assert datos['peso']['cambio_semanal'] < 0
+    assert datos['porcentaje_grasa']['registros'] == 1
+    assert datos['porcentaje_grasa']['cambio_semanal'] is None
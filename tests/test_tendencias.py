@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import tendencias
+
+
+def test_resumen_un_punto():
+    datos = tendencias.resumen(tendencias.estado_serie([datetime(2024, 1, 1)], [80.0]), objetivo=75.0)
+    assert datos['registros'] == 1
+    assert datos['ema'] == 80.0
+    assert datos['valor_tendencia'] is None
+    assert datos['cambio_semanal'] is None
+    assert datos['fecha_objetivo'] is None
+
+
+def test_resumen_puntos_en_la_misma_fecha():
+    fecha = datetime(2024, 1, 1, 8, 30)
+    estado = tendencias.estado_serie([fecha] * 3, [80.0, 81.0, 79.0])
+    datos = tendencias.resumen(estado)
+    assert datos['registros'] == 3
+    assert datos['ema'] == pytest.approx(80.0)
+    assert datos['cambio_semanal'] is None
+
+    # El estado incremental con los mismos puntos da el mismo resultado
+    incremental = tendencias.estado_inicial()
+    for valor in (80.0, 81.0, 79.0):
+        tendencias.agregar(incremental, fecha, valor)
+    assert tendencias.resumen(incremental)['cambio_semanal'] is None
+
+
+def test_suavizar_sin_dispersion_en_el_tiempo():
+    fechas = [datetime(2024, 1, 1), datetime(2024, 1, 1), datetime(2024, 1, 8)]
+    _, _, cambios = tendencias.suavizar(fechas, [80.0, 81.0, 79.0])
+    assert np.isnan(cambios[:2]).all()
+    assert cambios[2] == pytest.approx(-1.5)
+
+
+def test_resumen_tendencia_lineal():
+    fechas = [datetime(2024, 1, d) for d in range(1, 29)]
+    valores = [80.0 - 0.1 * i for i in range(len(fechas))]
+    datos = tendencias.resumen(tendencias.estado_serie(fechas, valores), objetivo=75.0)
+    assert datos['cambio_semanal'] == pytest.approx(-0.7)
+    assert datos['valor_tendencia'] == pytest.approx(valores[-1])
+    assert datos['fecha_objetivo'] is not None
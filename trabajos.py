@@ -0,0 +1,89 @@
+"""
+Ejecución de trabajos en segundo plano.
+
+Las importaciones grandes se registran como trabajos persistidos en la base
+de datos y se procesan en un pool de hilos del proceso que recibió el
+archivo, de modo que la petición HTTP responde de inmediato. El estado y el
+progreso de cada trabajo viven en su fila, por lo que cualquier worker puede
+consultarlo o pedir su cancelación; el proceso que lo ejecuta revisa el pedido
+de cancelación después de cada lote, y renueva en la fila su latido: un
+trabajo activo sin latido reciente quedó huérfano (su proceso terminó) y se
+marca como interrumpido desde cualquier máquina.
+"""
+
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PENDIENTE = 'pendiente'
+EN_CURSO = 'en_curso'
+COMPLETADO = 'completado'
+CANCELADO = 'cancelado'
+ERROR = 'error'
+INTERRUMPIDO = 'interrumpido'
+
+ESTADOS_ACTIVOS = (PENDIENTE, EN_CURSO)
+
+# Máquina de este proceso; con el pid identifica quién ejecuta cada trabajo
+HOST = socket.gethostname()
+
+
+class TrabajoCancelado(Exception):
+    """Se pidió cancelar el trabajo en curso"""
+
+
+class EjecutorTrabajos:
+    """
+    Pool de hilos para trabajos en segundo plano.
+
+    El pool se crea en cada proceso con el primer trabajo (los hilos no
+    sobreviven a un fork, y con ``preload_app`` el maestro de gunicorn no debe
+    tener hilos propios). Con ``hilos=0`` los trabajos se ejecutan en el hilo
+    que los envía, por ejemplo en pruebas con una base en memoria.
+    """
+
+    def __init__(self, hilos=2):
+        self.hilos = hilos
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def enviar(self, funcion, *argumentos):
+        if self.hilos <= 0:
+            funcion(*argumentos)
+            return None
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.hilos, thread_name_prefix='trabajo')
+                self._pid = os.getpid()
+        return self._pool.submit(self._ejecutar, funcion, argumentos)
+
+    def cerrar(self, esperar=True):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown(wait=esperar)
+            self._pool = None
+
+    @staticmethod
+    def _ejecutar(funcion, argumentos):
+        try:
+            funcion(*argumentos)
+        except Exception:
+            logger.exception('Error no controlado en un trabajo en segundo plano')
+
+
+def proceso_vivo(pid):
+    """Indica si existe un proceso con ese pid en esta máquina"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True